@@ -0,0 +1,76 @@
+/* Subtext/ConditionalGet.cs
+
+This file is part of the Subtext server.
+
+Subtext is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Subtext is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Subtext. If not, see <https://www.gnu.org/licenses/>.
+*/
+
+using System;
+using System.Linq;
+using System.Text;
+using System.Security.Cryptography;
+using Microsoft.AspNetCore.Http;
+using Microsoft.AspNetCore.Http.Headers;
+using Microsoft.AspNetCore.Mvc;
+using Microsoft.Net.Http.Headers;
+
+namespace Subtext {
+	
+	// ETag / Last-Modified support for GET endpoints that rarely change.
+	// Always call this AFTER checking the session and permissions, so a 304
+	// never tells anyone something they couldn't have fetched anyway.
+	public static class ConditionalGet {
+		
+		// Weak ETag over the values a response is built from. Anything that
+		// changes the response body (including what the caller is allowed
+		// to see) must be one of the parts.
+		public static EntityTagHeaderValue MakeETag(params object[] parts) {
+			string joined = string.Join("|", parts.Select(part => part is DateTime dt ? dt.Ticks.ToString() : (part ?? "").ToString()));
+			byte[] hash;
+			using (SHA256 sha = SHA256.Create()) {
+				hash = sha.ComputeHash(Encoding.UTF8.GetBytes(joined));
+			}
+			return new EntityTagHeaderValue("\"" + BitConverter.ToString(hash, 0, 16).Replace("-", "").ToLowerInvariant() + "\"", true);
+		}
+		
+		// Sets the validators on the response, and returns true if the
+		// request's If-None-Match / If-Modified-Since says the client's copy
+		// is still current (the caller should then return a 304).
+		public static bool IsNotModified(this ControllerBase controller, EntityTagHeaderValue etag, DateTime? lastModified = null) {
+			ResponseHeaders response = controller.Response.GetTypedHeaders();
+			RequestHeaders request = controller.Request.GetTypedHeaders();
+			
+			// Responses depend on the session, and must always be revalidated.
+			response.CacheControl = new CacheControlHeaderValue { Private = true, NoCache = true };
+			response.ETag = etag;
+			
+			DateTimeOffset? modified = null;
+			if (lastModified.HasValue) {
+				// The database stores UTC without a kind; HTTP dates have 1s resolution.
+				DateTime utc = DateTime.SpecifyKind(lastModified.Value, DateTimeKind.Utc);
+				modified = new DateTimeOffset(utc.AddTicks(-(utc.Ticks % TimeSpan.TicksPerSecond)));
+				response.LastModified = modified;
+			}
+			
+			// If-None-Match takes precedence over If-Modified-Since (RFC 7232 6)
+			if (request.IfNoneMatch != null && request.IfNoneMatch.Count > 0) {
+				return request.IfNoneMatch.Any(tag => tag.Equals(EntityTagHeaderValue.Any) || tag.Compare(etag, false));
+			}
+			if (modified.HasValue && request.IfModifiedSince.HasValue) {
+				return modified.Value <= request.IfModifiedSince.Value;
+			}
+			return false;
+		}
+	}
+}
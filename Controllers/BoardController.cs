@@ -22,6 +22,7 @@ using System.Linq;
 using System.Threading.Tasks;
 using Microsoft.AspNetCore.Mvc;
 using Microsoft.EntityFrameworkCore;
+using Microsoft.Net.Http.Headers;
 using Subtext.Models;
 using System.Security.Cryptography;
 using System.Text.RegularExpressions;
@@ -230,6 +231,11 @@ namespace Subtext.Controllers {
 				return StatusCode(403, new APIError("NotAuthorized"));
 			}
 			
+			EntityTagHeaderValue etag = ConditionalGet.MakeETag(board.Id, board.Name, board.OwnerId, board.Encryption, board.LastUpdate, board.LastSignificantUpdate, board.IsDirect);
+			if (this.IsNotModified(etag, board.LastUpdate)) {
+				return StatusCode(304);
+			}
+			
 			return StatusCode(200, new {board.Id, board.Name, board.OwnerId, board.Encryption, board.LastUpdate, board.LastSignificantUpdate, board.IsDirect});
 		}
 		
@@ -267,13 +273,22 @@ namespace Subtext.Controllers {
 				return StatusCode(403, new APIError("NotAuthorized"));
 			}
 			
-			return StatusCode(200, await context.MemberRecords
+			List<Guid> members = await context.MemberRecords
 				.Where(mr => mr.BoardId == boardId)
 				.OrderBy(mr => mr.UserId)
 				.Skip(start.GetValueOrDefault(0))
 				.Take(Math.Min(Config.pageSize, count.GetValueOrDefault(Config.pageSize)))
 				.Select(mr => mr.UserId)
-				.ToListAsync());
+				.ToListAsync();
+			
+			// Every posted message bumps LastUpdate too, so the validator is
+			// taken from the member records themselves; like for friends, this
+			// only saves sending the list.
+			if (this.IsNotModified(ConditionalGet.MakeETag(members.Cast<object>().ToArray()))) {
+				return StatusCode(304);
+			}
+			
+			return StatusCode(200, members);
 		}
 		
 		[HttpPost("{boardId}/members")]
@@ -396,6 +411,7 @@ namespace Subtext.Controllers {
 		}
 		
 		[HttpGet("{boardId}/messages")]
+		[Produces("application/json", "application/cbor")]
 		public async Task<ActionResult> GetMessages(
 			Guid sessionId,
 			Guid boardId,
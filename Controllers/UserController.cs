@@ -22,6 +22,7 @@ using System.Linq;
 using System.Threading.Tasks;
 using Microsoft.AspNetCore.Mvc;
 using Microsoft.EntityFrameworkCore;
+using Microsoft.Net.Http.Headers;
 using Subtext.Models;
 using System.Security.Cryptography;
 using System.Text.RegularExpressions;
@@ -300,7 +301,16 @@ namespace Subtext.Controllers {
 				return StatusCode(404, new APIError("NoObjectWithId"));
 			}
 			
-			if (user == session.User || await context.FriendRecords.AnyAsync(fr => fr.Owner == session.User && fr.Friend == user)) {
+			bool isVisible = user == session.User || await context.FriendRecords.AnyAsync(fr => fr.Owner == session.User && fr.Friend == user);
+			
+			// Presence and status can change without LastActive changing, so
+			// only the ETag is used here.
+			EntityTagHeaderValue etag = ConditionalGet.MakeETag(user.Id, user.Name, user.IsDeleted, isVisible, user.Presence, user.LastActive, user.Status);
+			if (this.IsNotModified(etag)) {
+				return StatusCode(304);
+			}
+			
+			if (isVisible) {
 				return StatusCode(200, new {user.Id, user.Name, user.Presence, user.LastActive, user.Status, user.IsDeleted});
 			} else {
 				return StatusCode(200, new {user.Id, user.Name, user.IsDeleted});
@@ -344,13 +354,20 @@ namespace Subtext.Controllers {
 				count = Config.pageSize;
 			}
 			
-			return StatusCode(200, await context.FriendRecords
+			List<Guid> friends = await context.FriendRecords
 				.Where(fr => fr.OwnerId == userId)
 				.OrderBy(fr => fr.FriendId)
 				.Skip(start.GetValueOrDefault(0))
 				.Take(Math.Min(Config.pageSize, count.GetValueOrDefault(Config.pageSize)))
 				.Select(fr => fr.FriendId)
-				.ToListAsync());
+				.ToListAsync();
+			
+			// Friend records have no timestamp, so this only saves sending the list.
+			if (this.IsNotModified(ConditionalGet.MakeETag(friends.Cast<object>().ToArray()))) {
+				return StatusCode(304);
+			}
+			
+			return StatusCode(200, friends);
 		}
 		
 		[HttpDelete("{userId}/friends/{friendId}")]
@@ -0,0 +1,221 @@
+/* Subtext/Formatters/CborOutputFormatter.cs
+
+This file is part of the Subtext server.
+
+Subtext is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Subtext is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Subtext. If not, see <https://www.gnu.org/licenses/>.
+*/
+
+using System;
+using System.Collections;
+using System.Globalization;
+using System.IO;
+using System.Reflection;
+using System.Text;
+using System.Threading.Tasks;
+using Microsoft.AspNetCore.Mvc.Formatters;
+using Microsoft.Net.Http.Headers;
+
+namespace Subtext.Formatters {
+	// Writes lists (e.g. message pages) as CBOR (RFC 7049) for clients that
+	// ask for application/cbor, so byte arrays are sent as raw byte strings
+	// instead of base64. The layout matches the JSON output: camelCase
+	// property names, enums as ordinals, and DateTimes as the same ISO 8601
+	// strings. Guids are byte strings tagged 37 (RFC 4122 byte order).
+	// Anything else, including errors, is still written as JSON.
+	public class CborOutputFormatter : OutputFormatter {
+		
+		private const int MaxDepth = 32;
+		
+		public CborOutputFormatter() {
+			SupportedMediaTypes.Add(MediaTypeHeaderValue.Parse("application/cbor"));
+		}
+		
+		public override bool CanWriteResult(OutputFormatterCanWriteContext context) {
+			// Only when asked for by Accept, never as the fallback for clients
+			// that accept anything
+			if (!context.ContentType.HasValue) {
+				return false;
+			}
+			return base.CanWriteResult(context);
+		}
+		
+		protected override bool CanWriteType(Type type) {
+			return type != null && type != typeof(string) && type != typeof(byte[]) && typeof(IEnumerable).IsAssignableFrom(type);
+		}
+		
+		public override async Task WriteResponseBodyAsync(OutputFormatterWriteContext context) {
+			using (MemoryStream stream = new MemoryStream()) {
+				WriteValue(stream, context.Object, 0);
+				stream.Position = 0;
+				await stream.CopyToAsync(context.HttpContext.Response.Body);
+			}
+		}
+		
+		private static void WriteHead(Stream stream, int major, ulong value) {
+			byte type = (byte) (major << 5);
+			if (value < 24) {
+				stream.WriteByte((byte) (type | (byte) value));
+			} else if (value <= byte.MaxValue) {
+				stream.WriteByte((byte) (type | 24));
+				stream.WriteByte((byte) value);
+			} else if (value <= ushort.MaxValue) {
+				stream.WriteByte((byte) (type | 25));
+				WriteBigEndian(stream, value, 2);
+			} else if (value <= uint.MaxValue) {
+				stream.WriteByte((byte) (type | 26));
+				WriteBigEndian(stream, value, 4);
+			} else {
+				stream.WriteByte((byte) (type | 27));
+				WriteBigEndian(stream, value, 8);
+			}
+		}
+		
+		private static void WriteBigEndian(Stream stream, ulong value, int size) {
+			for (int i = size - 1; i >= 0; i--) {
+				stream.WriteByte((byte) (value >> (i * 8)));
+			}
+		}
+		
+		private static void WriteInteger(Stream stream, long value) {
+			if (value >= 0) {
+				WriteHead(stream, 0, (ulong) value);
+			} else {
+				WriteHead(stream, 1, (ulong) (-1 - value));
+			}
+		}
+		
+		private static void WriteText(Stream stream, string value) {
+			byte[] data = Encoding.UTF8.GetBytes(value);
+			WriteHead(stream, 3, (ulong) data.Length);
+			stream.Write(data, 0, data.Length);
+		}
+		
+		private static void WriteGuid(Stream stream, Guid value) {
+			// Guid.ToByteArray puts the first three fields in little-endian order
+			byte[] data = value.ToByteArray();
+			Array.Reverse(data, 0, 4);
+			Array.Reverse(data, 4, 2);
+			Array.Reverse(data, 6, 2);
+			WriteHead(stream, 6, 37);
+			WriteHead(stream, 2, (ulong) data.Length);
+			stream.Write(data, 0, data.Length);
+		}
+		
+		private static string FormatDateTime(DateTime value) {
+			// Same as System.Text.Json: round-trip format, trailing zeros trimmed
+			string text = value.ToString("yyyy'-'MM'-'dd'T'HH':'mm':'ss.FFFFFFF", CultureInfo.InvariantCulture);
+			if (value.Kind == DateTimeKind.Utc) {
+				return text + "Z";
+			}
+			if (value.Kind == DateTimeKind.Local) {
+				return text + value.ToString("zzz", CultureInfo.InvariantCulture);
+			}
+			return text;
+		}
+		
+		private static string PropertyName(string name) {
+			return char.ToLowerInvariant(name[0]) + name.Substring(1);
+		}
+		
+		private static void WriteValue(Stream stream, object value, int depth) {
+			if (depth > MaxDepth) {
+				throw new InvalidOperationException("Object graph too deep to serialize");
+			}
+			
+			switch (value) {
+				case null:
+					stream.WriteByte(0xf6);
+					return;
+				case bool b:
+					stream.WriteByte(b ? (byte) 0xf5 : (byte) 0xf4);
+					return;
+				case string s:
+					WriteText(stream, s);
+					return;
+				case byte[] data:
+					WriteHead(stream, 2, (ulong) data.Length);
+					stream.Write(data, 0, data.Length);
+					return;
+				case Guid guid:
+					WriteGuid(stream, guid);
+					return;
+				case DateTime dateTime:
+					WriteText(stream, FormatDateTime(dateTime));
+					return;
+				case DateTimeOffset dateTimeOffset:
+					WriteText(stream, dateTimeOffset.ToString("o", CultureInfo.InvariantCulture));
+					return;
+				case Enum e:
+					// Enums are written as their ordinal, like the JSON output
+					WriteInteger(stream, Convert.ToInt64(e, CultureInfo.InvariantCulture));
+					return;
+				case ulong ul:
+					WriteHead(stream, 0, ul);
+					return;
+				case sbyte _:
+				case byte _:
+				case short _:
+				case ushort _:
+				case int _:
+				case uint _:
+				case long _:
+					WriteInteger(stream, Convert.ToInt64(value, CultureInfo.InvariantCulture));
+					return;
+				case float _:
+				case double _:
+				case decimal _:
+					stream.WriteByte(0xfb);
+					WriteBigEndian(stream, (ulong) BitConverter.DoubleToInt64Bits(Convert.ToDouble(value, CultureInfo.InvariantCulture)), 8);
+					return;
+				case IDictionary dictionary:
+					WriteHead(stream, 5, (ulong) dictionary.Count);
+					foreach (DictionaryEntry entry in dictionary) {
+						WriteText(stream, entry.Key.ToString());
+						WriteValue(stream, entry.Value, depth + 1);
+					}
+					return;
+				case ICollection collection:
+					WriteHead(stream, 4, (ulong) collection.Count);
+					foreach (object item in collection) {
+						WriteValue(stream, item, depth + 1);
+					}
+					return;
+				case IEnumerable enumerable:
+					// Indefinite-length array
+					stream.WriteByte(0x9f);
+					foreach (object item in enumerable) {
+						WriteValue(stream, item, depth + 1);
+					}
+					stream.WriteByte(0xff);
+					return;
+			}
+			
+			PropertyInfo[] properties = value.GetType().GetProperties(BindingFlags.Public | BindingFlags.Instance);
+			int count = 0;
+			foreach (PropertyInfo property in properties) {
+				if (property.CanRead && property.GetIndexParameters().Length == 0) {
+					count++;
+				}
+			}
+			WriteHead(stream, 5, (ulong) count);
+			foreach (PropertyInfo property in properties) {
+				if (property.CanRead && property.GetIndexParameters().Length == 0) {
+					WriteText(stream, PropertyName(property.Name));
+					WriteValue(stream, property.GetValue(value), depth + 1);
+				}
+			}
+		}
+	
+	}
+}
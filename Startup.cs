@@ -54,6 +54,8 @@ namespace Subtext {
 			services.AddMvc((MvcOptions opt) => {
 				opt.InputFormatters.Insert(0, new Subtext.Formatters.BinaryInputFormatter());
 				opt.OutputFormatters.Insert(0, new Subtext.Formatters.BinaryOutputFormatter());
+				// After the JSON formatter, so it is only used when asked for
+				opt.OutputFormatters.Add(new Subtext.Formatters.CborOutputFormatter());
 			});
 			
 			services.AddControllers();
@@ -2,48 +2,225 @@
 """
 python library for TESTING PURPOSES ONLY
 """
-import requests
+from typing import Any, Dict, Optional
+import importlib, threading
 
 from . import admin
 from . import user
 from . import key
 from . import board
-from .common import _assert_compatibility, VersionError, APIError, PagedList, Translator
+from .common import _assert_compatibility, VersionError, APIError, PagedList, Translator, AboutCache, message_content
+from .transport import Transport
+from .metrics import Instrumentation, RequestInfo, HistogramCollector, prometheus_text
 
 VERSION = "0.1.0"
 
 class Subtext:
 	"""
 	Subtext main API class.
+	
+	With typed=True, boards, users, messages, member records, key records
+	and audit log entries are returned as subtext.models objects instead of
+	plain dicts.
+	
+	By default the server is probed and its version checked on
+	construction. With lazy=True this is deferred until the first API
+	object is used, and the transport is only created when needed, so
+	constructing a client makes no requests. With about_cache=True (or a
+	file path), about() results are cached on disk per URL for
+	about_cache_ttl seconds and a fresh entry replaces the probe.
+	
+	With http_cache=True (or an SQLite file path, or a shared
+	subtext.HTTPCache), boards, users, member and friend lists are cached
+	and revalidated with conditional GETs, so unchanged ones cost a 304.
+	
+	With flow_control=True (or a shared subtext.FlowController), requests
+	are rate limited and their concurrency adapted to the server's latency
+	and overload responses. With coalesce=True (or a shared
+	subtext.SingleFlight), identical GETs made at the same time by several
+	threads are sent once and share the response.
+	
+	With binary_messages=True, message pages are requested as CBOR, so
+	contents arrive as memoryviews of the raw bytes instead of base64 (use
+	message_content() to read either); servers without CBOR support answer
+	with JSON as before. This trades CPU for bandwidth: pages of binary
+	contents are about a quarter smaller, but the pure-Python CBOR decoder
+	only keeps up with json and base64 once contents average around 1 KiB,
+	and is several times slower on short messages (see decode.dicts and
+	decode.cbor in subtext.bench).
 	"""
 	def __init__(self, url: str, **config):
 		self.url = url.rstrip("/")
-		resp = requests.get(self.url)
-		if resp.status_code != 200 or resp.text.strip().capitalize() != 'Subtext':
-			raise ValueError("Could not detect a valid Subtext server at {}".format(self.url))
-		
-		self.version = self.about()['version']
-		_assert_compatibility(self.version, VERSION, is_module=True)
 		
 		self.config = {
 			'secret_size': 32,
 			'pbkdf2_iterations': 10000,
+			'pool_size': 10,
+			'timeout': 10.0,
+			'max_retries': 3,
+			'backoff_factor': 0.5,
+			'page_size': 100,
+			'session_duration': 900,
+			'admin_session_duration': 120,
+			'typed': False,
+			'http_cache': None,
+			'http_cache_size': 1024,
+			'http_cache_bytes': 8 * 1024 * 1024,
+			'flow_control': None,
+			'coalesce': None,
+			'binary_messages': False,
+			'lazy': False,
+			'about_cache': None,
+			'about_cache_ttl': 3600.0,
 		}
 		self.config.update(config)
 		
-		self.admin = admin.AdminAPI(self.url, self.version, **self.config)
-		self.user = user.UserAPI(self.url, self.version, **self.config)
-		self.key = key.KeyAPI(self.url, self.version, **self.config)
-		self.board = board.BoardAPI(self.url, self.version, **self.config)
+		self.lock = threading.RLock()
+		self._transport: Optional[Transport] = None
+		self._version: Optional[str] = None
+		self._apis: Dict[str, Any] = {}
+		
+		self.about_cache = None
+		if self.config['about_cache']:
+			path = self.config['about_cache'] if isinstance(self.config['about_cache'], str) else None
+			self.about_cache = AboutCache(path, self.config['about_cache_ttl'])
+		
+		if not self.config['lazy']:
+			self.connect()
+	
+	@property
+	def transport(self) -> Transport:
+		if self._transport is None:
+			with self.lock:
+				if self._transport is None:
+					self._transport = Transport(**self.config)
+		return self._transport
+	
+	@property
+	def instrumentation(self) -> Instrumentation:
+		return self.transport.instrumentation
+	
+	@property
+	def version(self) -> str:
+		return self._version or self.connect()
+	
+	def connect(self) -> str:
+		"""
+		Check that the URL points at a compatible Subtext server and return
+		its version. Only talks to the server the first time, and not at all
+		if the about cache has a fresh entry.
+		"""
+		with self.lock:
+			if self._version is not None:
+				return self._version
+			
+			info = self.about_cache.get(self.url) if self.about_cache is not None else None
+			if info is not None:
+				try:
+					_assert_compatibility(info['version'], VERSION, is_module=True)
+				except (VersionError, KeyError, TypeError):
+					# Stale entry from before a server upgrade
+					self.about_cache.invalidate(self.url)
+					info = None
+			if info is None:
+				resp = self.transport.get(self.url)
+				if resp.status_code != 200 or resp.text.strip().capitalize() != 'Subtext':
+					raise ValueError("Could not detect a valid Subtext server at {}".format(self.url))
+				info = self.about()
+			
+			_assert_compatibility(info['version'], VERSION, is_module=True)
+			self._version = info['version']
+			return self._version
+	
+	def _api(self, name: str, cls: type) -> Any:
+		api = self._apis.get(name)
+		if api is None:
+			version = self.connect()
+			with self.lock:
+				api = self._apis.get(name)
+				if api is None:
+					api = self._apis[name] = cls(self.url, version, self.transport, **self.config)
+		return api
+	
+	@property
+	def admin(self) -> admin.AdminAPI:
+		return self._api('admin', admin.AdminAPI)
+	
+	@property
+	def user(self) -> user.UserAPI:
+		return self._api('user', user.UserAPI)
+	
+	@property
+	def key(self) -> key.KeyAPI:
+		return self._api('key', key.KeyAPI)
+	
+	@property
+	def board(self) -> board.BoardAPI:
+		return self._api('board', board.BoardAPI)
+	
+	def close(self):
+		"""
+		Close the shared transport and its pooled connections.
+		"""
+		if self._transport is not None:
+			self._transport.close()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
 	
 	def about(self):
 		"""
 		Retrieve server information.
 		"""
-		resp = requests.get(self.url + "/Subtext")
+		resp = self.transport.get(self.url + "/Subtext")
 		if resp.status_code // 100 != 2:
 			if resp.headers['Content-Type'] == 'application/json':
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		info = resp.json()
+		if self.about_cache is not None:
+			self.about_cache.put(self.url, info)
+		return info
+
+# Names imported from their modules on first access, to keep importing
+# the package cheap. The asyncio client also needs aiohttp.
+_LAZY = {
+	'AsyncSubtext': '.aio',
+	'BoardSync': '.sync',
+	'BoardWatcher': '.watch',
+	'BoardChange': '.watch',
+	'SearchIndex': '.search',
+	'GPGPipeline': '.gpg',
+	'SharedKeyCodec': '.sharedkey',
+	'MessageCompressor': '.compress',
+	'AuditLogExporter': '.export',
+	'FlowController': '.flow',
+	'Budget': '.flow',
+	'SingleFlight': '.coalesce',
+	'NameResolver': '.resolve',
+	'BodyFetcher': '.fetch',
+	'KeyCache': '.keycache',
+	'SessionManager': '.session',
+	'UserSessionManager': '.session',
+	'AdminSessionManager': '.session',
+	'Message': '.models',
+	'MessagePage': '.models',
+	'Board': '.models',
+	'User': '.models',
+	'MemberRecord': '.models',
+	'PublicKey': '.models',
+	'AuditLogEntry': '.models',
+	'HTTPCache': '.httpcache',
+}
+
+def __getattr__(name: str):
+	module = _LAZY.get(name)
+	if module is None:
+		raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+	value = getattr(importlib.import_module(module, __name__), name)
+	globals()[name] = value
+	return value
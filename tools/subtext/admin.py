@@ -2,27 +2,62 @@
 """
 subtext.admin - Subtext admin API.
 """
-from typing import Optional
-import requests, base64, hashlib
+from typing import Dict, Iterable, Optional, Tuple, Union
+import base64, hashlib, os, threading, time
+import concurrent.futures
 from uuid import UUID
 from datetime import datetime
 
-from .common import _assert_compatibility, VersionError, APIError, PagedList
+from .common import _assert_compatibility, VersionError, APIError, PagedList, _typed
+from .transport import Transport
+
+def derive_response(secret: bytes, challenge: bytes, iterations: int, size: int) -> Tuple[bytes, float]:
+	"""
+	Compute the response to a login challenge.
+	
+	Returns the response and the time the derivation took in seconds.
+	Module level so it can run in a ProcessPoolExecutor.
+	"""
+	start = time.perf_counter()
+	response = hashlib.pbkdf2_hmac('sha1', secret, challenge, iterations, size)
+	return response, time.perf_counter() - start
+
+class KDFStats:
+	"""
+	Timing statistics of the PBKDF2 derivations done for admin logins.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+	
+	def record(self, seconds: float):
+		with self.lock:
+			self.count += 1
+			self.total += seconds
+			self.max = max(self.max, seconds)
+	
+	@property
+	def mean(self) -> float:
+		return self.total / self.count if self.count else 0.0
 
 class AdminAPI:
 	"""
 	Subtext admin API class.
 	"""
-	def __init__(self, url: str, version: str, **config):
+	def __init__(self, url: str, version: str, transport: Transport, **config):
 		self.url = url
 		self.version = version
+		self.transport = transport
 		self.config = config
+		self.kdf_stats = KDFStats()
 	
 	def login_challenge(self, admin_id: UUID):
 		"""
 		Get a login challenge for the admin.
 		"""
-		resp = requests.get(self.url + "/Subtext/admin/login/challenge", params={
+		resp = self.transport.get(self.url + "/Subtext/admin/login/challenge", params={
 			'adminId': admin_id
 		})
 		if resp.status_code // 100 != 2:
@@ -36,7 +71,7 @@ class AdminAPI:
 		"""
 		Respond to the login challenge for the admin.
 		"""
-		resp = requests.post(self.url + "/Subtext/admin/login/response", params={
+		resp = self.transport.post(self.url + "/Subtext/admin/login/response", params={
 			'adminId': admin_id,
 			'response': base64.b64encode(response)
 		})
@@ -47,23 +82,57 @@ class AdminAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
 	
-	def login(self, admin_id: UUID, secret: bytes):
+	def login(self, admin_id: UUID, secret: bytes, executor: Optional[concurrent.futures.Executor] = None):
 		"""
 		Log in as the admin using the given secret.
+		
+		If an executor is given, the PBKDF2 derivation runs on it instead of
+		the calling thread.
 		"""
 		result = self.login_challenge(admin_id)
 		
-		challenge = base64.b64decode(result['challenge'])
-		response = hashlib.pbkdf2_hmac('sha1', secret, challenge, self.config['pbkdf2_iterations'], self.config['secret_size'])
+		# The server sends the challenge and the session ID as bare JSON values
+		challenge = base64.b64decode(result['challenge'] if isinstance(result, dict) else result)
+		args = (secret, challenge, self.config['pbkdf2_iterations'], self.config['secret_size'])
+		if executor is None:
+			response, seconds = derive_response(*args)
+		else:
+			response, seconds = executor.submit(derive_response, *args).result()
+		self.kdf_stats.record(seconds)
 		
 		result = self.login_response(admin_id, response)
-		return UUID(result['sessionId'])
+		return UUID(result['sessionId'] if isinstance(result, dict) else result)
+	
+	def login_many(self, credentials: Iterable[Tuple[UUID, bytes]], max_workers: Optional[int] = None, use_processes: bool = False) -> Dict[UUID, Union[UUID, Exception]]:
+		"""
+		Log in as many admins in parallel.
+		
+		Takes (admin ID, secret) pairs and returns a dict mapping each admin ID
+		to its session ID, or to the exception its login raised. hashlib
+		releases the GIL while deriving, so threads already use all cores;
+		use_processes moves the derivations to a process pool instead.
+		"""
+		max_workers = max_workers or os.cpu_count() or 1
+		results = {}
+		kdf_executor = concurrent.futures.ProcessPoolExecutor(max_workers) if use_processes else None
+		try:
+			with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+				futures = {executor.submit(self.login, admin_id, secret, kdf_executor): admin_id for admin_id, secret in credentials}
+				for future in concurrent.futures.as_completed(futures):
+					try:
+						results[futures[future]] = future.result()
+					except Exception as e:
+						results[futures[future]] = e
+		finally:
+			if kdf_executor is not None:
+				kdf_executor.shutdown()
+		return results
 	
 	def renew(self, session_id: UUID):
 		"""
 		Renew the admin session.
 		"""
-		resp = requests.post(self.url + "/Subtext/admin/renew", params={
+		resp = self.transport.post(self.url + "/Subtext/admin/renew", params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -77,11 +146,10 @@ class AdminAPI:
 		"""
 		Log out of the admin session.
 		"""
-		resp = requests.post(self.url + "/Subtext/admin/logout", params={
+		resp = self.transport.post(self.url + "/Subtext/admin/logout", params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
-			print(resp.headers)
 			if resp.headers['Content-Type'].startswith('application/json'):
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
@@ -92,7 +160,7 @@ class AdminAPI:
 		"""
 		Retrieve audit log entries.
 		"""
-		resp = requests.get(self.url + "/Subtext/admin/auditlog", params={
+		resp = self.transport.get(self.url + "/Subtext/admin/auditlog", params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count,
@@ -106,4 +174,11 @@ class AdminAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		return _typed(self.config, 'AuditLogEntry', resp.json())
+	
+	def iter_audit_log(self, session_id: UUID, action: Optional[str] = None, admin_id: Optional[UUID] = None, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None, **options) -> PagedList:
+		"""
+		Iterate over audit log entries, newest first.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.audit_log(session_id, start, page_size, action, admin_id, start_time, end_time), page_size=page_size, **options)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+subtext.aio - asyncio version of the Subtext API.
+"""
+from typing import Optional
+import aiohttp
+
+from . import admin
+from . import user
+from . import key
+from . import board
+from ..common import _assert_compatibility, VersionError, APIError, PagedList, Translator
+from .transport import AsyncTransport
+
+from .. import VERSION
+
+class AsyncSubtext:
+	"""
+	Subtext main API class (asyncio).
+	
+	The server probe and version check need the event loop, so they happen
+	in connect() instead of the constructor:
+		
+		async with AsyncSubtext(url) as subtext:
+			await subtext.board.get_messages(session_id, board_id)
+	
+	An existing aiohttp.ClientSession can be passed as session, e.g. one
+	pointing at a local stub server in tests.
+	"""
+	def __init__(self, url: str, session: Optional[aiohttp.ClientSession] = None, **config):
+		self.url = url.rstrip("/")
+		
+		self.config = {
+			'secret_size': 32,
+			'pbkdf2_iterations': 10000,
+			'pool_size': 100,
+			'timeout': 10.0,
+			'max_retries': 3,
+			'backoff_factor': 0.5,
+			'page_size': 100,
+			'session_duration': 900,
+			'admin_session_duration': 120,
+			'typed': False,
+			'http_cache': None,
+			'http_cache_size': 1024,
+			'http_cache_bytes': 8 * 1024 * 1024,
+			'flow_control': None,
+			'coalesce': None,
+			'binary_messages': False,
+		}
+		self.config.update(config)
+		
+		self.transport = AsyncTransport(session, **self.config)
+		self.instrumentation = self.transport.instrumentation
+		self.version = None
+	
+	async def connect(self):
+		"""
+		Detect the server and check its version.
+		"""
+		resp = await self.transport.get(self.url)
+		if resp.status_code != 200 or resp.text.strip().capitalize() != 'Subtext':
+			raise ValueError("Could not detect a valid Subtext server at {}".format(self.url))
+		
+		self.version = (await self.about())['version']
+		_assert_compatibility(self.version, VERSION, is_module=True)
+		
+		self.admin = admin.AsyncAdminAPI(self.url, self.version, self.transport, **self.config)
+		self.user = user.AsyncUserAPI(self.url, self.version, self.transport, **self.config)
+		self.key = key.AsyncKeyAPI(self.url, self.version, self.transport, **self.config)
+		self.board = board.AsyncBoardAPI(self.url, self.version, self.transport, **self.config)
+		return self
+	
+	async def close(self):
+		"""
+		Close the shared transport and its pooled connections.
+		"""
+		await self.transport.close()
+	
+	async def __aenter__(self):
+		return await self.connect()
+	
+	async def __aexit__(self, *exc_info):
+		await self.close()
+	
+	async def about(self):
+		"""
+		Retrieve server information.
+		"""
+		resp = await self.transport.get(self.url + "/Subtext")
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'] == 'application/json':
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.admin - Subtext admin API (asyncio).
+"""
+from typing import Dict, Iterable, Optional, Tuple, Union
+import asyncio, base64
+import concurrent.futures
+from uuid import UUID
+from datetime import datetime
+
+from ..common import _assert_compatibility, VersionError, APIError, PagedList, _typed
+from ..admin import derive_response, KDFStats
+from .common import AsyncPagedList
+from .transport import AsyncTransport
+
+class AsyncAdminAPI:
+	"""
+	Subtext admin API class (asyncio).
+	"""
+	def __init__(self, url: str, version: str, transport: AsyncTransport, **config):
+		self.url = url
+		self.version = version
+		self.transport = transport
+		self.config = config
+		self.kdf_stats = KDFStats()
+	
+	async def login_challenge(self, admin_id: UUID):
+		"""
+		Get a login challenge for the admin.
+		"""
+		resp = await self.transport.get(self.url + "/Subtext/admin/login/challenge", params={
+			'adminId': admin_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def login_response(self, admin_id: UUID, response: bytes):
+		"""
+		Respond to the login challenge for the admin.
+		"""
+		resp = await self.transport.post(self.url + "/Subtext/admin/login/response", params={
+			'adminId': admin_id,
+			'response': base64.b64encode(response)
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def login(self, admin_id: UUID, secret: bytes, executor: Optional[concurrent.futures.Executor] = None):
+		"""
+		Log in as the admin using the given secret.
+		
+		The PBKDF2 derivation runs on executor (the loop's default executor
+		if None), so it never blocks the event loop.
+		"""
+		result = await self.login_challenge(admin_id)
+		
+		# The server sends the challenge and the session ID as bare JSON values
+		challenge = base64.b64decode(result['challenge'] if isinstance(result, dict) else result)
+		loop = asyncio.get_running_loop()
+		response, seconds = await loop.run_in_executor(executor, derive_response, secret, challenge, self.config['pbkdf2_iterations'], self.config['secret_size'])
+		self.kdf_stats.record(seconds)
+		
+		result = await self.login_response(admin_id, response)
+		return UUID(result['sessionId'] if isinstance(result, dict) else result)
+	
+	async def login_many(self, credentials: Iterable[Tuple[UUID, bytes]], executor: Optional[concurrent.futures.Executor] = None) -> Dict[UUID, Union[UUID, Exception]]:
+		"""
+		Log in as many admins concurrently.
+		
+		Takes (admin ID, secret) pairs and returns a dict mapping each admin ID
+		to its session ID, or to the exception its login raised. Pass a
+		ProcessPoolExecutor to spread the derivations over processes.
+		"""
+		credentials = list(credentials)
+		results = await asyncio.gather(*(self.login(admin_id, secret, executor) for admin_id, secret in credentials), return_exceptions=True)
+		return {admin_id: result for (admin_id, _), result in zip(credentials, results)}
+	
+	async def renew(self, session_id: UUID):
+		"""
+		Renew the admin session.
+		"""
+		resp = await self.transport.post(self.url + "/Subtext/admin/renew", params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def logout(self, session_id: UUID):
+		"""
+		Log out of the admin session.
+		"""
+		resp = await self.transport.post(self.url + "/Subtext/admin/logout", params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def audit_log(self, session_id: UUID, start: int = 0, count: int = 0, action: Optional[str] = None, admin_id: Optional[UUID] = None, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None):
+		"""
+		Retrieve audit log entries.
+		"""
+		resp = await self.transport.get(self.url + "/Subtext/admin/auditlog", params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count,
+			'action': action,
+			'adminId': admin_id,
+			'startTime': start_time,
+			'endTime': end_time
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return _typed(self.config, 'AuditLogEntry', resp.json())
+	
+	def iter_audit_log(self, session_id: UUID, action: Optional[str] = None, admin_id: Optional[UUID] = None, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None, **options) -> AsyncPagedList:
+		"""
+		Iterate over audit log entries, newest first.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.audit_log(session_id, start, page_size, action, admin_id, start_time, end_time), page_size=page_size, **options)
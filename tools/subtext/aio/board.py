@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.board - Subtext board API (asyncio).
+"""
+from typing import Callable, Optional, Union
+import base64, hashlib
+from uuid import UUID
+from datetime import datetime
+
+from ..common import _assert_compatibility, VersionError, APIError, PagedList, Body, _typed
+from ..board import BoardEncryption
+from .. import cbor
+from .common import AsyncPagedList, _stream_body
+from .transport import AsyncTransport
+
+class AsyncBoardAPI:
+	"""
+	Subtext board API class (asyncio).
+	"""
+	def __init__(self, url: str, version: str, transport: AsyncTransport, **config):
+		self.url = url
+		self.version = version
+		self.transport = transport
+		self.config = config
+	
+	async def create(self, session_id: UUID, name: str, encryption: BoardEncryption = BoardEncryption.gnupg):
+		resp = await self.transport.post(self.url + "/Subtext/board/create", params={
+			'sessionId': session_id,
+			'name': name,
+			'encryption': encryption.value
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def create_direct(self, session_id: UUID, recipient_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/board/createdirect", params={
+			'sessionId': session_id,
+			'recipientId': recipient_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get_boards(self, session_id: UUID, start: Optional[int] = None, count: Optional[int] = None, only_owned: Optional[bool] = None):
+		resp = await self.transport.get(self.url + "/Subtext/board", params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count,
+			'onlyOwned': only_owned
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return _typed(self.config, 'Board', resp.json())
+	
+	def iter_boards(self, session_id: UUID, only_owned: Optional[bool] = None, **options) -> AsyncPagedList:
+		"""
+		Iterate over all boards the user is a member of.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_boards(session_id, start, page_size, only_owned), page_size=page_size, **options)
+	
+	async def get(self, session_id: UUID, board_id: UUID):
+		resp = await self.transport.get(self.url + "/Subtext/board/{}".format(board_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return _typed(self.config, 'Board', resp.json())
+	
+	async def get_members(self, session_id: UUID, board_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
+		resp = await self.transport.get(self.url + "/Subtext/board/{}/members".format(board_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		members = resp.json()
+		if self.config.get('typed'):
+			return _typed(self.config, 'MemberRecord', [{'boardId': str(board_id), 'userId': user_id} for user_id in members])
+		return members
+	
+	def iter_members(self, session_id: UUID, board_id: UUID, **options) -> AsyncPagedList:
+		"""
+		Iterate over the user IDs of all board members.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_members(session_id, board_id, start, page_size), page_size=page_size, **options)
+	
+	async def add_member(self, session_id: UUID, board_id: UUID, user_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/board/{}/members".format(board_id), params={
+			'sessionId': session_id,
+			'userId': user_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def remove_member(self, session_id: UUID, board_id: UUID, user_id: UUID):
+		resp = await self.transport.delete(self.url + "/Subtext/board/{}/members/{}".format(board_id, user_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get_messages(self, session_id: UUID, board_id: UUID, start: Optional[int] = None, count: Optional[int] = None, msg_type: Optional[str] = None, only_system: Optional[bool] = None, since_time: Optional[Union[datetime, str]] = None):
+		resp = await self.transport.get(self.url + "/Subtext/board/{}/messages".format(board_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count,
+			'type': msg_type,
+			'onlySystem': only_system,
+			'sinceTime': since_time
+		}, headers={'Accept': cbor.ACCEPT} if self.config.get('binary_messages') else None)
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		if cbor.is_cbor(resp.headers.get('Content-Type')):
+			return _typed(self.config, 'MessagePage', cbor.loads(resp.content))
+		return _typed(self.config, 'MessagePage', resp.json())
+	
+	def iter_messages(self, session_id: UUID, board_id: UUID, msg_type: Optional[str] = None, only_system: Optional[bool] = None, since_time: Optional[Union[datetime, str]] = None, **options) -> AsyncPagedList:
+		"""
+		Iterate over the messages of a board, newest first.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_messages(session_id, board_id, start, page_size, msg_type, only_system, since_time), page_size=page_size, **options)
+	
+	async def get_message(self, session_id: UUID, board_id: UUID, message_id: UUID):
+		resp = await self.transport.get(self.url + "/Subtext/board/{}/messages/{}".format(board_id, message_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.content
+	
+	async def post_message(self, session_id: UUID, board_id: UUID, content: Body, is_system: bool = False, msg_type: str = "Message", progress: Optional[Callable[[int, Optional[int]], None]] = None):
+		"""
+		Post a message to a board.
+		
+		content can be bytes, a memoryview, a binary file object or a sync or
+		async iterable of chunks; anything but bytes is streamed. progress is
+		called with (bytes sent, total bytes or None) after each chunk.
+		"""
+		resp = await self.transport.post(self.url + "/Subtext/board/{}/messages".format(board_id), params={
+			'sessionId': session_id,
+			'isSystem': is_system,
+			'type': msg_type
+		}, headers={'Content-Type': 'application/octet-stream'}, data=_stream_body(content, progress))
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+
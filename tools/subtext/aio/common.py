@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.common - Common functions and classes (asyncio)
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+import asyncio
+
+from ..common import Body, _body_size
+
+class AsyncPagedList:
+	"""
+	Async iterable that retrieves chunks of values from a coroutine function
+	
+	While one page is being consumed, the next one is already being fetched
+	in a background task. If `page_size` is given, a shorter page is taken as
+	the last one, saving a request for the empty page.
+	"""
+	def __init__(self, callback: Callable[[int], Awaitable[List[Any]]], page_size: Optional[int] = None, prefetch: bool = True, limit: Optional[int] = None):
+		self.__callback = callback
+		self.__page_size = page_size
+		self.__prefetch = prefetch
+		self.__limit = limit
+	def __aiter__(self):
+		return self.__iterate()
+	async def __iterate(self):
+		start = 0
+		pending = None
+		try:
+			while self.__limit is None or start < self.__limit:
+				if pending is not None:
+					page = await pending
+					pending = None
+				else:
+					page = await self.__callback(start)
+				if len(page) <= 0:
+					return
+				last = self.__page_size is not None and len(page) < self.__page_size
+				next_start = start + len(page)
+				if self.__prefetch and not last and (self.__limit is None or next_start < self.__limit):
+					pending = asyncio.ensure_future(self.__callback(next_start))
+				for item in page:
+					if self.__limit is not None and start >= self.__limit:
+						return
+					yield item
+					start += 1
+				if last:
+					return
+		finally:
+			if pending is not None:
+				pending.cancel()
+	async def to_list(self) -> List[Any]:
+		"""
+		Retrieve all items.
+		"""
+		return [item async for item in self]
+
+async def _aiter_body(content: Body, chunk_size: int) -> AsyncIterator[bytes]:
+	if isinstance(content, (bytes, bytearray, memoryview)):
+		view = memoryview(content).cast('B')
+		for offset in range(0, len(view), chunk_size):
+			yield view[offset:offset + chunk_size]
+	elif hasattr(content, 'read'):
+		# Keep blocking file reads off the event loop
+		loop = asyncio.get_running_loop()
+		while True:
+			chunk = await loop.run_in_executor(None, content.read, chunk_size)
+			if not chunk:
+				break
+			yield chunk
+	elif hasattr(content, '__aiter__'):
+		async for chunk in content:
+			yield chunk
+	else:
+		for chunk in content:
+			yield chunk
+
+def _stream_body(content: Body, progress: Optional[Callable[[int, Optional[int]], None]] = None, chunk_size: int = 65536) -> Any:
+	"""
+	Prepare a request body that is sent without being loaded into memory.
+	
+	Same as subtext.common._stream_body, but also accepts async iterables of
+	chunks.
+	"""
+	if isinstance(content, (bytes, bytearray)) and progress is None:
+		return content
+	total = _body_size(content)
+	async def generate():
+		sent = 0
+		async for chunk in _aiter_body(content, chunk_size):
+			yield chunk
+			sent += len(chunk)
+			if progress is not None:
+				progress(sent, total)
+	return generate()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.key - Subtext key API (asyncio).
+"""
+from typing import Tuple
+import json
+from uuid import UUID
+
+from ..common import _assert_compatibility, VersionError, APIError, PagedList
+from .transport import AsyncTransport
+
+class AsyncKeyAPI:
+	"""
+	Subtext key API class (asyncio).
+	"""
+	def __init__(self, url: str, version: str, transport: AsyncTransport, **config):
+		self.url = url
+		self.version = version
+		self.transport = transport
+		self.config = config
+	
+	async def get(self, key_id: UUID):
+		resp = await self.transport.get(self.url + "/Subtext/key/{}".format(key_id))
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.content
+	
+	async def get_with_metadata(self, key_id: UUID) -> Tuple[bytes, dict]:
+		"""
+		Retrieve a public key along with its metadata (Id, PublishTime, OwnerId).
+		"""
+		resp = await self.transport.get(self.url + "/Subtext/key/{}".format(key_id))
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.content, json.loads(resp.headers.get('X-Metadata', '{}'))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.transport - Shared asyncio HTTP transport.
+"""
+from typing import Any, Optional
+from enum import Enum
+import asyncio, collections.abc, json, time
+import aiohttp
+from multidict import CIMultiDict
+
+from ..metrics import Instrumentation, RequestInfo, _error_code, _acounted
+from .. import httpcache, flow, coalesce
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+class Response:
+	"""
+	Fully read HTTP response.
+	
+	Mirrors the parts of requests.Response used by the API classes, so the
+	asynchronous API can handle responses exactly like the synchronous one.
+	"""
+	def __init__(self, status_code: int, headers, content: bytes, encoding: Optional[str] = None):
+		self.status_code = status_code
+		self.headers = headers
+		self.content = content
+		self.encoding = encoding or 'utf-8'
+	
+	@property
+	def text(self) -> str:
+		return self.content.decode(self.encoding, errors='replace')
+	
+	def json(self) -> Any:
+		return json.loads(self.content)
+
+def _encode_param(value: Any) -> str:
+	if isinstance(value, Enum):
+		return str(value.value)
+	if isinstance(value, (bytes, bytearray)):
+		return bytes(value).decode('ascii')
+	return str(value)
+
+def _encode_params(params: Optional[dict]) -> Optional[dict]:
+	# aiohttp only accepts str/int/float query values and does not drop None
+	# like requests does.
+	if params is None:
+		return None
+	return {k: _encode_param(v) for k, v in params.items() if v is not None}
+
+class AsyncTransport:
+	"""
+	Pooled asyncio HTTP transport shared by all API classes of an AsyncSubtext
+	instance.
+	
+	Idempotent requests (GET, PUT, DELETE) are retried with exponential
+	backoff on connection errors, timeouts and 502/503/504 responses.
+	
+	Every request is reported to the hooks registered on instrumentation.
+	
+	If the http_cache option is set, GET responses with an ETag or
+	Last-Modified header are cached and revalidated with conditional
+	requests (see subtext.httpcache).
+	
+	If the flow_control option is set, requests are paced by a
+	subtext.flow.FlowController, and if the coalesce option is set,
+	identical concurrent GETs are merged (see subtext.coalesce). With flow
+	control, retries are made above the controller, so every attempt takes
+	a slot and the controller sees each overload response; 429 responses
+	are retried as well.
+	"""
+	def __init__(self, session: Optional[aiohttp.ClientSession] = None, **config):
+		self.config = config
+		self.instrumentation = Instrumentation()
+		self.cache, self.owns_cache = httpcache.from_config(config)
+		self.flow = flow.from_config(config)
+		self.coalesce = coalesce.from_config(config)
+		self.timeout = config.get('timeout', 10.0)
+		self.max_retries = config.get('max_retries', 3)
+		self.backoff_factor = config.get('backoff_factor', 0.5)
+		self.session = session
+		self.owns_session = session is None
+	
+	def _get_session(self) -> aiohttp.ClientSession:
+		# ClientSession must be created inside a running event loop.
+		if self.session is None:
+			self.session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(limit=self.config.get('pool_size', 100)),
+				timeout=aiohttp.ClientTimeout(total=self.timeout)
+			)
+		return self.session
+	
+	async def request(self, method: str, url: str, params: Optional[dict] = None, **kwargs) -> Response:
+		"""
+		Send a request over the pooled session and read the whole response.
+		"""
+		if self.coalesce is not None and method == 'GET':
+			key = self.coalesce.key(url, params, kwargs.get('headers'))
+			return await self.coalesce.do_async(key, lambda: self._cached(method, url, params, **kwargs))
+		return await self._cached(method, url, params, **kwargs)
+	
+	async def _cached(self, method: str, url: str, params: Optional[dict] = None, **kwargs) -> Response:
+		if self.cache is None or method != 'GET':
+			return await self._flowed(method, url, params, **kwargs)
+		
+		key = self.cache.key(url, params)
+		entry = self.cache.get(key)
+		if entry is not None:
+			kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.validators())
+		resp = await self._flowed(method, url, params, **kwargs)
+		replay = self.cache.handle(key, entry, resp.status_code, resp.headers, resp.content)
+		if replay is not None:
+			headers = CIMultiDict(resp.headers)
+			headers.update(replay.headers)
+			return Response(200, headers, replay.content, resp.encoding)
+		return resp
+	
+	async def _flowed(self, method: str, url: str, params: Optional[dict] = None, **kwargs) -> Response:
+		if self.flow is None:
+			return await self._instrumented(method, url, params, **kwargs)
+		retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+		attempt = 0
+		while True:
+			slot = await self.flow.acquire_async(method, url)
+			start = time.monotonic()
+			resp, status, retry_after = None, 0, None
+			try:
+				resp = await self._instrumented(method, url, params, **kwargs)
+				status, retry_after = resp.status_code, resp.headers.get('Retry-After')
+			except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+				if attempt >= retries:
+					raise
+			finally:
+				self.flow.release(slot, time.monotonic() - start, status, retry_after)
+			if resp is not None and (status not in flow.RETRY_STATUSES or attempt >= retries):
+				return resp
+			# Sleeps without holding a slot; a Retry-After pause is waited
+			# out in acquire_async()
+			await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+			attempt += 1
+	
+	async def _instrumented(self, method: str, url: str, params: Optional[dict] = None, **kwargs) -> Response:
+		if not self.instrumentation.hooks:
+			return await self._request(method, url, params, **kwargs)
+		
+		info = RequestInfo(method, url)
+		data = kwargs.get('data')
+		streamed = isinstance(data, collections.abc.AsyncIterator)
+		if streamed:
+			kwargs['data'] = _acounted(data, info)
+		self.instrumentation.pre_request(info)
+		info.start = time.monotonic()
+		try:
+			resp = await self._request(method, url, params, **kwargs)
+		except Exception as e:
+			info.latency = time.monotonic() - info.start
+			info.error = type(e).__name__
+			self.instrumentation.post_request(info)
+			raise
+		info.latency = time.monotonic() - info.start
+		info.status = resp.status_code
+		if not streamed:
+			info.bytes_out = len(data) if isinstance(data, (bytes, bytearray)) else 0
+		info.bytes_in = len(resp.content)
+		info.error = _error_code(resp.status_code, resp.headers.get('Content-Type', ''), resp.content)
+		self.instrumentation.post_request(info)
+		return resp
+	
+	async def _request(self, method: str, url: str, params: Optional[dict] = None, **kwargs) -> Response:
+		session = self._get_session()
+		params = _encode_params(params)
+		# With flow control, _flowed() retries
+		retries = self.max_retries if method in IDEMPOTENT_METHODS and self.flow is None else 0
+		attempt = 0
+		while True:
+			try:
+				async with session.request(method, url, params=params, **kwargs) as resp:
+					content = await resp.read()
+					if resp.status not in RETRY_STATUSES or attempt >= retries:
+						return Response(resp.status, resp.headers, content, resp.charset)
+			except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+				if attempt >= retries:
+					raise
+			await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+			attempt += 1
+	
+	async def get(self, url: str, **kwargs) -> Response:
+		return await self.request('GET', url, **kwargs)
+	
+	async def post(self, url: str, **kwargs) -> Response:
+		return await self.request('POST', url, **kwargs)
+	
+	async def put(self, url: str, **kwargs) -> Response:
+		return await self.request('PUT', url, **kwargs)
+	
+	async def delete(self, url: str, **kwargs) -> Response:
+		return await self.request('DELETE', url, **kwargs)
+	
+	async def close(self):
+		"""
+		Close all pooled connections.
+		"""
+		if self.session is not None and self.owns_session:
+			await self.session.close()
+		self.session = None
+		if self.owns_cache:
+			self.cache.close()
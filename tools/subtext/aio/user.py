@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+subtext.aio.user - Subtext user API (asyncio).
+"""
+from typing import Callable, List, Optional
+from uuid import UUID
+from datetime import datetime
+
+from ..common import _assert_compatibility, VersionError, APIError, PagedList, Body, _typed
+from ..user import UserPresence
+from .common import AsyncPagedList, _stream_body
+from .transport import AsyncTransport
+
+class AsyncUserAPI:
+	"""
+	Subtext user API class (asyncio).
+	"""
+	def __init__(self, url: str, version: str, transport: AsyncTransport, **config):
+		self.url = url
+		self.version = version
+		self.transport = transport
+		self.config = config
+		# Called with the name and ID of every user created / ID of every
+		# user deleted through this API, e.g. to invalidate caches
+		self.on_create: List[Callable[[str, UUID], None]] = []
+		self.on_delete: List[Callable[[UUID], None]] = []
+	
+	async def create(self, name: str, password: str, public_key: bytes = bytes(0)):
+		resp = await self.transport.post(self.url + "/Subtext/user/create", data=public_key, params={
+			'name': name,
+			'password': password
+		}, headers={'Content-Type': 'application/octet-stream'})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		user_id = resp.json()
+		for callback in self.on_create:
+			callback(name, UUID(str(user_id)))
+		return user_id
+	
+	async def query_id_by_name(self, name: str):
+		resp = await self.transport.get(self.url + "/Subtext/user/queryidbyname", params={
+			'name': name
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def login(self, user_id: UUID, password: str):
+		resp = await self.transport.post(self.url + "/Subtext/user/login", params={
+			'userId': user_id,
+			'password': password
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def heartbeat(self, session_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/user/heartbeat", params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def logout(self, session_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/user/logout", params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get(self, session_id: UUID, user_id: UUID):
+		resp = await self.transport.get(self.url + "/Subtext/user/{}".format(user_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return _typed(self.config, 'User', resp.json())
+	
+	async def get_friends(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
+		resp = await self.transport.get(self.url + "/Subtext/user/{}/friends".format(user_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	def iter_friends(self, session_id: UUID, user_id: UUID, **options) -> AsyncPagedList:
+		"""
+		Iterate over the IDs of all friends of the user.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_friends(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
+	async def remove_friend(self, session_id: UUID, user_id: UUID, friend_id: UUID):
+		resp = await self.transport.delete(self.url + "/Subtext/user/{}/friends/{}".format(user_id, friend_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get_blocked_users(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
+		resp = await self.transport.get(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	def iter_blocked_users(self, session_id: UUID, user_id: UUID, **options) -> AsyncPagedList:
+		"""
+		Iterate over the IDs of all users blocked by the user.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_blocked_users(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
+	async def add_blocked_user(self, session_id: UUID, user_id: UUID, blocked_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
+			'sessionId': session_id,
+			'blockedId': blocked_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def remove_blocked_user(self, session_id: UUID, user_id: UUID, blocked_id: UUID):
+		resp = await self.transport.delete(self.url + "/Subtext/user/{}/blocked/{}".format(user_id, blocked_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get_friend_requests(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
+		resp = await self.transport.get(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	def iter_friend_requests(self, session_id: UUID, user_id: UUID, **options) -> AsyncPagedList:
+		"""
+		Iterate over the IDs of all users who sent the user a friend request.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_friend_requests(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
+	async def send_friend_request(self, session_id: UUID, user_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def accept_friend_request(self, session_id: UUID, user_id: UUID, sender_id: UUID):
+		resp = await self.transport.post(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def reject_friend_request(self, session_id: UUID, user_id: UUID, sender_id: UUID):
+		resp = await self.transport.delete(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
+			'sessionId': session_id
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def get_keys(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
+		resp = await self.transport.get(self.url + "/Subtext/user/{}/keys".format(user_id), params={
+			'sessionId': session_id,
+			'start': start,
+			'count': count
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return _typed(self.config, 'PublicKey', resp.json())
+	
+	def iter_keys(self, session_id: UUID, user_id: UUID, **options) -> AsyncPagedList:
+		"""
+		Iterate over the public key records of the user.
+		"""
+		page_size = self.config['page_size']
+		return AsyncPagedList(lambda start: self.get_keys(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
+	async def add_key(self, session_id: UUID, user_id: UUID, public_key: Body, progress: Optional[Callable[[int, Optional[int]], None]] = None):
+		"""
+		Publish a public key for the user.
+		
+		public_key is streamed like the content in AsyncBoardAPI.post_message.
+		"""
+		resp = await self.transport.post(self.url + "/Subtext/user/{}/keys".format(user_id), data=_stream_body(public_key, progress), params={
+			'sessionId': session_id
+		}, headers={'Content-Type': 'application/octet-stream'})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def set_presence(self, session_id: UUID, user_id: UUID, presence: UserPresence, until_time: Optional[datetime] = None, other_data: str = ""):
+		resp = await self.transport.put(self.url + "/Subtext/user/{}/presence".format(user_id), params={
+			'sessionId': session_id,
+			'presence': presence.value,
+			'untilTime': until_time,
+			'otherData': other_data
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.json()
+	
+	async def delete(self, session_id: UUID, user_id: UUID, password: str):
+		resp = await self.transport.delete(self.url + "/Subtext/user/{}".format(user_id), params={
+			'sessionId': session_id,
+			'password': password
+		})
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		for callback in self.on_delete:
+			callback(user_id)
+		return resp.json()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+subtext.bench - Client micro-benchmarks against the stub server.
+
+Run from the tools directory:
+	
+	python -m subtext.bench -o results.json
+	python -m subtext.bench -o new.json --compare results.json
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse, base64, gc, io, json, math, multiprocessing, os, platform, sys, time, tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from . import Subtext, VERSION
+from .stub import StubServer, StubState, _now
+from .models import MessagePage
+from . import cbor
+
+def seed(state: StubState, messages: int = 1000, members: int = 20, large_every: int = 100) -> Dict[str, Any]:
+	"""
+	Fill a stub server with the data the benchmarks use.
+	
+	Every large_every-th message is bigger than the server's inline limit,
+	so message pages contain some entries without content.
+	"""
+	alice = state.add_user("alice", "password1")
+	bob = state.add_user("bob", "password2")
+	state.add_friends(alice, bob)
+	keys = [state.add_key(alice, os.urandom(1024)) for _ in range(4)]
+	others = [state.add_user("user{}".format(i), "password") for i in range(members - 2)]
+	board = state.add_board(alice, "bench", members=(bob, *others))
+	start = _now() - timedelta(seconds=messages)
+	large = None
+	for i in range(messages):
+		size = state.max_inline_message_size * 32 if i % large_every == large_every - 1 else 200
+		msg_id = state.add_message(board, alice if i % 2 else bob, os.urandom(size), timestamp=start + timedelta(seconds=i))
+		if size > state.max_inline_message_size:
+			large = msg_id
+	admin_id, secret = state.add_admin()
+	for i in range(200):
+		state.log_admin_action(admin_id, "Bench.Action", str(i))
+	return {
+		'alice': alice,
+		'bob': bob,
+		'board': board,
+		'key': keys[0],
+		'large_message': large,
+		'admin_id': admin_id,
+		'admin_secret': secret,
+	}
+
+def _serve(conn, latency: float):
+	# Child process entry point: seed a stub, report its URL, serve until told to stop
+	server = StubServer(latency=latency)
+	ids = seed(server.state)
+	server.start()
+	conn.send((server.url, ids))
+	conn.recv()
+	server.stop()
+
+class BenchContext:
+	"""
+	A client logged in to a seeded stub server.
+	
+	The stub runs in a child process by default, so that its work neither
+	competes with the client for the GIL nor shows up in the allocation
+	figures. With same_process=True it runs on a thread instead.
+	"""
+	def __init__(self, latency: float = 0.0, same_process: bool = False, **config):
+		self.server = None
+		self.process = None
+		if same_process:
+			self.server = StubServer(latency=latency)
+			self.ids = seed(self.server.state)
+			self.server.start()
+			url = self.server.url
+		else:
+			self.conn, child_conn = multiprocessing.Pipe()
+			self.process = multiprocessing.Process(target=_serve, args=(child_conn, latency), daemon=True)
+			self.process.start()
+			url, self.ids = self.conn.recv()
+		self.client = Subtext(url, **config)
+		self.session_id = self.client.user.login(self.ids['alice'], "password1")
+		self.admin_session_id = None
+		self.payload = os.urandom(1024)
+		# A canned page for the decode-only benchmarks
+		self.page_json = self.client.transport.get(url + "/Subtext/board/{}/messages".format(self.ids['board']), params={'sessionId': self.session_id}).content
+		self.page_cbor = self.client.transport.get(url + "/Subtext/board/{}/messages".format(self.ids['board']), params={'sessionId': self.session_id}, headers={'Accept': cbor.ACCEPT}).content
+	
+	def close(self):
+		self.client.close()
+		if self.server is not None:
+			self.server.stop()
+		if self.process is not None:
+			self.conn.send(None)
+			self.process.join()
+
+def _admin_audit_log(ctx: BenchContext) -> Callable[[], Any]:
+	# Admin sessions are short-lived, so log in right before the benchmark
+	if ctx.admin_session_id is None:
+		ctx.admin_session_id = ctx.client.admin.login(ctx.ids['admin_id'], ctx.ids['admin_secret'])
+	return lambda: ctx.client.admin.audit_log(ctx.admin_session_id, 0, 100)
+
+def _admin_login(ctx: BenchContext) -> Callable[[], Any]:
+	def op():
+		session_id = ctx.client.admin.login(ctx.ids['admin_id'], ctx.ids['admin_secret'])
+		ctx.client.admin.logout(session_id)
+	# The server refuses new logins while the admin is logged in
+	if ctx.admin_session_id is not None:
+		ctx.client.admin.logout(ctx.admin_session_id)
+		ctx.admin_session_id = None
+	return op
+
+def _decode_dicts(ctx: BenchContext) -> Callable[[], Any]:
+	def op():
+		for msg in json.loads(ctx.page_json):
+			if msg['content'] is not None:
+				base64.b64decode(msg['content'])
+	return op
+
+def _decode_page(ctx: BenchContext) -> Callable[[], Any]:
+	def op():
+		page = MessagePage(json.loads(ctx.page_json))
+		for i in range(len(page)):
+			page[i].content
+	return op
+
+def _decode_cbor(ctx: BenchContext) -> Callable[[], Any]:
+	def op():
+		for msg in cbor.loads(ctx.page_cbor):
+			if msg['content'] is not None:
+				msg['content']
+	return op
+
+def _shared_key_codec(ctx: BenchContext):
+	from .sharedkey import SharedKeyCodec, generate_key
+	codec = SharedKeyCodec()
+	codec.set_key(ctx.ids['board'], generate_key())
+	# A page of 100 messages of 4 KiB
+	plaintexts = [os.urandom(4096) for _ in range(100)]
+	return codec, plaintexts
+
+def _shared_key_encrypt(ctx: BenchContext) -> Callable[[], Any]:
+	codec, plaintexts = _shared_key_codec(ctx)
+	op = lambda: codec.encrypt_many(ctx.ids['board'], plaintexts)
+	op.bytes_per_op = sum(map(len, plaintexts))
+	return op
+
+def _shared_key_decrypt_many(ctx: BenchContext) -> Callable[[], Any]:
+	codec, plaintexts = _shared_key_codec(ctx)
+	contents = codec.encrypt_many(ctx.ids['board'], plaintexts)
+	op = lambda: codec.decrypt_many(ctx.ids['board'], contents, strict=True)
+	op.bytes_per_op = sum(map(len, plaintexts))
+	return op
+
+def _shared_key_decrypt_page(ctx: BenchContext) -> Callable[[], Any]:
+	# Includes decoding the base64 contents of the JSON page
+	codec, plaintexts = _shared_key_codec(ctx)
+	page = [{'content': base64.b64encode(content).decode('ascii')} for content in codec.encrypt_many(ctx.ids['board'], plaintexts)]
+	op = lambda: codec.decrypt_page(ctx.ids['board'], page, strict=True)
+	op.bytes_per_op = sum(map(len, plaintexts))
+	return op
+
+# name -> (factory, share of the iterations to run)
+# A factory may set bytes_per_op on the operation to get a MB/s figure, and
+# raises ImportError if the benchmark needs an optional dependency that is
+# not installed.
+BENCHMARKS: Dict[str, Tuple[Callable[[BenchContext], Callable[[], Any]], float]] = {
+	'about': (lambda ctx: ctx.client.about, 1),
+	'user.heartbeat': (lambda ctx: lambda: ctx.client.user.heartbeat(ctx.session_id), 1),
+	'user.get': (lambda ctx: lambda: ctx.client.user.get(ctx.session_id, ctx.ids['bob']), 1),
+	'user.get_friends': (lambda ctx: lambda: ctx.client.user.get_friends(ctx.session_id, ctx.ids['alice']), 1),
+	'user.get_keys': (lambda ctx: lambda: ctx.client.user.get_keys(ctx.session_id, ctx.ids['alice']), 1),
+	'key.get': (lambda ctx: lambda: ctx.client.key.get(ctx.ids['key']), 1),
+	'board.get_boards': (lambda ctx: lambda: ctx.client.board.get_boards(ctx.session_id), 1),
+	'board.get': (lambda ctx: lambda: ctx.client.board.get(ctx.session_id, ctx.ids['board']), 1),
+	'board.get_members': (lambda ctx: lambda: ctx.client.board.get_members(ctx.session_id, ctx.ids['board']), 1),
+	'board.get_messages': (lambda ctx: lambda: ctx.client.board.get_messages(ctx.session_id, ctx.ids['board']), 1),
+	'board.iter_messages': (lambda ctx: lambda: sum(1 for _ in ctx.client.board.iter_messages(ctx.session_id, ctx.ids['board'], prefetch=False)), 0.1),
+	'board.get_message': (lambda ctx: lambda: ctx.client.board.get_message(ctx.session_id, ctx.ids['board'], ctx.ids['large_message']), 1),
+	'board.get_message_into': (lambda ctx: lambda: ctx.client.board.get_message_into(ctx.session_id, ctx.ids['board'], ctx.ids['large_message'], io.BytesIO()), 1),
+	'board.post_message': (lambda ctx: lambda: ctx.client.board.post_message(ctx.session_id, ctx.ids['board'], ctx.payload), 1),
+	'admin.audit_log': (_admin_audit_log, 1),
+	'admin.login': (_admin_login, 0.05),
+	'decode.dicts': (_decode_dicts, 1),
+	'decode.message_page': (_decode_page, 1),
+	'decode.cbor': (_decode_cbor, 1),
+	'sharedkey.encrypt_page': (_shared_key_encrypt, 1),
+	'sharedkey.decrypt_many': (_shared_key_decrypt_many, 1),
+	'sharedkey.decrypt_page': (_shared_key_decrypt_page, 1),
+}
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+	if not sorted_values:
+		return 0.0
+	return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+def measure(op: Callable[[], Any], iterations: int, warmup: int = 10, alloc_iterations: Optional[int] = None) -> Dict[str, float]:
+	"""
+	Time an operation and measure its allocations.
+	
+	Latencies come from a plain timed loop. Allocations are measured in a
+	separate pass under tracemalloc, which slows everything down: the mean
+	peak of traced memory during one call, and the memory still held
+	after the pass, per call.
+	"""
+	for _ in range(warmup):
+		op()
+	
+	latencies = []
+	gc.collect()
+	total_start = time.perf_counter()
+	for _ in range(iterations):
+		start = time.perf_counter()
+		op()
+		latencies.append(time.perf_counter() - start)
+	total = time.perf_counter() - total_start
+	latencies.sort()
+	
+	alloc_iterations = alloc_iterations or min(iterations, 100)
+	gc.collect()
+	tracemalloc.start()
+	try:
+		base = tracemalloc.get_traced_memory()[0]
+		peak_total = 0
+		for _ in range(alloc_iterations):
+			current = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+			op()
+			peak_total += tracemalloc.get_traced_memory()[1] - current
+		gc.collect()
+		retained = tracemalloc.get_traced_memory()[0] - base
+	finally:
+		tracemalloc.stop()
+	
+	return {
+		'iterations': iterations,
+		'ops_per_sec': iterations / total if total else 0.0,
+		'mean_ms': total / iterations * 1000,
+		'p50_ms': _percentile(latencies, 0.5) * 1000,
+		'p99_ms': _percentile(latencies, 0.99) * 1000,
+		'alloc_peak_bytes': peak_total / alloc_iterations,
+		'alloc_retained_bytes': max(retained, 0) / alloc_iterations,
+	}
+
+def run(names: Optional[List[str]] = None, iterations: int = 200, warmup: int = 10, latency: float = 0.0, same_process: bool = False, **config) -> Dict[str, Any]:
+	"""
+	Run benchmarks against a fresh stub server and return the results.
+	
+	names selects benchmarks by name or name prefix ('board.'); the
+	default runs all of BENCHMARKS. Extra keyword arguments are passed to
+	the Subtext client as config.
+	"""
+	selected = [name for name in BENCHMARKS if names is None or any(name == n or name.startswith(n) for n in names)]
+	ctx = BenchContext(latency, same_process, **config)
+	results = {}
+	try:
+		for name in selected:
+			factory, share = BENCHMARKS[name]
+			count = max(1, int(iterations * share))
+			try:
+				op = factory(ctx)
+			except ImportError:
+				continue
+			results[name] = measure(op, count, min(warmup, count))
+			if hasattr(op, 'bytes_per_op'):
+				results[name]['mb_per_sec'] = op.bytes_per_op * results[name]['ops_per_sec'] / 1e6
+	finally:
+		ctx.close()
+	return {
+		'meta': {
+			'timestamp': datetime.now(timezone.utc).isoformat(),
+			'client_version': VERSION,
+			'python': platform.python_version(),
+			'implementation': platform.python_implementation(),
+			'platform': platform.platform(),
+			'iterations': iterations,
+			'latency': latency,
+			'same_process': same_process,
+			'config': {k: v for k, v in config.items() if isinstance(v, (int, float, str, bool))},
+		},
+		'results': results,
+	}
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1) -> List[Dict[str, Any]]:
+	"""
+	Compare two result sets benchmark by benchmark.
+	
+	A benchmark counts as a regression if its throughput dropped or its p99
+	latency grew by more than threshold (a fraction).
+	"""
+	rows = []
+	for name, new in current['results'].items():
+		old = baseline['results'].get(name)
+		if old is None:
+			continue
+		ops_change = new['ops_per_sec'] / old['ops_per_sec'] - 1 if old['ops_per_sec'] else 0.0
+		p99_change = new['p99_ms'] / old['p99_ms'] - 1 if old['p99_ms'] else 0.0
+		rows.append({
+			'name': name,
+			'ops_change': ops_change,
+			'p99_change': p99_change,
+			'alloc_change': new['alloc_peak_bytes'] - old['alloc_peak_bytes'],
+			'regression': ops_change < -threshold or p99_change > threshold,
+		})
+	return rows
+
+def format_results(results: Dict[str, Any]) -> str:
+	lines = ["{:<24} {:>10} {:>9} {:>9} {:>12} {:>12}".format("benchmark", "ops/s", "p50 ms", "p99 ms", "peak B/op", "kept B/op")]
+	for name, r in results['results'].items():
+		line = "{:<24} {:>10.1f} {:>9.3f} {:>9.3f} {:>12.0f} {:>12.0f}".format(name, r['ops_per_sec'], r['p50_ms'], r['p99_ms'], r['alloc_peak_bytes'], r['alloc_retained_bytes'])
+		if 'mb_per_sec' in r:
+			line += " {:>9.1f} MB/s".format(r['mb_per_sec'])
+		lines.append(line)
+	return '\n'.join(lines)
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+	lines = ["{:<24} {:>9} {:>9} {:>12}".format("benchmark", "ops/s", "p99", "peak B/op")]
+	for row in rows:
+		lines.append("{:<24} {:>+8.1%} {:>+8.1%} {:>+12.0f}{}".format(row['name'], row['ops_change'], row['p99_change'], row['alloc_change'], "  REGRESSION" if row['regression'] else ""))
+	return '\n'.join(lines)
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(prog='python -m subtext.bench', description="Benchmark the Subtext client against an in-memory stub server.")
+	parser.add_argument('names', nargs='*', help="benchmarks to run, by name or prefix (default: all)")
+	parser.add_argument('-n', '--iterations', type=int, default=200)
+	parser.add_argument('-w', '--warmup', type=int, default=10)
+	parser.add_argument('--latency', type=float, default=0.0, help="simulated server latency in seconds")
+	parser.add_argument('--same-process', action='store_true', help="run the stub on a thread instead of a child process")
+	parser.add_argument('--typed', action='store_true', help="create the client with typed=True")
+	parser.add_argument('-o', '--output', help="save the results as JSON")
+	parser.add_argument('--compare', metavar='BASELINE', help="compare against earlier results")
+	parser.add_argument('--threshold', type=float, default=0.1, help="relative change counted as a regression (default 0.1)")
+	parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+	args = parser.parse_args(argv)
+	
+	if args.list:
+		print('\n'.join(BENCHMARKS))
+		return 0
+	
+	results = run(args.names or None, args.iterations, args.warmup, args.latency, args.same_process, typed=args.typed)
+	print(format_results(results))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent='\t')
+	
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		rows = compare(baseline, results, args.threshold)
+		print()
+		print(format_comparison(rows))
+		if any(row['regression'] for row in rows):
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
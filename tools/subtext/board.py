@@ -2,13 +2,15 @@
 """
 subtext.board - Subtext board API.
 """
-from typing import Optional
-import requests, base64, hashlib
+from typing import BinaryIO, Callable, Optional, Union
+import base64, hashlib
 from uuid import UUID
 from datetime import datetime
 from enum import Enum
 
-from .common import _assert_compatibility, VersionError, APIError, PagedList
+from .common import _assert_compatibility, VersionError, APIError, PagedList, Body, _stream_body, _typed
+from .transport import Transport
+from . import cbor
 
 class BoardEncryption(Enum):
 	none = 'None'
@@ -19,13 +21,14 @@ class BoardAPI:
 	"""
 	Subtext board API class.
 	"""
-	def __init__(self, url: str, version: str, **config):
+	def __init__(self, url: str, version: str, transport: Transport, **config):
 		self.url = url
 		self.version = version
+		self.transport = transport
 		self.config = config
 	
 	def create(self, session_id: UUID, name: str, encryption: BoardEncryption = BoardEncryption.gnupg):
-		resp = requests.post(self.url + "/Subtext/board/create", params={
+		resp = self.transport.post(self.url + "/Subtext/board/create", params={
 			'sessionId': session_id,
 			'name': name,
 			'encryption': encryption.value
@@ -38,7 +41,7 @@ class BoardAPI:
 		return resp.json()
 	
 	def create_direct(self, session_id: UUID, recipient_id: UUID):
-		resp = requests.post(self.url + "/Subtext/board/createdirect", params={
+		resp = self.transport.post(self.url + "/Subtext/board/createdirect", params={
 			'sessionId': session_id,
 			'recipientId': recipient_id
 		})
@@ -50,7 +53,7 @@ class BoardAPI:
 		return resp.json()
 	
 	def get_boards(self, session_id: UUID, start: Optional[int] = None, count: Optional[int] = None, only_owned: Optional[bool] = None):
-		resp = requests.get(self.url + "/Subtext/board", params={
+		resp = self.transport.get(self.url + "/Subtext/board", params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count,
@@ -61,10 +64,17 @@ class BoardAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		return _typed(self.config, 'Board', resp.json())
+	
+	def iter_boards(self, session_id: UUID, only_owned: Optional[bool] = None, **options) -> PagedList:
+		"""
+		Iterate over all boards the user is a member of.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_boards(session_id, start, page_size, only_owned), page_size=page_size, **options)
 	
 	def get(self, session_id: UUID, board_id: UUID):
-		resp = requests.get(self.url + "/Subtext/board/{}".format(board_id), params={
+		resp = self.transport.get(self.url + "/Subtext/board/{}".format(board_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -72,10 +82,10 @@ class BoardAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		return _typed(self.config, 'Board', resp.json())
 	
 	def get_members(self, session_id: UUID, board_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/board/{}/members".format(board_id), params={
+		resp = self.transport.get(self.url + "/Subtext/board/{}/members".format(board_id), params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count
@@ -85,10 +95,20 @@ class BoardAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		members = resp.json()
+		if self.config.get('typed'):
+			return _typed(self.config, 'MemberRecord', [{'boardId': str(board_id), 'userId': user_id} for user_id in members])
+		return members
+	
+	def iter_members(self, session_id: UUID, board_id: UUID, **options) -> PagedList:
+		"""
+		Iterate over the user IDs of all board members.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_members(session_id, board_id, start, page_size), page_size=page_size, **options)
 	
 	def add_member(self, session_id: UUID, board_id: UUID, user_id: UUID):
-		resp = requests.post(self.url + "/Subtext/board/{}/members".format(board_id), params={
+		resp = self.transport.post(self.url + "/Subtext/board/{}/members".format(board_id), params={
 			'sessionId': session_id,
 			'userId': user_id
 		})
@@ -100,7 +120,7 @@ class BoardAPI:
 		return resp.json()
 	
 	def remove_member(self, session_id: UUID, board_id: UUID, user_id: UUID):
-		resp = requests.delete(self.url + "/Subtext/board/{}/members/{}".format(board_id, user_id), params={
+		resp = self.transport.delete(self.url + "/Subtext/board/{}/members/{}".format(board_id, user_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -110,21 +130,33 @@ class BoardAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
 	
-	def get_messages(self, session_id: UUID, board_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/board/{}/messages".format(board_id), params={
+	def get_messages(self, session_id: UUID, board_id: UUID, start: Optional[int] = None, count: Optional[int] = None, msg_type: Optional[str] = None, only_system: Optional[bool] = None, since_time: Optional[Union[datetime, str]] = None):
+		resp = self.transport.get(self.url + "/Subtext/board/{}/messages".format(board_id), params={
 			'sessionId': session_id,
 			'start': start,
-			'count': count
-		})
+			'count': count,
+			'type': msg_type,
+			'onlySystem': only_system,
+			'sinceTime': since_time
+		}, headers={'Accept': cbor.ACCEPT} if self.config.get('binary_messages') else None)
 		if resp.status_code // 100 != 2:
 			if resp.headers['Content-Type'].startswith('application/json'):
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		if cbor.is_cbor(resp.headers.get('Content-Type')):
+			return _typed(self.config, 'MessagePage', cbor.loads(resp.content))
+		return _typed(self.config, 'MessagePage', resp.json())
+	
+	def iter_messages(self, session_id: UUID, board_id: UUID, msg_type: Optional[str] = None, only_system: Optional[bool] = None, since_time: Optional[Union[datetime, str]] = None, **options) -> PagedList:
+		"""
+		Iterate over the messages of a board, newest first.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_messages(session_id, board_id, start, page_size, msg_type, only_system, since_time), page_size=page_size, **options)
 	
 	def get_message(self, session_id: UUID, board_id: UUID, message_id: UUID):
-		resp = requests.get(self.url + "/Subtext/board/{}/messages/{}".format(board_id, message_id), params={
+		resp = self.transport.get(self.url + "/Subtext/board/{}/messages/{}".format(board_id, message_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -134,16 +166,48 @@ class BoardAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.content
 	
-	def post_message(self, session_id: UUID, board_id: UUID, content: bytes, is_system: bool = False, msg_type: str = "Message"):
-		resp = requests.post(self.url + "/Subtext/board/{}/messages".format(board_id), params={
+	def get_message_into(self, session_id: UUID, board_id: UUID, message_id: UUID, fp: BinaryIO, max_size: Optional[int] = None, chunk_size: int = 65536) -> int:
+		"""
+		Stream the content of a message into a writable binary file.
+		
+		Returns the number of bytes written. Raises ValueError if the content
+		is larger than max_size.
+		"""
+		with self.transport.get(self.url + "/Subtext/board/{}/messages/{}".format(board_id, message_id), params={
+			'sessionId': session_id
+		}, stream=True) as resp:
+			if resp.status_code // 100 != 2:
+				if resp.headers['Content-Type'].startswith('application/json'):
+					raise APIError(resp.json()['error'], resp.status_code)
+				else:
+					raise APIError(resp.text, resp.status_code)
+			if max_size is not None and int(resp.headers.get('Content-Length', 0)) > max_size:
+				raise ValueError("message {} exceeds max_size ({} bytes)".format(message_id, max_size))
+			size = 0
+			for chunk in resp.iter_content(chunk_size):
+				size += len(chunk)
+				if max_size is not None and size > max_size:
+					raise ValueError("message {} exceeds max_size ({} bytes)".format(message_id, max_size))
+				fp.write(chunk)
+		return size
+	
+	def post_message(self, session_id: UUID, board_id: UUID, content: Body, is_system: bool = False, msg_type: str = "Message", progress: Optional[Callable[[int, Optional[int]], None]] = None):
+		"""
+		Post a message to a board.
+		
+		content can be bytes, a memoryview, a binary file object or an
+		iterable of chunks; anything but bytes is streamed. progress is called
+		with (bytes sent, total bytes or None) after each chunk.
+		"""
+		resp = self.transport.post(self.url + "/Subtext/board/{}/messages".format(board_id), params={
 			'sessionId': session_id,
 			'isSystem': is_system,
 			'type': msg_type
-		}, headers={'Content-Type': 'application/octet-stream'}, data=content)
+		}, headers={'Content-Type': 'application/octet-stream'}, data=_stream_body(content, progress))
 		if resp.status_code // 100 != 2:
 			if resp.headers['Content-Type'].startswith('application/json'):
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
-	
+
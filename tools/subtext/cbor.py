@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+subtext.cbor - CBOR encoding of message pages.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import struct
+from uuid import UUID
+
+MEDIA_TYPE = 'application/cbor'
+# Accept header sent by clients that can read CBOR; servers without the
+# CBOR formatter answer with JSON
+ACCEPT = 'application/cbor, application/json;q=0.9'
+TAG_UUID = 37
+
+_BREAK = object()
+
+def is_cbor(content_type: Optional[str]) -> bool:
+	return content_type is not None and content_type.split(';', 1)[0].strip().lower() == MEDIA_TYPE
+
+def loads(data: Union[bytes, bytearray, memoryview]) -> Any:
+	"""
+	Decode a CBOR document. Byte strings come back as memoryviews into
+	data rather than copies, and tagged UUIDs as strings like in the JSON
+	responses.
+	"""
+	buf = data if isinstance(data, bytes) else bytes(data)
+	view = memoryview(buf)
+	size = len(buf)
+	# Map keys and type names repeat on every message of a page
+	texts: Dict[bytes, str] = {}
+	from_bytes = int.from_bytes
+	
+	# One closure with the state in locals; this runs once per value, so
+	# it is kept free of attribute lookups and method calls
+	def decode(pos: int) -> Tuple[Any, int]:
+		initial = buf[pos]
+		pos += 1
+		major = initial >> 5
+		info = initial & 0x1f
+		if major == 7:
+			if info == 22 or info == 23:
+				return None, pos
+			if info == 20:
+				return False, pos
+			if info == 21:
+				return True, pos
+			if info == 27:
+				return struct.unpack_from('>d', buf, pos)[0], pos + 8
+			if info == 26:
+				return struct.unpack_from('>f', buf, pos)[0], pos + 4
+			if info == 25:
+				return struct.unpack_from('>e', buf, pos)[0], pos + 2
+			if info == 31:
+				return _BREAK, pos
+			raise ValueError("unsupported CBOR simple value {}".format(info))
+		if info < 24:
+			length = info
+		elif info == 24:
+			length = buf[pos]
+			pos += 1
+		elif info < 28:
+			end = pos + (1 << (info - 24))
+			if end > size:
+				raise ValueError("truncated CBOR data")
+			length = from_bytes(buf[pos:end], 'big')
+			pos = end
+		elif info == 31 and major in (2, 3, 4, 5):
+			length = None
+		else:
+			raise ValueError("invalid CBOR additional information {}".format(info))
+		
+		if major == 3 and length is not None:
+			end = pos + length
+			if end > size:
+				raise ValueError("truncated CBOR data")
+			raw = buf[pos:end]
+			text = texts.get(raw)
+			if text is None:
+				text = texts[raw] = raw.decode('utf-8')
+			return text, end
+		if major == 2 and length is not None:
+			end = pos + length
+			if end > size:
+				raise ValueError("truncated CBOR data")
+			return view[pos:end], end
+		if major == 5:
+			result = {}
+			if length is None:
+				while True:
+					key, pos = decode(pos)
+					if key is _BREAK:
+						return result, pos
+					result[key], pos = decode(pos)
+			for _ in range(length):
+				key, pos = decode(pos)
+				result[key], pos = decode(pos)
+			return result, pos
+		if major == 4:
+			items: List[Any] = []
+			append = items.append
+			if length is None:
+				while True:
+					item, pos = decode(pos)
+					if item is _BREAK:
+						return items, pos
+					append(item)
+			for _ in range(length):
+				item, pos = decode(pos)
+				append(item)
+			return items, pos
+		if major == 0:
+			return length, pos
+		if major == 1:
+			return -1 - length, pos
+		if major == 6:
+			value, pos = decode(pos)
+			if length == TAG_UUID and isinstance(value, memoryview) and len(value) == 16:
+				# Formatted by hand; going through UUID() doubles the
+				# decoding time of a page
+				h = value.hex()
+				return '{}-{}-{}-{}-{}'.format(h[:8], h[8:12], h[12:16], h[16:20], h[20:]), pos
+			return value, pos
+		# Indefinite-length byte or text string
+		chunks = []
+		while True:
+			chunk, pos = decode(pos)
+			if chunk is _BREAK:
+				break
+			chunks.append(chunk)
+		return (b''.join(chunks) if major == 2 else ''.join(chunks)), pos
+	
+	try:
+		value, pos = decode(0)
+	except (IndexError, struct.error):
+		raise ValueError("truncated CBOR data") from None
+	if pos != size:
+		raise ValueError("trailing data after CBOR document")
+	return value
+
+def _head(major: int, value: int) -> bytes:
+	if value < 24:
+		return bytes((major << 5 | value,))
+	for info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+		if value < 1 << (size * 8):
+			return bytes((major << 5 | info,)) + value.to_bytes(size, 'big')
+	raise ValueError("integer too large for CBOR")
+
+def dumps(value: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+	"""
+	Encode a value as CBOR like the server's CborOutputFormatter does, with
+	UUIDs as tagged byte strings. Values of other types are passed through
+	default(), or raise TypeError without it.
+	"""
+	out = bytearray()
+	
+	def encode(value: Any):
+		if value is None:
+			out.append(0xf6)
+		elif value is True:
+			out.append(0xf5)
+		elif value is False:
+			out.append(0xf4)
+		elif isinstance(value, int):
+			out.extend(_head(0, value) if value >= 0 else _head(1, -1 - value))
+		elif isinstance(value, float):
+			out.append(0xfb)
+			out.extend(struct.pack('>d', value))
+		elif isinstance(value, str):
+			data = value.encode('utf-8')
+			out.extend(_head(3, len(data)))
+			out.extend(data)
+		elif isinstance(value, (bytes, bytearray, memoryview)):
+			out.extend(_head(2, len(value)))
+			out.extend(value)
+		elif isinstance(value, UUID):
+			out.extend(_head(6, TAG_UUID))
+			out.extend(_head(2, 16))
+			out.extend(value.bytes)
+		elif isinstance(value, dict):
+			out.extend(_head(5, len(value)))
+			for key, item in value.items():
+				encode(key)
+				encode(item)
+		elif isinstance(value, (list, tuple)):
+			out.extend(_head(4, len(value)))
+			for item in value:
+				encode(item)
+		elif default is not None:
+			encode(default(value))
+		else:
+			raise TypeError("cannot encode {} as CBOR".format(type(value).__name__))
+	
+	encode(value)
+	return bytes(out)
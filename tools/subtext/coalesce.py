@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+subtext.coalesce - Single-flight coalescing of identical GET requests.
+"""
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+import threading
+
+from .metrics import endpoint_template
+
+# Endpoints whose response doesn't depend on who is asking
+SHARED_ENDPOINTS = frozenset((
+	'/',
+	'/Subtext',
+	'/Subtext/user/queryidbyname',
+	'/Subtext/key/{}',
+))
+
+def _encode(value: Any) -> str:
+	if isinstance(value, (bytes, bytearray)):
+		return bytes(value).decode('ascii', errors='replace')
+	return str(getattr(value, 'value', value))
+
+class _Call:
+	__slots__ = ('event', 'result', 'error')
+	
+	def __init__(self):
+		self.event = threading.Event()
+		self.result: Any = None
+		self.error: Optional[BaseException] = None
+
+class _AsyncCall:
+	__slots__ = ('task', 'waiters')
+	
+	def __init__(self, task: Any):
+		self.task = task
+		self.waiters = 0
+
+class SingleFlight:
+	"""
+	Merges identical GET requests that are in flight at the same time: the
+	first caller sends the request and every caller that asks for the same
+	thing before it completes gets the same response (or exception).
+	
+	Requests are identified by URL, parameters and headers. The session ID
+	is left out of the key only for the endpoints in shared, whose
+	responses are the same for every caller (user names, keys, server
+	info). Everything else is only merged within a session: UserAPI.get
+	shows presence only to friends, and boards only to their members, so
+	merging those across sessions could leak data between users.
+	
+	Works for threads (do()) and coroutines (do_async()); callers on
+	different event loops are not merged with each other. A coroutine's
+	request runs as its own task, so cancelling one caller doesn't affect
+	the others; it is only cancelled once every caller has given up.
+	"""
+	def __init__(self, shared: Iterable[str] = SHARED_ENDPOINTS):
+		self.shared: FrozenSet[str] = frozenset(shared)
+		self.lock = threading.Lock()
+		self.calls: Dict[Any, _Call] = {}
+		# (loop, key) -> task running the request
+		self.async_calls: Dict[Tuple[Any, Any], _AsyncCall] = {}
+		self.requests = 0
+		self.hits = 0
+	
+	def key(self, url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> Tuple:
+		shared = endpoint_template(url) in self.shared
+		items = tuple(sorted((k, _encode(v)) for k, v in (params or {}).items() if v is not None and not (shared and k == 'sessionId')))
+		return (url, items, tuple(sorted((headers or {}).items())))
+	
+	def do(self, key: Any, func: Callable[[], Any]) -> Any:
+		"""
+		Call func(), unless a call with the same key is in flight, in which
+		case wait for it and return its result.
+		"""
+		with self.lock:
+			self.requests += 1
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = _Call()
+			else:
+				self.hits += 1
+		if not leader:
+			call.event.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+		try:
+			call.result = func()
+		except BaseException as e:
+			call.error = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call.event.set()
+		return call.result
+	
+	async def do_async(self, key: Any, func: Callable[[], Awaitable[Any]]) -> Any:
+		"""
+		Coroutine version of do().
+		"""
+		import asyncio
+		loop = asyncio.get_running_loop()
+		loop_key = (loop, key)
+		
+		def done(task):
+			with self.lock:
+				self._forget(loop_key, call)
+		
+		with self.lock:
+			self.requests += 1
+			call = self.async_calls.get(loop_key)
+			if call is None:
+				call = self.async_calls[loop_key] = _AsyncCall(loop.create_task(func()))
+				call.task.add_done_callback(done)
+			else:
+				self.hits += 1
+			call.waiters += 1
+		try:
+			# shield() so a cancelled caller doesn't cancel the request
+			return await asyncio.shield(call.task)
+		except asyncio.CancelledError:
+			with self.lock:
+				call.waiters -= 1
+				abandoned = call.waiters == 0 and not call.task.done()
+				if abandoned:
+					self._forget(loop_key, call)
+			if abandoned:
+				call.task.cancel()
+			raise
+	
+	def _forget(self, loop_key: Tuple[Any, Any], call: _AsyncCall):
+		# Must be called with the lock held; later callers start a new
+		# request instead of joining this one
+		if self.async_calls.get(loop_key) is call:
+			del self.async_calls[loop_key]
+	
+	def stats(self) -> Dict[str, Any]:
+		with self.lock:
+			return {
+				'requests': self.requests,
+				'hits': self.hits,
+				'hit_ratio': self.hits / self.requests if self.requests else 0.0,
+				'in_flight': len(self.calls) + len(self.async_calls),
+			}
+	
+	def collect(self, collector: Any):
+		"""
+		Publish the coalescing statistics as gauges on a HistogramCollector.
+		"""
+		stats = self.stats()
+		collector.set_gauge('coalesce_requests', stats['requests'], "GET requests that went through request coalescing.")
+		collector.set_gauge('coalesce_hits', stats['hits'], "GET requests served by another caller's request.")
+
+def from_config(config: Dict[str, Any]) -> Optional[SingleFlight]:
+	"""
+	Get the coalescer selected by the coalesce option: None/False for none,
+	True for a new one, or a SingleFlight to share between clients.
+	"""
+	option = config.get('coalesce')
+	if not option:
+		return None
+	if isinstance(option, SingleFlight):
+		return option
+	return SingleFlight()
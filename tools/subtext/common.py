@@ -2,11 +2,12 @@
 """
 subtext.common - Common functions, classes and exceptions
 """
-from typing import Callable, List, Any, Type
-import collections.abc
+from typing import Callable, Dict, List, Any, Type, Optional, Union, BinaryIO, Iterable, Iterator
+import collections, collections.abc
+import concurrent.futures, threading
+import io, os, json, time
 from datetime import datetime
 import base64
-import iso8601
 from uuid import UUID
 
 class VersionError(Exception):
@@ -40,35 +41,240 @@ def _assert_compatibility(serv_ver: str, req_ver: str, *, is_module: bool = Fals
 class PagedList(collections.abc.Iterable):
 	"""
 	Iterable that retrieves chunks of values from a function
+	
+	While one page is being consumed, the next one is fetched in the
+	background. Only the last `window` items are kept; indexing an evicted
+	item fetches its page again. If `page_size` is given, a shorter page is
+	taken as the last one, saving a request for the empty page.
 	"""
-	def __init__(self, callback: Callable[[int], List[Any]]):
+	def __init__(self, callback: Callable[[int], List[Any]], page_size: Optional[int] = None, window: Optional[int] = None, prefetch: bool = True, limit: Optional[int] = None):
 		self.__callback = callback
-		self.__list = []
-	def __getitem__(self, index: int) -> Any:
+		self.__page_size = page_size
+		self.__window = window
+		self.__prefetch = prefetch
+		self.__limit = limit
+		self.__list = collections.deque()
+		self.__base = 0
+		self.__end = None
+		self.__pending = None
+		self.__pending_start = None
+	def __getitem__(self, index: Union[int, slice]) -> Any:
+		if isinstance(index, slice):
+			return self.__slice(index)
 		if not isinstance(index, int):
-			raise TypeError("index must be int")
-		while index >= len(self.__list):
-			if not self.__fetch():
+			raise TypeError("index must be int or slice")
+		if index < 0:
+			index += self.__len()
+			if index < 0:
 				raise IndexError("index out of range")
-		return self.__list[index]
+		return self.__item(index)
 	def __iter__(self) -> Any:
-		for item in self.__list:
-			yield item
-		start = len(self.__list)
+		index = 0
 		while True:
-			page = self.__callback(start)
-			start += len(page)
-			if len(page) <= 0:
+			try:
+				yield self.__item(index)
+			except IndexError:
+				return
+			index += 1
+	def __len(self) -> int:
+		while self.__end is None:
+			self.__base += len(self.__list)
+			self.__list.clear()
+			self.__fetch()
+		if self.__limit is not None:
+			return min(self.__end, self.__limit)
+		return self.__end
+	def __slice(self, index: slice) -> List[Any]:
+		start, stop, step = index.start, index.stop, index.step
+		if step == 0:
+			raise ValueError("slice step cannot be zero")
+		if (start is not None and start < 0) or (stop is not None and stop < 0) or (step is not None and step < 0):
+			# Needs the length, which fetches every page
+			return [self.__item(i) for i in range(*index.indices(self.__len()))]
+		start, step = start or 0, step or 1
+		result = []
+		i = start
+		while stop is None or i < stop:
+			try:
+				result.append(self.__item(i))
+			except IndexError:
 				break
-			for item in page:
-				self.__list.append(item)
-				yield item
+			i += step
+		return result
+	def __item(self, index: int) -> Any:
+		if self.__limit is not None and index >= self.__limit:
+			raise IndexError("index out of range")
+		if index < self.__base:
+			# Evicted from the window, start a new window there
+			self.__discard_pending()
+			self.__list.clear()
+			self.__base = index
+		while index >= self.__base + len(self.__list):
+			if not self.__fetch():
+				raise IndexError("index out of range")
+		return self.__list[index - self.__base]
 	def __fetch(self) -> bool:
-		page = self.__callback(len(self.__list))
+		start = self.__base + len(self.__list)
+		if self.__end is not None and start >= self.__end:
+			return False
+		if self.__pending is not None and self.__pending_start == start:
+			page = self.__pending.result()
+			self.__pending = None
+		else:
+			self.__discard_pending()
+			page = self.__callback(start)
+		if len(page) <= 0 or (self.__page_size is not None and len(page) < self.__page_size):
+			self.__end = start + len(page)
 		if len(page) <= 0:
 			return False
 		self.__list.extend(page)
+		if self.__window is not None:
+			while len(self.__list) > max(self.__window, len(page)):
+				self.__list.popleft()
+				self.__base += 1
+		next_start = start + len(page)
+		if self.__prefetch and self.__end is None and (self.__limit is None or next_start < self.__limit):
+			self.__pending = _prefetch_executor().submit(self.__callback, next_start)
+			self.__pending_start = next_start
 		return True
+	def __discard_pending(self):
+		if self.__pending is not None:
+			self.__pending.cancel()
+			self.__pending = None
+	def close(self):
+		"""
+		Stop any background fetch and drop all retained items.
+		"""
+		self.__discard_pending()
+		self.__list.clear()
+
+class AboutCache:
+	"""
+	On-disk cache of Subtext.about() results, keyed by server URL.
+	
+	Entries older than ttl seconds are ignored. The file is a small JSON
+	object replaced atomically on every update, so concurrent processes
+	at worst overwrite each other's entries.
+	"""
+	def __init__(self, path: Optional[str] = None, ttl: float = 3600.0):
+		if path is None:
+			base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+			path = os.path.join(base, 'subtext', 'about.json')
+		self.path = path
+		self.ttl = ttl
+	
+	def _load(self) -> Dict[str, Any]:
+		try:
+			with open(self.path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		return data if isinstance(data, dict) else {}
+	
+	def _save(self, data: Dict[str, Any]):
+		try:
+			os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+			tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+			with open(tmp, 'w') as f:
+				json.dump(data, f)
+			os.replace(tmp, self.path)
+		except OSError:
+			# A cache that can't be written is just a cache miss next time
+			pass
+	
+	def get(self, url: str) -> Optional[Dict[str, Any]]:
+		entry = self._load().get(url)
+		if entry is None or time.time() - entry.get('time', 0) >= self.ttl:
+			return None
+		return entry.get('about')
+	
+	def put(self, url: str, about: Dict[str, Any]):
+		data = self._load()
+		data[url] = {'time': time.time(), 'about': about}
+		self._save(data)
+	
+	def invalidate(self, url: str):
+		data = self._load()
+		if data.pop(url, None) is not None:
+			self._save(data)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _prefetch_executor() -> concurrent.futures.ThreadPoolExecutor:
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='subtext-prefetch')
+		return _executor
+
+Body = Union[bytes, bytearray, memoryview, BinaryIO, Iterable[bytes]]
+
+def _body_size(content: Body) -> Optional[int]:
+	if isinstance(content, (bytes, bytearray)):
+		return len(content)
+	if isinstance(content, memoryview):
+		return content.nbytes
+	if hasattr(content, 'read'):
+		try:
+			return os.fstat(content.fileno()).st_size - content.tell()
+		except (AttributeError, OSError, io.UnsupportedOperation):
+			try:
+				return len(content.getbuffer()) - content.tell()
+			except AttributeError:
+				return None
+	return None
+
+def _iter_body(content: Body, chunk_size: int) -> Iterator[bytes]:
+	if isinstance(content, (bytes, bytearray, memoryview)):
+		view = memoryview(content).cast('B')
+		for offset in range(0, len(view), chunk_size):
+			yield view[offset:offset + chunk_size]
+	elif hasattr(content, 'read'):
+		while True:
+			chunk = content.read(chunk_size)
+			if not chunk:
+				break
+			yield chunk
+	else:
+		yield from content
+
+def _stream_body(content: Body, progress: Optional[Callable[[int, Optional[int]], None]] = None, chunk_size: int = 65536) -> Any:
+	"""
+	Prepare a request body that is sent without being loaded into memory.
+	
+	bytes are passed through unchanged. memoryviews, file objects and
+	iterables of chunks are sent in chunks of at most chunk_size bytes using
+	chunked transfer encoding. progress, if given, is called after each chunk
+	with the number of bytes sent so far and the total size (None if unknown).
+	"""
+	if isinstance(content, (bytes, bytearray)) and progress is None:
+		return content
+	total = _body_size(content)
+	def generate():
+		sent = 0
+		for chunk in _iter_body(content, chunk_size):
+			yield chunk
+			sent += len(chunk)
+			if progress is not None:
+				progress(sent, total)
+	return generate()
+
+def message_content(message: Any) -> Optional[Union[bytes, memoryview]]:
+	"""
+	Content of a message from BoardAPI.get_messages() as bytes, or None if
+	the server left it out. JSON pages carry it base64-encoded, CBOR pages
+	as a memoryview into the response.
+	"""
+	content = message['content']
+	return Translator.from_subtext(content, bytes) if content is not None else None
+
+def _typed(config: Dict[str, Any], model: str, value: Any) -> Any:
+	# Wrap a JSON result in a subtext.models class if the client was created with typed=True
+	if not config.get('typed'):
+		return value
+	from . import models
+	return models.wrap(getattr(models, model), value)
 
 class Translator:
 	@staticmethod
@@ -82,8 +288,12 @@ class Translator:
 	@staticmethod
 	def from_subtext(value: str, type: Type) -> Any:
 		if type in (bytes, bytearray):
+			if isinstance(value, (bytes, bytearray, memoryview)):
+				# Already raw in binary (CBOR) responses
+				return value
 			return base64.b64decode(value)
 		elif type == datetime:
+			import iso8601
 			return iso8601.parse_date(value)
 		elif type == UUID:
 			return UUID(value)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+subtext.compress - zstd compression of message contents.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import threading
+from uuid import UUID
+
+import zstandard
+
+from .board import BoardAPI
+from .common import message_content
+
+# Suffix added to the type of compressed messages
+TYPE_SUFFIX = "+zstd"
+# Type of the messages carrying a board's compression dictionary
+DICTIONARY_TYPE = "ZstdDictionary"
+
+def base_type(msg_type: Optional[str]) -> Optional[str]:
+	"""
+	Type of a message without the compression tag.
+	"""
+	if msg_type is not None and msg_type.endswith(TYPE_SUFFIX):
+		return msg_type[:-len(TYPE_SUFFIX)]
+	return msg_type
+
+def is_compressed(msg_type: Optional[str]) -> bool:
+	return msg_type is not None and msg_type.endswith(TYPE_SUFFIX)
+
+class MessageCompressor:
+	"""
+	Compresses message contents with zstd before they are encrypted and
+	posted, and decompresses them after they are fetched and decrypted.
+	
+	Compressed messages are tagged by appending "+zstd" to their Type
+	("Message" becomes "Message+zstd"); other clients see an unknown type
+	instead of garbage, and base_type() gives the original. Note that
+	filtering get_messages by type must use the tagged type for these.
+	Contents that don't shrink are posted unchanged and untagged.
+	
+	Short chat messages barely compress on their own, so each board can
+	have a dictionary trained on its own traffic (train()). A dictionary is
+	shared with the other members by posting it to the board as a
+	"ZstdDictionary" message (post_dictionary()); read_messages() loads any
+	it comes across, and load_dictionaries() fetches all of a board's. The
+	frame header names the dictionary it was made with, so old messages
+	stay readable after a new one is trained.
+	
+	Every compressed message counts towards the ratio statistics, and
+	inline_saved counts the ones that went from above inline_limit to at
+	or below it, i.e. that will be returned inline by GetMessages instead
+	of needing their own request. The limit should leave room for the
+	encryption overhead.
+	"""
+	def __init__(self, level: int = 3, min_size: int = 32, inline_limit: int = 2048):
+		self.level = level
+		self.min_size = min_size
+		self.inline_limit = inline_limit
+		self.lock = threading.Lock()
+		# dictionary ID -> dictionary
+		self.dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+		# board ID -> dictionary ID used for new messages
+		self.board_dictionaries: Dict[str, int] = {}
+		# dictionary ID (0 for none) -> compressor / decompressor
+		self._compressors: Dict[int, zstandard.ZstdCompressor] = {}
+		self._decompressors: Dict[int, zstandard.ZstdDecompressor] = {}
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.compressed = 0
+		self.skipped = 0
+		self.inline_saved = 0
+	
+	@property
+	def ratio(self) -> float:
+		"""
+		Original size over compressed size of all contents seen by
+		compress(), including the ones posted uncompressed.
+		"""
+		return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+	
+	def stats(self) -> Dict[str, Any]:
+		with self.lock:
+			return {
+				'bytes_in': self.bytes_in,
+				'bytes_out': self.bytes_out,
+				'ratio': self.ratio,
+				'compressed': self.compressed,
+				'skipped': self.skipped,
+				'inline_saved': self.inline_saved,
+			}
+	
+	def add_dictionary(self, board_id: UUID, data: bytes, current: bool = True) -> int:
+		"""
+		Load a dictionary for a board and, if current, use it for new
+		messages. Returns its dictionary ID.
+		"""
+		dictionary = zstandard.ZstdCompressionDict(data)
+		dict_id = dictionary.dict_id()
+		with self.lock:
+			self.dictionaries[dict_id] = dictionary
+			if current or str(board_id) not in self.board_dictionaries:
+				self.board_dictionaries[str(board_id)] = dict_id
+		return dict_id
+	
+	def train(self, board_id: UUID, samples: Sequence[bytes], size: int = 16384) -> bytes:
+		"""
+		Train a dictionary on sample messages of a board, start using it and
+		return it (to be shared with post_dictionary()). zstd needs a few
+		hundred samples at the very least.
+		"""
+		data = zstandard.train_dictionary(size, list(samples), level=self.level).as_bytes()
+		self.add_dictionary(board_id, data)
+		return data
+	
+	def _compressor(self, dict_id: int) -> zstandard.ZstdCompressor:
+		compressor = self._compressors.get(dict_id)
+		if compressor is None:
+			if dict_id:
+				compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionaries[dict_id])
+			else:
+				compressor = zstandard.ZstdCompressor(level=self.level)
+			self._compressors[dict_id] = compressor
+		return compressor
+	
+	def _decompressor(self, dict_id: int) -> zstandard.ZstdDecompressor:
+		decompressor = self._decompressors.get(dict_id)
+		if decompressor is None:
+			if dict_id:
+				dictionary = self.dictionaries.get(dict_id)
+				if dictionary is None:
+					raise ValueError("unknown zstd dictionary {}".format(dict_id))
+				decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+			else:
+				decompressor = zstandard.ZstdDecompressor()
+			self._decompressors[dict_id] = decompressor
+		return decompressor
+	
+	def compress(self, board_id: UUID, content: bytes, msg_type: str = "Message") -> Tuple[bytes, str]:
+		"""
+		Compress the plaintext of a message if that makes it smaller.
+		Returns the content and type to encrypt and post.
+		"""
+		with self.lock:
+			self.bytes_in += len(content)
+			if len(content) >= self.min_size:
+				# zstd contexts are not thread-safe, hence the lock
+				compressed = self._compressor(self.board_dictionaries.get(str(board_id), 0)).compress(content)
+				if len(compressed) < len(content):
+					self.bytes_out += len(compressed)
+					self.compressed += 1
+					if len(content) > self.inline_limit >= len(compressed):
+						self.inline_saved += 1
+					return compressed, msg_type + TYPE_SUFFIX
+			self.bytes_out += len(content)
+			self.skipped += 1
+		return content, msg_type
+	
+	def decompress(self, content: bytes, msg_type: Optional[str]) -> Tuple[bytes, Optional[str]]:
+		"""
+		Undo compress() on a decrypted message. Returns the original content
+		and type; messages that aren't tagged are returned unchanged.
+		"""
+		if not is_compressed(msg_type):
+			return content, msg_type
+		dict_id = zstandard.get_frame_parameters(content).dict_id
+		with self.lock:
+			return self._decompressor(dict_id).decompress(content), base_type(msg_type)
+	
+	def post_message(self, board_api: BoardAPI, session_id: UUID, board_id: UUID, content: bytes, msg_type: str = "Message", encrypt: Optional[Callable[[bytes], bytes]] = None) -> Any:
+		"""
+		Compress, encrypt (with encrypt, if given) and post a message.
+		"""
+		content, msg_type = self.compress(board_id, content, msg_type)
+		if encrypt is not None:
+			content = encrypt(content)
+		return board_api.post_message(session_id, board_id, content, msg_type=msg_type)
+	
+	def post_dictionary(self, board_api: BoardAPI, session_id: UUID, board_id: UUID, encrypt: Optional[Callable[[bytes], bytes]] = None) -> Any:
+		"""
+		Share the board's current dictionary with its other members.
+		"""
+		with self.lock:
+			dictionary = self.dictionaries[self.board_dictionaries[str(board_id)]]
+		data = dictionary.as_bytes()
+		return board_api.post_message(session_id, board_id, encrypt(data) if encrypt is not None else data, msg_type=DICTIONARY_TYPE)
+	
+	def load_dictionaries(self, board_api: BoardAPI, session_id: UUID, board_id: UUID, decrypt: Optional[Callable[[bytes], bytes]] = None) -> int:
+		"""
+		Load all dictionaries posted to a board, e.g. when joining it or
+		after read_messages() came across an unknown one. Returns the number
+		of dictionaries loaded.
+		"""
+		loaded = 0
+		for message in board_api.iter_messages(session_id, board_id, msg_type=DICTIONARY_TYPE):
+			if message['content'] is not None:
+				content = bytes(message_content(message))
+			else:
+				content = board_api.get_message(session_id, board_id, message['id'])
+			try:
+				self.add_dictionary(board_id, decrypt(content) if decrypt is not None else content, current=False)
+			except Exception:
+				# Not readable by us; skip it rather than fail the whole board
+				continue
+			loaded += 1
+		return loaded
+	
+	def read_messages(self, board_id: UUID, messages: Sequence[Any], contents: Optional[Sequence[Optional[bytes]]] = None, fetch: Optional[Callable[[Any], Optional[bytes]]] = None) -> List[Tuple[Any, Optional[bytes], Optional[str]]]:
+		"""
+		Decompress a page of messages, returning (message, content, type)
+		for each. contents are the decrypted contents of the messages, in
+		order (e.g. from GPGPipeline or SharedKeyCodec); without them the
+		contents are used as they are. fetch(message), if given, returns the
+		decrypted content of a message the server left out of the page.
+		
+		Dictionaries found on the page are loaded first, so all messages on
+		the page can use them. Contents that are missing, failed to decrypt
+		or can't be decompressed come back as None.
+		"""
+		if contents is None:
+			contents = [message_content(message) for message in messages]
+		if fetch is not None:
+			contents = [fetch(message) if content is None and message['content'] is None else content for message, content in zip(messages, contents)]
+		for message, content in zip(messages, contents):
+			if message['type'] == DICTIONARY_TYPE and content is not None:
+				# A board without a dictionary starts using the first one seen
+				# (the newest, as pages are newest first); one already in use is
+				# kept, the others are only loaded for reading
+				self.add_dictionary(board_id, bytes(content), current=False)
+		results = []
+		for message, content in zip(messages, contents):
+			msg_type = message['type']
+			if content is not None:
+				try:
+					content, msg_type = self.decompress(content, msg_type)
+				except (ValueError, zstandard.ZstdError):
+					# Missing dictionary or corrupt frame
+					content = None
+			results.append((message, content, base_type(msg_type)))
+		return results
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+subtext.export - Parallel export of the admin audit log.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import concurrent.futures, gzip, json, os, shutil, threading, time
+from uuid import UUID
+from datetime import datetime, timedelta, timezone
+
+from .common import Translator
+from .session import AdminSessionManager
+
+FORMATS = ('jsonl', 'parquet')
+_SUFFIX = {'jsonl': '.jsonl.gz', 'parquet': '.parquet'}
+CHECKPOINT = 'checkpoint.json'
+
+def _utc(value: datetime) -> datetime:
+	# Naive values are taken to be UTC, like the server's timestamps
+	if value.tzinfo is None:
+		return value.replace(tzinfo=timezone.utc)
+	return value.astimezone(timezone.utc)
+
+def _param(value: datetime) -> str:
+	# The server compares against naive UTC timestamps
+	return value.replace(tzinfo=None).isoformat()
+
+def _row(entry: Any) -> Dict[str, Any]:
+	return entry.to_dict() if hasattr(entry, 'to_dict') else dict(entry)
+
+class _JSONLPart:
+	def __init__(self, path: str, compresslevel: int):
+		self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+	
+	def write(self, rows: List[Dict[str, Any]]):
+		for row in rows:
+			self.file.write(json.dumps(row, separators=(',', ':')))
+			self.file.write('\n')
+	
+	def close(self):
+		self.file.close()
+
+class _ParquetPart:
+	def __init__(self, path: str, compresslevel: int):
+		import pyarrow, pyarrow.parquet
+		self.pa = pyarrow
+		self.schema = pyarrow.schema([
+			('id', pyarrow.string()),
+			('adminId', pyarrow.string()),
+			('action', pyarrow.string()),
+			('details', pyarrow.string()),
+			('timestamp', pyarrow.timestamp('us', tz='UTC')),
+		])
+		self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd', compression_level=compresslevel)
+	
+	def write(self, rows: List[Dict[str, Any]]):
+		# One row group per page keeps memory bounded by the page size
+		columns = {name: [row.get(name) for row in rows] for name in self.schema.names}
+		columns['timestamp'] = [_utc(Translator.from_subtext(value, datetime)) for value in columns['timestamp']]
+		self.writer.write_table(self.pa.table(columns, schema=self.schema))
+	
+	def close(self):
+		self.writer.close()
+
+class AuditLogExporter:
+	"""
+	Exports the audit log entries of a time range, e.g. for compliance.
+	
+	The range is cut into slices of slice_size, which are fetched
+	concurrently by max_workers threads; every slice pages through its
+	entries with AdminAPI.audit_log, so offsets stay as shallow as the
+	slices are small. All threads share one admin session, which is kept
+	alive by the AdminSessionManager's renewal thread while the export runs
+	and logged in again if it lapses anyway.
+	
+	Every slice is streamed, one page at a time, to its own part file in
+	directory: gzip-compressed JSON lines (format='jsonl') or Parquet
+	(format='parquet', needs pyarrow). Part 0 is the newest slice. Parts
+	are written under a temporary name and recorded in a checkpoint file
+	once complete, so an interrupted export resumed with the same
+	arguments only fetches the slices that are missing. combine() joins
+	the parts into a single file, newest entries first.
+	
+	Slices are half-open, [start, end), except the newest one, which also
+	includes entries at end.
+	"""
+	def __init__(self, sessions: AdminSessionManager, directory: str, format: str = 'jsonl', slice_size: timedelta = timedelta(hours=1), max_workers: int = 4, action: Optional[str] = None, admin_id: Optional[UUID] = None, compresslevel: int = 6):
+		if format not in FORMATS:
+			raise ValueError("format must be one of {}".format(', '.join(FORMATS)))
+		if slice_size <= timedelta(0):
+			raise ValueError("slice_size must be positive")
+		self.sessions = sessions
+		self.admin_api = sessions.admin_api
+		self.directory = directory
+		self.format = format
+		self.slice_size = slice_size
+		self.max_workers = max_workers
+		self.action = action
+		self.admin_id = admin_id
+		self.compresslevel = compresslevel
+		self.lock = threading.Lock()
+		self.checkpoint: Dict[str, Any] = {}
+	
+	def slices(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+		"""
+		Cut [start, end] into slices, newest first.
+		"""
+		start, end = _utc(start), _utc(end)
+		bounds = []
+		while start < end:
+			bounds.append((start, min(start + self.slice_size, end)))
+			start += self.slice_size
+		bounds.reverse()
+		return bounds
+	
+	def part_path(self, index: int) -> str:
+		return os.path.join(self.directory, 'part-{:05d}{}'.format(index, _SUFFIX[self.format]))
+	
+	def _read_checkpoint(self) -> Optional[Dict[str, Any]]:
+		try:
+			with open(os.path.join(self.directory, CHECKPOINT), encoding='utf-8') as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return None
+	
+	def _load_checkpoint(self, params: Dict[str, Any]):
+		checkpoint = self._read_checkpoint()
+		if checkpoint is not None and checkpoint['params'] != params:
+			raise ValueError("{} holds an export with different arguments".format(self.directory))
+		self.checkpoint = checkpoint or {'params': params, 'done': {}}
+	
+	def _save_checkpoint(self):
+		# Must be called with the lock held
+		path = os.path.join(self.directory, CHECKPOINT)
+		tmp = '{}.{}.tmp'.format(path, os.getpid())
+		with open(tmp, 'w', encoding='utf-8') as f:
+			json.dump(self.checkpoint, f)
+		os.replace(tmp, path)
+	
+	def _export_slice(self, index: int, start: datetime, end: datetime, newest: bool) -> int:
+		page_size = self.admin_api.config['page_size']
+		path = self.part_path(index)
+		tmp = path + '.tmp'
+		part = (_JSONLPart if self.format == 'jsonl' else _ParquetPart)(tmp, self.compresslevel)
+		rows = 0
+		offset = 0
+		previous = set()
+		try:
+			try:
+				while True:
+					page = self.sessions.call(self.admin_api.audit_log, offset, page_size, self.action, self.admin_id, _param(start), _param(end))
+					offset += len(page)
+					# Entries logged while paging shift the offsets; drop the repeats
+					entries = [_row(entry) for entry in page if str(entry['id']) not in previous]
+					previous = {str(entry['id']) for entry in page}
+					if not newest:
+						# The server's endTime is inclusive; those belong to the next slice
+						entries = [entry for entry in entries if _utc(Translator.from_subtext(entry['timestamp'], datetime)) < end]
+					if entries:
+						part.write(entries)
+						rows += len(entries)
+					if len(page) < page_size:
+						break
+			finally:
+				part.close()
+		except BaseException:
+			# Don't leave the partial part behind
+			try:
+				os.remove(tmp)
+			except OSError:
+				pass
+			raise
+		os.replace(tmp, path)
+		return rows
+	
+	def export(self, start: datetime, end: Optional[datetime] = None) -> Dict[str, Any]:
+		"""
+		Export the entries logged between start and end (default: now) and
+		return statistics of the run. Slices that fail don't stop the
+		others; the first error is raised once they are done, and running
+		the export again retries only the failed slices.
+		"""
+		if end is None:
+			# Resuming an export that ran up to "now" continues up to the same time
+			checkpoint = self._read_checkpoint()
+			end = datetime.fromisoformat(checkpoint['params']['end']) if checkpoint is not None else datetime.now(timezone.utc)
+		end = _utc(end)
+		os.makedirs(self.directory, exist_ok=True)
+		self._load_checkpoint({
+			'start': _utc(start).isoformat(),
+			'end': end.isoformat(),
+			'sliceSeconds': self.slice_size.total_seconds(),
+			'format': self.format,
+			'action': self.action,
+			'adminId': str(self.admin_id) if self.admin_id is not None else None,
+		})
+		bounds = self.slices(start, end)
+		self.checkpoint['slices'] = len(bounds)
+		done = self.checkpoint['done']
+		todo = [i for i in range(len(bounds)) if str(i) not in done or not os.path.exists(self.part_path(i))]
+		began = time.perf_counter()
+		rows = 0
+		errors = []
+		renewing = not self.sessions.running
+		if renewing:
+			self.sessions.start()
+		try:
+			with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+				futures = {executor.submit(self._export_slice, i, bounds[i][0], bounds[i][1], i == 0): i for i in todo}
+				for future in concurrent.futures.as_completed(futures):
+					try:
+						count = future.result()
+					except Exception as e:
+						errors.append(e)
+						continue
+					rows += count
+					with self.lock:
+						done[str(futures[future])] = count
+						self._save_checkpoint()
+		finally:
+			if renewing:
+				self.sessions.stop()
+		if errors:
+			raise errors[0]
+		return {
+			'slices': len(bounds),
+			'fetched': len(todo),
+			'rows': rows,
+			'total_rows': sum(done.values()),
+			'seconds': time.perf_counter() - began,
+		}
+	
+	def combine(self, path: str) -> str:
+		"""
+		Join the parts of a finished export into a single file at path,
+		newest entries first, without loading them into memory.
+		"""
+		if not self.checkpoint:
+			self.checkpoint = self._read_checkpoint() or {'done': {}, 'slices': -1}
+		if len(self.checkpoint['done']) != self.checkpoint['slices']:
+			raise ValueError("the export in {} is not finished".format(self.directory))
+		parts = [self.part_path(i) for i in range(self.checkpoint['slices'])]
+		if self.format == 'jsonl':
+			# A sequence of gzip members is itself a valid gzip file
+			with open(path, 'wb') as out:
+				for part in parts:
+					with open(part, 'rb') as f:
+						shutil.copyfileobj(f, out)
+		else:
+			import pyarrow.parquet
+			writer = None
+			try:
+				for part in parts:
+					reader = pyarrow.parquet.ParquetFile(part)
+					if writer is None:
+						writer = pyarrow.parquet.ParquetWriter(path, reader.schema_arrow, compression='zstd', compression_level=self.compresslevel)
+					for i in range(reader.num_row_groups):
+						writer.write_table(reader.read_row_group(i))
+			finally:
+				if writer is not None:
+					writer.close()
+		return path
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+subtext.fetch - Concurrent retrieval of large message bodies.
+"""
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional
+import concurrent.futures, io, mmap, tempfile
+from uuid import UUID
+
+from .board import BoardAPI
+
+class BodyFetcher:
+	"""
+	Fetches the bodies of messages too large to be returned inline.
+	
+	BoardController.GetMessages leaves out the content of messages larger
+	than Config.maxInlineMessageSize. Given a page of message metadata, the
+	missing bodies are fetched concurrently with up to max_workers requests
+	in flight. The transport's pool_size should be at least max_workers,
+	otherwise surplus connections are not reused.
+	"""
+	def __init__(self, board_api: BoardAPI, max_workers: int = 8, max_size: Optional[int] = None):
+		self.board_api = board_api
+		self.max_workers = max_workers
+		self.max_size = max_size
+	
+	@staticmethod
+	def missing(messages: Iterable[dict]) -> List[dict]:
+		"""
+		Select the messages whose content was left out of a message page.
+		"""
+		return [msg for msg in messages if msg.get('content') is None]
+	
+	def fetch(self, session_id: UUID, board_id: UUID, messages: Iterable[dict], sink: Optional[Callable[[dict], BinaryIO]] = None, use_mmap: bool = False) -> Dict[str, Any]:
+		"""
+		Fetch the missing bodies of a page of messages.
+		
+		Returns a dict mapping message IDs to bodies. With sink, each body is
+		streamed into the file returned by sink(message) and the file is
+		returned. With use_mmap, each body is spooled to a temporary file and
+		returned as a read-only mmap. Otherwise bodies are returned as bytes.
+		"""
+		missing = self.missing(messages)
+		if not missing:
+			return {}
+		
+		results = {}
+		with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+			futures = {executor.submit(self.fetch_one, session_id, board_id, msg, sink, use_mmap): msg['id'] for msg in missing}
+			try:
+				for future in concurrent.futures.as_completed(futures):
+					results[futures[future]] = future.result()
+			except BaseException:
+				for future in futures:
+					future.cancel()
+				raise
+		return results
+	
+	def fetch_one(self, session_id: UUID, board_id: UUID, message: dict, sink: Optional[Callable[[dict], BinaryIO]] = None, use_mmap: bool = False) -> Any:
+		"""
+		Fetch the body of a single message, see fetch().
+		"""
+		if sink is not None:
+			fp = sink(message)
+			self.board_api.get_message_into(session_id, board_id, message['id'], fp, self.max_size)
+			return fp
+		
+		if use_mmap:
+			with tempfile.TemporaryFile() as fp:
+				size = self.board_api.get_message_into(session_id, board_id, message['id'], fp, self.max_size)
+				if size == 0:
+					# Empty files can't be mapped
+					return b''
+				fp.flush()
+				return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		
+		fp = io.BytesIO()
+		self.board_api.get_message_into(session_id, board_id, message['id'], fp, self.max_size)
+		return fp.getvalue()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+subtext.flow - Client-side rate limiting and adaptive concurrency.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import threading, time
+
+from .metrics import endpoint_template
+
+class Budget:
+	"""
+	Limits of one class of endpoints.
+	
+	rate is the sustained number of requests per second allowed by the
+	token bucket (None for no rate limit) and burst its size. The number of
+	concurrent requests starts at initial and is adapted between min_limit
+	and max_limit.
+	"""
+	__slots__ = ('rate', 'burst', 'initial', 'min_limit', 'max_limit')
+	
+	def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None, initial: int = 4, min_limit: int = 1, max_limit: int = 64):
+		if not 1 <= min_limit <= initial <= max_limit:
+			raise ValueError("limits must satisfy 1 <= min_limit <= initial <= max_limit")
+		self.rate = rate
+		self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+		self.initial = initial
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+
+# Statuses the transports retry (for idempotent requests) when a controller
+# is in use
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+
+DEFAULT_BUDGETS = {
+	'heartbeat': Budget(rate=1.0, burst=4, initial=2, max_limit=4),
+	'admin': Budget(initial=2, max_limit=8),
+	'post_message': Budget(initial=4, max_limit=32),
+	'read': Budget(initial=8, max_limit=128),
+	'write': Budget(initial=4, max_limit=32),
+}
+
+# (method, endpoint template prefix, class), first match wins
+DEFAULT_CLASSES: List[Tuple[Optional[str], str, str]] = [
+	('POST', '/Subtext/user/heartbeat', 'heartbeat'),
+	(None, '/Subtext/admin/', 'admin'),
+	('POST', '/Subtext/board/{}/messages', 'post_message'),
+	('GET', '', 'read'),
+	(None, '', 'write'),
+]
+
+def classify(method: str, url: str) -> str:
+	"""
+	Name the endpoint class of a request (see DEFAULT_CLASSES).
+	"""
+	endpoint = endpoint_template(url)
+	for class_method, prefix, name in DEFAULT_CLASSES:
+		if (class_method is None or class_method == method) and endpoint.startswith(prefix):
+			return name
+	return 'write'
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+	# Retry-After is either a number of seconds or an HTTP date
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	import email.utils
+	try:
+		return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+class _Limiter:
+	# State of one endpoint class; only touched with the controller's lock held
+	def __init__(self, name: str, budget: Budget):
+		self.name = name
+		self.budget = budget
+		self.limit = float(budget.initial)
+		self.in_flight = 0
+		self.tokens = budget.burst
+		self.updated = time.monotonic()
+		self.paused_until = 0.0
+		self.latency: Optional[float] = None
+		self.baseline: Optional[float] = None
+		self.baseline_updated = 0.0
+		self.last_decrease = 0.0
+		self.requests = 0
+		self.throttled = 0
+		self.waited = 0.0
+		self.overloads = 0
+		self.increases = 0
+		self.decreases = 0
+	
+	def try_acquire(self, now: float) -> Optional[float]:
+		# 0 if a slot was taken, else how long to wait (None: until a release)
+		budget = self.budget
+		if budget.rate is not None:
+			self.tokens = min(budget.burst, self.tokens + (now - self.updated) * budget.rate)
+		self.updated = now
+		if now < self.paused_until:
+			return self.paused_until - now
+		if self.in_flight >= int(self.limit):
+			return None
+		if budget.rate is not None:
+			if self.tokens < 1:
+				return (1 - self.tokens) / budget.rate
+			self.tokens -= 1
+		self.in_flight += 1
+		self.requests += 1
+		return 0
+	
+	def decrease(self, now: float, factor: float):
+		# At most once per round trip, so one burst of errors counts once
+		if now - self.last_decrease < (self.latency or 0.0):
+			return
+		self.last_decrease = now
+		self.limit = max(float(self.budget.min_limit), self.limit * factor)
+		self.decreases += 1
+	
+	def feedback(self, controller: 'FlowController', now: float, latency: float, status: int, retry_after: Optional[float]):
+		saturated = self.in_flight + 1 >= int(self.limit)
+		self.in_flight -= 1
+		if retry_after is not None and status in controller.overload_statuses:
+			self.paused_until = max(self.paused_until, now + min(retry_after, controller.max_pause))
+		if status == 0 or status in controller.overload_statuses:
+			self.overloads += 1
+			self.decrease(now, controller.backoff)
+			return
+		if status // 100 == 5:
+			# Server bugs say nothing about load
+			return
+		alpha = controller.smoothing
+		self.latency = latency if self.latency is None else self.latency + alpha * (latency - self.latency)
+		# The baseline follows the fastest responses and creeps up towards
+		# the smoothed latency over baseline_window seconds, so a permanent
+		# change in the server's speed is eventually accepted as normal
+		if self.baseline is None:
+			self.baseline = latency
+		else:
+			creep = min(1.0, (now - self.baseline_updated) / controller.baseline_window)
+			self.baseline = min(latency, self.baseline + creep * (self.latency - self.baseline))
+		self.baseline_updated = now
+		if self.latency > self.baseline * controller.tolerance and self.latency > controller.min_latency:
+			self.decrease(now, controller.latency_backoff)
+		elif saturated and self.limit < self.budget.max_limit:
+			# About one more slot per round trip's worth of responses
+			self.limit = min(float(self.budget.max_limit), self.limit + 1 / self.limit)
+			self.increases += 1
+
+class FlowController:
+	"""
+	Paces the requests of a client: per endpoint class, a token bucket caps
+	the request rate and an AIMD limit caps the number of requests in
+	flight.
+	
+	The concurrency limit grows by about one per round trip while it is
+	fully used and the smoothed latency stays within tolerance times the
+	baseline (the fastest recent responses). It shrinks by backoff on
+	429/503 responses and connection errors, and by latency_backoff when
+	latency climbs past that, so the client settles just below the point
+	where queueing at the server makes latency collapse. A Retry-After
+	header on a 429/503 pauses the class for that long (up to max_pause).
+	
+	Requests are sorted into classes by classifier(method, url), which
+	defaults to classify(): 'heartbeat', 'admin', 'post_message', 'read'
+	and 'write'. Each class has its own Budget, from budgets or default.
+	
+	One controller can be shared by several clients, synchronous and
+	asynchronous, through the flow_control option.
+	"""
+	def __init__(self, budgets: Optional[Dict[str, Budget]] = None, default: Optional[Budget] = None, classifier: Callable[[str, str], str] = classify, backoff: float = 0.5, latency_backoff: float = 0.9, tolerance: float = 2.0, smoothing: float = 0.2, baseline_window: float = 30.0, min_latency: float = 0.005, max_pause: float = 60.0, overload_statuses: Tuple[int, ...] = (429, 503)):
+		self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+		self.default = default or Budget()
+		self.classifier = classifier
+		self.backoff = backoff
+		self.latency_backoff = latency_backoff
+		self.tolerance = tolerance
+		self.smoothing = smoothing
+		self.baseline_window = baseline_window
+		self.min_latency = min_latency
+		self.max_pause = max_pause
+		self.overload_statuses = frozenset(overload_statuses)
+		self.lock = threading.Lock()
+		self.cond = threading.Condition(self.lock)
+		self.limiters: Dict[str, _Limiter] = {}
+		# (loop, future) of coroutines waiting for a release
+		self._async_waiters: List[Tuple[Any, Any]] = []
+	
+	def _limiter(self, method: str, url: str) -> _Limiter:
+		# Must be called with the lock held
+		name = self.classifier(method, url)
+		limiter = self.limiters.get(name)
+		if limiter is None:
+			limiter = self.limiters[name] = _Limiter(name, self.budgets.get(name, self.default))
+		return limiter
+	
+	def acquire(self, method: str, url: str) -> _Limiter:
+		"""
+		Wait for a slot for a request; pass the result to release().
+		"""
+		waited = None
+		with self.cond:
+			limiter = self._limiter(method, url)
+			while True:
+				now = time.monotonic()
+				delay = limiter.try_acquire(now)
+				if delay == 0:
+					break
+				if waited is None:
+					waited = now
+					limiter.throttled += 1
+				self.cond.wait(delay)
+			if waited is not None:
+				limiter.waited += time.monotonic() - waited
+		return limiter
+	
+	async def acquire_async(self, method: str, url: str) -> _Limiter:
+		"""
+		Coroutine version of acquire().
+		"""
+		import asyncio
+		loop = asyncio.get_running_loop()
+		waited = None
+		while True:
+			future = None
+			with self.lock:
+				limiter = self._limiter(method, url)
+				now = time.monotonic()
+				delay = limiter.try_acquire(now)
+				if delay == 0:
+					if waited is not None:
+						limiter.waited += now - waited
+					return limiter
+				if waited is None:
+					waited = now
+					limiter.throttled += 1
+				if delay is None:
+					future = loop.create_future()
+					self._async_waiters.append((loop, future))
+			if future is None:
+				await asyncio.sleep(delay)
+			else:
+				await future
+	
+	def release(self, limiter: _Limiter, latency: float, status: int, retry_after: Optional[str] = None):
+		"""
+		Return a slot and feed the outcome of its request to the limiter.
+		status is 0 if no response was received.
+		"""
+		with self.cond:
+			limiter.feedback(self, time.monotonic(), latency, status, _retry_after(retry_after))
+			self.cond.notify_all()
+			waiters, self._async_waiters = self._async_waiters, []
+		for loop, future in waiters:
+			loop.call_soon_threadsafe(_wake, future)
+	
+	def metrics(self) -> Dict[str, Dict[str, Any]]:
+		"""
+		Current limits and counters of every endpoint class seen so far.
+		"""
+		with self.lock:
+			return {name: {
+				'limit': int(limiter.limit),
+				'in_flight': limiter.in_flight,
+				'rate': limiter.budget.rate,
+				'tokens': limiter.tokens if limiter.budget.rate is not None else None,
+				'latency': limiter.latency,
+				'baseline': limiter.baseline,
+				'requests': limiter.requests,
+				'throttled': limiter.throttled,
+				'waited': limiter.waited,
+				'overloads': limiter.overloads,
+				'increases': limiter.increases,
+				'decreases': limiter.decreases,
+			} for name, limiter in self.limiters.items()}
+	
+	def collect(self, collector: Any):
+		"""
+		Publish the current limits as gauges on a HistogramCollector, e.g.
+		right before rendering it with prometheus_text().
+		"""
+		for name, values in self.metrics().items():
+			collector.set_gauge('flow_concurrency_limit', values['limit'], "Adaptive limit of concurrent requests.", endpoint_class=name)
+			collector.set_gauge('flow_in_flight', values['in_flight'], "Requests in flight.", endpoint_class=name)
+			if values['rate'] is not None:
+				collector.set_gauge('flow_rate_limit', values['rate'], "Requests per second allowed.", endpoint_class=name)
+			if values['latency'] is not None:
+				collector.set_gauge('flow_latency_seconds', values['latency'], "Smoothed request latency.", endpoint_class=name)
+				collector.set_gauge('flow_latency_baseline_seconds', values['baseline'], "Baseline request latency.", endpoint_class=name)
+			collector.set_gauge('flow_throttled', values['throttled'], "Requests that had to wait for a slot.", endpoint_class=name)
+			collector.set_gauge('flow_overloads', values['overloads'], "Overload responses and connection errors.", endpoint_class=name)
+
+def _wake(future: Any):
+	if not future.done():
+		future.set_result(None)
+
+def from_config(config: Dict[str, Any]) -> Optional[FlowController]:
+	"""
+	Get the controller selected by the flow_control option: None/False for
+	none, True for a new one with the default budgets, or a FlowController
+	to share between clients.
+	"""
+	option = config.get('flow_control')
+	if not option:
+		return None
+	if isinstance(option, FlowController):
+		return option
+	return FlowController()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+subtext.gpg - Parallel GnuPG encryption and decryption of board messages.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import concurrent.futures, multiprocessing, multiprocessing.util, os, re, shutil, subprocess, tempfile
+from uuid import UUID
+
+from .board import BoardAPI
+from .common import message_content
+
+class GPGError(Exception):
+	"""
+	A gpg invocation failed, or a message could not be decrypted.
+	"""
+	pass
+
+def _run(binary: str, homedir: str, args: Sequence[str], input: Optional[bytes] = None, cwd: Optional[str] = None) -> bytes:
+	proc = subprocess.run(
+		[binary, '--homedir', homedir, '--batch', '--yes', '--no-tty', '--quiet', '--pinentry-mode', 'loopback'] + list(args),
+		input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd
+	)
+	if proc.returncode != 0:
+		raise GPGError(proc.stderr.decode('utf-8', errors='replace').strip() or "gpg exited with status {}".format(proc.returncode))
+	return proc.stdout
+
+def generate_key(homedir: str, uid: str, binary: str = 'gpg') -> str:
+	"""
+	Generate an unprotected key pair (ed25519 signing key with a cv25519
+	encryption subkey) and return its fingerprint. Meant for throwaway test
+	keyrings.
+	"""
+	os.makedirs(homedir, mode=0o700, exist_ok=True)
+	_run(binary, homedir, ['--passphrase', '', '--quick-gen-key', uid, 'future-default', 'default', 'never'])
+	return _fingerprints(_run(binary, homedir, ['--with-colons', '--list-secret-keys', uid]))[0]
+
+def _fingerprints(colons: bytes) -> List[str]:
+	# The fpr record following each primary key (pub/sec) line
+	fingerprints = []
+	expect = False
+	for line in colons.decode('utf-8', errors='replace').splitlines():
+		fields = line.split(':')
+		if fields[0] in ('pub', 'sec'):
+			expect = True
+		elif fields[0] == 'fpr' and expect:
+			fingerprints.append(fields[9])
+			expect = False
+	return fingerprints
+
+# Worker process state, set up once by _init_worker
+_worker: Dict[str, Any] = {}
+
+def _kill_agent(binary: str, homedir: str):
+	gpgconf = os.path.join(os.path.dirname(shutil.which(binary) or binary), 'gpgconf')
+	subprocess.run([gpgconf if os.path.exists(gpgconf) else 'gpgconf', '--homedir', homedir, '--kill', 'gpg-agent'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	shutil.rmtree(homedir, ignore_errors=True)
+
+def _init_worker(binary: str, homedir: str, passphrase: Optional[str], copy_keyring: bool):
+	if copy_keyring:
+		# Every gpg-agent serializes the private key operations it is asked
+		# for, so each worker gets its own copy of the keyring and its own
+		# agent. Copying once per worker and reusing it for every batch keeps
+		# the cost of that out of the hot path.
+		copy = tempfile.mkdtemp(prefix='subtext-gpg-')
+		shutil.copytree(homedir, copy, dirs_exist_ok=True, ignore=shutil.ignore_patterns('S.*', '*.lock', '.#*'))
+		os.chmod(copy, 0o700)
+		multiprocessing.util.Finalize(None, _kill_agent, args=(binary, copy), exitpriority=10)
+		homedir = copy
+	_worker.update(binary=binary, homedir=homedir, passphrase=passphrase)
+
+def _scratch() -> tempfile.TemporaryDirectory:
+	# Plaintexts never touch the system temp directory: batches are staged
+	# inside the worker's keyring, which only its owner can read
+	return tempfile.TemporaryDirectory(prefix='scratch-', dir=_worker['homedir'])
+
+def _decrypt_batch(contents: List[bytes]) -> List[Any]:
+	# Decrypt a batch with a single gpg process; failed messages come back as
+	# the error message instead of bytes.
+	with _scratch() as tmp:
+		names = []
+		for i, content in enumerate(contents):
+			name = '{}.gpg'.format(i)
+			with open(os.path.join(tmp, name), 'wb') as f:
+				f.write(content)
+			names.append(name)
+		args = ['--decrypt-files'] + names
+		passphrase = _worker['passphrase']
+		if passphrase is not None:
+			args = ['--passphrase-fd', '0'] + args
+		error = None
+		try:
+			_run(_worker['binary'], _worker['homedir'], args, passphrase.encode() if passphrase is not None else None, cwd=tmp)
+		except GPGError as e:
+			# gpg carries on after a bad file; the ones it managed are still there
+			error = str(e)
+		results = []
+		for i in range(len(contents)):
+			try:
+				with open(os.path.join(tmp, str(i)), 'rb') as f:
+					results.append(f.read())
+			except FileNotFoundError:
+				results.append(error or "decryption failed")
+		return results
+
+def _encrypt_batch(contents: List[bytes], recipients: List[str], armor: bool) -> List[bytes]:
+	with _scratch() as tmp:
+		names = []
+		for i, content in enumerate(contents):
+			name = str(i)
+			with open(os.path.join(tmp, name), 'wb') as f:
+				f.write(content)
+			names.append(name)
+		args = ['--trust-model', 'always']
+		for recipient in recipients:
+			args += ['--recipient', recipient]
+		if armor:
+			args.append('--armor')
+		_run(_worker['binary'], _worker['homedir'], args + ['--encrypt-files'] + names, cwd=tmp)
+		suffix = '.asc' if armor else '.gpg'
+		results = []
+		for name in names:
+			with open(os.path.join(tmp, name + suffix), 'rb') as f:
+				results.append(f.read())
+		return results
+
+def _content(message: Any) -> Optional[bytes]:
+	content = message_content(message)
+	return bytes(content) if content is not None else None
+
+class GPGPipeline:
+	"""
+	Encrypts and decrypts message contents for BoardEncryption.gnupg boards
+	in a pool of worker processes.
+	
+	Contents are split into batches of batch_size, and each batch is handled
+	by a single gpg process (--decrypt-files / --encrypt-files), so the cost
+	of starting gpg is paid once per batch rather than once per message.
+	Results always come back in the order of the input.
+	
+	Each worker copies the keyring at homedir once when it starts and reuses
+	it, with its own gpg-agent, for all of its batches (copy_keyring=False
+	makes all workers share homedir and its agent). Keys imported with
+	import_keys() restart the pool so the workers pick them up.
+	
+	gpg reads and writes the files of a batch in a scratch directory that
+	is created inside the worker's keyring (the private 0700 copy, or
+	homedir itself without copy_keyring) and removed when the batch is
+	done, so neither ciphertexts nor plaintexts are written to the system
+	temp directory.
+	
+	passphrase, if set, unlocks the secret keys; without it they must be
+	unprotected or already cached by the agent.
+	"""
+	def __init__(self, homedir: str, processes: Optional[int] = None, batch_size: int = 32, binary: str = 'gpg', passphrase: Optional[str] = None, copy_keyring: bool = True, armor: bool = False):
+		self.homedir = homedir
+		self.processes = processes or os.cpu_count() or 1
+		self.batch_size = batch_size
+		self.binary = binary
+		self.passphrase = passphrase
+		self.copy_keyring = copy_keyring
+		self.armor = armor
+		self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+	
+	@property
+	def pool(self) -> concurrent.futures.ProcessPoolExecutor:
+		if self._pool is None:
+			self._pool = concurrent.futures.ProcessPoolExecutor(
+				self.processes,
+				mp_context=multiprocessing.get_context('spawn'),
+				initializer=_init_worker,
+				initargs=(self.binary, self.homedir, self.passphrase, self.copy_keyring)
+			)
+		return self._pool
+	
+	def _batches(self, items: List[Any]) -> List[List[Any]]:
+		# Spread small inputs over all workers instead of filling one batch
+		size = max(1, min(self.batch_size, -(-len(items) // self.processes)))
+		return [items[i:i + size] for i in range(0, len(items), size)]
+	
+	def import_keys(self, key_data: bytes) -> List[str]:
+		"""
+		Import public keys (e.g. from KeyAPI.get or a KeyCache) into the
+		keyring and return the fingerprints of the imported keys.
+		"""
+		status = _run(self.binary, self.homedir, ['--status-fd', '1', '--import'], key_data)
+		fingerprints = re.findall(r'^\[GNUPG:\] IMPORT_OK \d+ ([0-9A-F]+)$', status.decode('utf-8', errors='replace'), re.MULTILINE)
+		self.close()
+		return list(dict.fromkeys(fingerprints))
+	
+	def submit_decrypt(self, contents: Sequence[Optional[bytes]]) -> List[Tuple[List[int], concurrent.futures.Future]]:
+		"""
+		Start decrypting contents and return (indices, future) per batch;
+		see decrypt(). Used to overlap decryption with other work.
+		"""
+		indices = [i for i, content in enumerate(contents) if content is not None]
+		return [(batch, self.pool.submit(_decrypt_batch, [contents[i] for i in batch])) for batch in self._batches(indices)]
+	
+	def collect(self, count: int, pending: List[Tuple[List[int], concurrent.futures.Future]], strict: bool = False) -> List[Optional[bytes]]:
+		"""
+		Wait for the futures returned by submit_decrypt() for count contents.
+		"""
+		results: List[Optional[bytes]] = [None] * count
+		for batch, future in pending:
+			for i, result in zip(batch, future.result()):
+				if isinstance(result, str):
+					if strict:
+						raise GPGError(result)
+					continue
+				results[i] = result
+		return results
+	
+	def decrypt(self, contents: Sequence[Optional[bytes]], strict: bool = False) -> List[Optional[bytes]]:
+		"""
+		Decrypt message contents, in order. None entries (contents left out
+		by the server) stay None, and so do contents that can't be decrypted,
+		unless strict is set, in which case GPGError is raised.
+		"""
+		return self.collect(len(contents), self.submit_decrypt(contents), strict)
+	
+	def decrypt_messages(self, messages: Sequence[Any], strict: bool = False) -> List[Optional[bytes]]:
+		"""
+		Decrypt the contents of a page of messages from BoardAPI.get_messages().
+		"""
+		return self.decrypt([_content(message) for message in messages], strict)
+	
+	def encrypt(self, plaintexts: Sequence[bytes], recipients: Sequence[str]) -> List[bytes]:
+		"""
+		Encrypt every plaintext to all recipients (key IDs or fingerprints in
+		the keyring), in order.
+		"""
+		if not recipients:
+			raise ValueError("no recipients")
+		plaintexts = list(plaintexts)
+		futures = [self.pool.submit(_encrypt_batch, batch, list(recipients), self.armor) for batch in self._batches(plaintexts)]
+		return [content for future in futures for content in future.result()]
+	
+	def iter_board(self, session_id: UUID, board_api: BoardAPI, board_id: UUID, since_time: Any = None, strict: bool = False) -> Iterator[List[Tuple[Any, Optional[bytes]]]]:
+		"""
+		Yield the pages of a board's messages (newest first, as the server
+		returns them) as lists of (message, plaintext) pairs.
+		
+		The next page is downloaded while the current one is decrypted, and
+		the bodies of messages too large to be returned inline are fetched
+		along with their page.
+		"""
+		page_size = board_api.config.get('page_size', 100)
+		
+		def fetch(start: int) -> Tuple[List[Any], List[Optional[bytes]]]:
+			page = board_api.get_messages(session_id, board_id, start=start, count=page_size, since_time=since_time)
+			contents = [_content(message) if message['content'] is not None else board_api.get_message(session_id, board_id, message['id']) for message in page]
+			return page, contents
+		
+		with concurrent.futures.ThreadPoolExecutor(1) as fetcher:
+			next_page = fetcher.submit(fetch, 0)
+			start = 0
+			while next_page is not None:
+				page, contents = next_page.result()
+				pending = self.submit_decrypt(contents)
+				start += len(page)
+				next_page = fetcher.submit(fetch, start) if len(page) == page_size else None
+				if page:
+					yield list(zip(page, self.collect(len(contents), pending, strict)))
+	
+	def post_messages(self, session_id: UUID, board_api: BoardAPI, board_id: UUID, plaintexts: Sequence[bytes], recipients: Sequence[str], msg_type: str = "Message") -> List[Any]:
+		"""
+		Encrypt plaintexts to all recipients in parallel, then post them to
+		the board in order. Returns the message IDs.
+		"""
+		return [board_api.post_message(session_id, board_id, content, msg_type=msg_type) for content in self.encrypt(plaintexts, recipients)]
+	
+	def close(self):
+		"""
+		Shut down the worker processes (and their gpg-agents).
+		"""
+		if self._pool is not None:
+			self._pool.shutdown()
+			self._pool = None
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
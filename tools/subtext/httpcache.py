@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+subtext.httpcache - Conditional GET cache.
+"""
+from typing import Any, Dict, Optional, Tuple
+import collections, json, threading, time
+from enum import Enum
+
+# Response headers replayed from the cache on a 304
+_STORED_HEADERS = ('Content-Type', 'X-Metadata', 'ETag', 'Last-Modified')
+
+class CacheEntry:
+	"""
+	Stored response: its validators, the headers needed to replay it and
+	the body.
+	"""
+	__slots__ = ('headers', 'content', 'stored')
+	
+	def __init__(self, headers: Dict[str, str], content: bytes, stored: Optional[float] = None):
+		self.headers = headers
+		self.content = content
+		self.stored = time.time() if stored is None else stored
+	
+	@property
+	def etag(self) -> Optional[str]:
+		return self.headers.get('ETag')
+	
+	@property
+	def last_modified(self) -> Optional[str]:
+		return self.headers.get('Last-Modified')
+	
+	def validators(self) -> Dict[str, str]:
+		"""
+		Request headers asking the server to only send the body if it changed.
+		"""
+		headers = {}
+		if self.etag is not None:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified is not None:
+			headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+def _encode_param(value: Any) -> str:
+	if isinstance(value, Enum):
+		return str(value.value)
+	if isinstance(value, (bytes, bytearray)):
+		return bytes(value).decode('ascii')
+	return str(value)
+
+class HTTPCache:
+	"""
+	Cache of GET responses that carry an ETag or Last-Modified header.
+	
+	Cached responses are always revalidated: the transport sends their
+	validators with the next GET to the same URL and, if the server answers
+	304 Not Modified, replays the stored body. Responses without validators
+	are never stored, so only the endpoints the server supports conditional
+	requests on (board and user lookups, member and friend lists) end up
+	here.
+	
+	Entries are kept in a bounded in-memory LRU (max_entries responses and
+	max_bytes of content) and, if a path is given, in an SQLite file that
+	survives restarts.
+	
+	The sessionId parameter is left out of the cache key, so entries can
+	be shared between sessions. The server checks the session and
+	permissions before answering 304 and includes what the caller is
+	allowed to see in the ETag, so this never exposes a response to a
+	session that couldn't have fetched it.
+	"""
+	def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024, path: Optional[str] = None):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.entries: 'collections.OrderedDict[str, CacheEntry]' = collections.OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		
+		self.db = None
+		if path is not None:
+			import sqlite3
+			self.db = sqlite3.connect(path, check_same_thread=False)
+			self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, headers TEXT NOT NULL, content BLOB NOT NULL, stored REAL NOT NULL)")
+			self.db.commit()
+	
+	@staticmethod
+	def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+		"""
+		Cache key of a GET request.
+		"""
+		if not params:
+			return url
+		items = sorted((k, _encode_param(v)) for k, v in params.items() if v is not None and k != 'sessionId')
+		return url + '?' + '&'.join('{}={}'.format(k, v) for k, v in items)
+	
+	def get(self, key: str) -> Optional[CacheEntry]:
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				self.entries.move_to_end(key)
+				return entry
+			if self.db is None:
+				return None
+			row = self.db.execute("SELECT headers, content, stored FROM responses WHERE key = ?", (key,)).fetchone()
+		if row is None:
+			return None
+		entry = CacheEntry(json.loads(row[0]), bytes(row[1]), row[2])
+		self.put(key, entry, persist=False)
+		return entry
+	
+	def put(self, key: str, entry: CacheEntry, persist: bool = True):
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if old is not None:
+				self.size -= len(old.content)
+			if len(entry.content) <= self.max_bytes:
+				self.entries[key] = entry
+				self.size += len(entry.content)
+			while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+				self.size -= len(self.entries.popitem(last=False)[1].content)
+			if persist and self.db is not None:
+				self.db.execute("INSERT OR REPLACE INTO responses (key, headers, content, stored) VALUES (?, ?, ?, ?)", (key, json.dumps(entry.headers), entry.content, entry.stored))
+				self.db.execute("DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY stored DESC LIMIT ?)", (self.max_entries,))
+				self.db.commit()
+	
+	def handle(self, key: str, entry: Optional[CacheEntry], status: int, headers: Any, content: bytes) -> Optional[CacheEntry]:
+		"""
+		Handle the response to a GET sent with the validators of entry (if
+		any). Returns the entry to replay if the server answered 304, and
+		stores the response if it can be revalidated later.
+		"""
+		if status == 304 and entry is not None:
+			with self.lock:
+				self.hits += 1
+			return entry
+		
+		if status == 200 and ('ETag' in headers or 'Last-Modified' in headers):
+			with self.lock:
+				self.misses += 1
+			self.put(key, CacheEntry({name: headers[name] for name in _STORED_HEADERS if name in headers}, content))
+		elif entry is not None and status // 100 != 5:
+			# The resource is gone, or we lost access to it
+			self.invalidate(key)
+		return None
+	
+	def invalidate(self, key: str):
+		with self.lock:
+			entry = self.entries.pop(key, None)
+			if entry is not None:
+				self.size -= len(entry.content)
+			if self.db is not None:
+				self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+				self.db.commit()
+	
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.size = 0
+			if self.db is not None:
+				self.db.execute("DELETE FROM responses")
+				self.db.commit()
+	
+	def close(self):
+		with self.lock:
+			if self.db is not None:
+				self.db.close()
+				self.db = None
+
+def from_config(config: Dict[str, Any]) -> Tuple[Optional[HTTPCache], bool]:
+	"""
+	Get the cache selected by the http_cache option: None/False for no
+	cache, True for an in-memory one, a path for one backed by that SQLite
+	file, or an HTTPCache to share between clients. Also returns whether the
+	cache was created here (and should be closed with the transport).
+	"""
+	option = config.get('http_cache')
+	if not option:
+		return None, False
+	if isinstance(option, HTTPCache):
+		return option, False
+	path = option if isinstance(option, str) else None
+	return HTTPCache(config.get('http_cache_size', 1024), config.get('http_cache_bytes', 8 * 1024 * 1024), path), True
@@ -2,25 +2,40 @@
 """
 subtext.key - Subtext key API.
 """
-import requests
+from typing import Tuple
+import json
 from uuid import UUID
 
 from .common import _assert_compatibility, VersionError, APIError, PagedList
+from .transport import Transport
 
 class KeyAPI:
 	"""
 	Subtext key API class.
 	"""
-	def __init__(self, url: str, version: str, **config):
+	def __init__(self, url: str, version: str, transport: Transport, **config):
 		self.url = url
 		self.version = version
+		self.transport = transport
 		self.config = config
 	
 	def get(self, key_id: UUID):
-		resp = requests.get(self.url + "/Subtext/key/{}".format(key_id))
+		resp = self.transport.get(self.url + "/Subtext/key/{}".format(key_id))
 		if resp.status_code // 100 != 2:
 			if resp.headers['Content-Type'].startswith('application/json'):
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
 		return resp.content
+	
+	def get_with_metadata(self, key_id: UUID) -> Tuple[bytes, dict]:
+		"""
+		Retrieve a public key along with its metadata (Id, PublishTime, OwnerId).
+		"""
+		resp = self.transport.get(self.url + "/Subtext/key/{}".format(key_id))
+		if resp.status_code // 100 != 2:
+			if resp.headers['Content-Type'].startswith('application/json'):
+				raise APIError(resp.json()['error'], resp.status_code)
+			else:
+				raise APIError(resp.text, resp.status_code)
+		return resp.content, json.loads(resp.headers.get('X-Metadata', '{}'))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+subtext.keycache - Public key cache.
+"""
+from typing import Dict, List, Optional, Tuple
+import collections, sqlite3, threading, time
+from uuid import UUID
+from datetime import datetime
+
+from .common import Translator
+from .key import KeyAPI
+from .user import UserAPI
+from .board import BoardAPI
+
+class KeyCache:
+	"""
+	Cache of public key blobs, keyed by key ID.
+	
+	Key blobs never change for a given ID, so once fetched they are served
+	from a bounded in-memory LRU and, if a path is given, from an SQLite
+	file that survives restarts. An entry is dropped when a key listing
+	reports a different PublishTime for its ID, or when it is older than
+	ttl seconds (if set).
+	
+	User key listings are cached for listing_ttl seconds; with the default
+	of 0 every get_user_keys() asks the server which keys a user has, but
+	only downloads the ones not cached yet.
+	"""
+	def __init__(self, key_api: KeyAPI, user_api: UserAPI, max_entries: int = 1024, ttl: Optional[float] = None, listing_ttl: float = 0, path: Optional[str] = None):
+		self.key_api = key_api
+		self.user_api = user_api
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.listing_ttl = listing_ttl
+		self.lock = threading.Lock()
+		# key ID -> (publish time, key data, fetch time)
+		self.entries: 'collections.OrderedDict[str, Tuple[Optional[str], bytes, float]]' = collections.OrderedDict()
+		# user ID -> (key records, fetch time)
+		self.listings: Dict[str, Tuple[List[dict], float]] = {}
+		self.hits = 0
+		self.misses = 0
+		
+		self.db = None
+		if path is not None:
+			self.db = sqlite3.connect(path, check_same_thread=False)
+			self.db.execute("CREATE TABLE IF NOT EXISTS keys (key_id TEXT PRIMARY KEY, publish_time TEXT, data BLOB NOT NULL, fetched REAL NOT NULL)")
+			self.db.commit()
+	
+	def _lookup(self, key_id: str) -> Optional[Tuple[Optional[str], bytes, float]]:
+		with self.lock:
+			entry = self.entries.get(key_id)
+			if entry is not None:
+				self.entries.move_to_end(key_id)
+				return entry
+			if self.db is None:
+				return None
+			row = self.db.execute("SELECT publish_time, data, fetched FROM keys WHERE key_id = ?", (key_id,)).fetchone()
+		if row is None:
+			return None
+		entry = (row[0], bytes(row[1]), row[2])
+		self._store(key_id, entry, persist=False)
+		return entry
+	
+	def _store(self, key_id: str, entry: Tuple[Optional[str], bytes, float], persist: bool = True):
+		with self.lock:
+			self.entries[key_id] = entry
+			self.entries.move_to_end(key_id)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+			if persist and self.db is not None:
+				self.db.execute("INSERT OR REPLACE INTO keys (key_id, publish_time, data, fetched) VALUES (?, ?, ?, ?)", (key_id, entry[0], entry[1], entry[2]))
+				self.db.commit()
+	
+	def _is_valid(self, entry: Tuple[Optional[str], bytes, float], publish_time: Optional[str]) -> bool:
+		if self.ttl is not None and time.time() - entry[2] > self.ttl:
+			return False
+		if publish_time is not None and entry[0] is not None:
+			return Translator.from_subtext(entry[0], datetime) == Translator.from_subtext(publish_time, datetime)
+		return True
+	
+	def get(self, key_id: UUID, publish_time: Optional[str] = None) -> bytes:
+		"""
+		Retrieve a public key, from the cache if possible.
+		
+		If publish_time (as reported by UserAPI.get_keys) is given and differs
+		from the cached entry's, the key is downloaded again.
+		"""
+		key_id = str(key_id)
+		entry = self._lookup(key_id)
+		if entry is not None and self._is_valid(entry, publish_time):
+			with self.lock:
+				self.hits += 1
+			return entry[1]
+		
+		with self.lock:
+			self.misses += 1
+		data, metadata = self.key_api.get_with_metadata(key_id)
+		self._store(key_id, (metadata.get('PublishTime', publish_time), data, time.time()))
+		return data
+	
+	def get_user_keys(self, session_id: UUID, user_id: UUID) -> Dict[str, bytes]:
+		"""
+		Retrieve all public keys of a user, keyed by key ID.
+		"""
+		user_id = str(user_id)
+		with self.lock:
+			listing = self.listings.get(user_id)
+		if listing is None or time.time() - listing[1] >= self.listing_ttl:
+			listing = (list(self.user_api.iter_keys(session_id, user_id)), time.time())
+			with self.lock:
+				self.listings[user_id] = listing
+		return {record['id']: self.get(record['id'], record.get('publishTime')) for record in listing[0]}
+	
+	def get_board_keys(self, session_id: UUID, board_api: BoardAPI, board_id: UUID) -> Dict[str, Dict[str, bytes]]:
+		"""
+		Retrieve the public keys of all members of a board, keyed by user ID
+		and then key ID.
+		"""
+		members = (getattr(member, 'user_id', member) for member in board_api.iter_members(session_id, board_id))
+		return {str(member_id): self.get_user_keys(session_id, member_id) for member_id in members}
+	
+	def invalidate(self, key_id: UUID):
+		"""
+		Drop a key from the cache.
+		"""
+		key_id = str(key_id)
+		with self.lock:
+			self.entries.pop(key_id, None)
+			if self.db is not None:
+				self.db.execute("DELETE FROM keys WHERE key_id = ?", (key_id,))
+				self.db.commit()
+	
+	def invalidate_user(self, user_id: UUID):
+		"""
+		Drop the cached key listing of a user.
+		"""
+		with self.lock:
+			self.listings.pop(str(user_id), None)
+	
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.listings.clear()
+			if self.db is not None:
+				self.db.execute("DELETE FROM keys")
+				self.db.commit()
+	
+	def close(self):
+		with self.lock:
+			if self.db is not None:
+				self.db.close()
+				self.db = None
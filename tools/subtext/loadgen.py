@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+subtext.loadgen - Load generator simulating a population of users.
+
+Run from the tools directory, against a real server or a stub:
+	
+	python -m subtext.loadgen --url http://localhost:5000 --users 500 --processes 4 --ramp 120 --duration 300 -o series.jsonl
+	python -m subtext.loadgen --stub --users 50 --duration 30 --mix poll=50,post=20
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse, json, multiprocessing, os, queue, random, sys, threading, time
+from uuid import UUID
+from datetime import datetime, timedelta
+
+from .common import APIError
+from .metrics import RequestInfo, Histogram
+from .session import UserSessionManager
+from .user import UserPresence
+
+DEFAULT_MIX = {
+	'heartbeat': 10,
+	'poll': 40,
+	'post': 15,
+	'get_boards': 10,
+	'get_user': 10,
+	'presence': 5,
+	'friend': 5,
+}
+
+# 1 ms to ~9 s in steps of 25%
+LATENCY_BUCKETS = tuple(0.001 * 1.25 ** i for i in range(42))
+
+def parse_mix(text: str) -> Dict[str, float]:
+	"""
+	Parse an action mix like 'poll=40,post=15'. Actions left out keep
+	their default weight; a weight of 0 disables an action.
+	"""
+	mix = dict(DEFAULT_MIX)
+	for item in filter(None, text.split(',')):
+		action, _, weight = item.partition('=')
+		if action not in DEFAULT_MIX:
+			raise ValueError("unknown action {!r}, expected one of {}".format(action, ', '.join(DEFAULT_MIX)))
+		mix[action] = float(weight)
+	return mix
+
+class IntervalRecorder:
+	"""
+	Instrumentation hook collecting per-endpoint latency histograms and
+	error counts, drained once per reporting interval.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.stats: Dict[str, Tuple[Histogram, Dict[str, int]]] = {}
+	
+	def post_request(self, info: RequestInfo):
+		key = info.method + ' ' + info.endpoint
+		with self.lock:
+			stats = self.stats.get(key)
+			if stats is None:
+				stats = self.stats[key] = (Histogram(LATENCY_BUCKETS), {})
+			stats[0].observe(info.latency)
+			if info.error is not None:
+				stats[1][info.error] = stats[1].get(info.error, 0) + 1
+	
+	def drain(self) -> Dict[str, Tuple[List[int], float, Dict[str, int]]]:
+		"""
+		Return and reset the stats as (bucket counts, latency sum, errors)
+		per endpoint.
+		"""
+		with self.lock:
+			stats, self.stats = self.stats, {}
+		return {key: (histogram.counts, histogram.sum, errors) for key, (histogram, errors) in stats.items()}
+
+class SimulatedUser:
+	"""
+	A user that creates an account, logs in and then performs random
+	actions from the mix with exponentially distributed think times.
+	"""
+	def __init__(self, client, name: str, password: str, rng: random.Random, mix: Dict[str, float], message_size: int):
+		self.client = client
+		self.name = name
+		self.password = password
+		self.rng = rng
+		self.actions = [action for action, weight in mix.items() if weight > 0]
+		self.weights = [mix[action] for action in self.actions]
+		self.message_size = message_size
+		self.user_id: Optional[UUID] = None
+		self.session: Optional[UserSessionManager] = None
+		self.boards: List[UUID] = []
+		self.since: Dict[UUID, str] = {}
+		self.peers: List['SimulatedUser'] = []
+		self.friends = set()
+		self.requested = set()
+		self.pending: List[UUID] = []
+	
+	def setup(self):
+		self.user_id = UUID(self.client.user.create(self.name, self.password))
+		self.session = UserSessionManager(self.client.user, self.user_id, self.password)
+		self.session.get()
+	
+	def step(self):
+		action = self.rng.choices(self.actions, self.weights)[0]
+		getattr(self, 'do_' + action)()
+	
+	def do_heartbeat(self):
+		self.session.call(self.client.user.heartbeat)
+	
+	def do_poll(self):
+		if not self.boards:
+			return
+		board_id = self.rng.choice(self.boards)
+		page = self.session.call(self.client.board.get_messages, board_id, since_time=self.since.get(board_id))
+		if page:
+			# Newest first
+			self.since[board_id] = page[0]['timestamp']
+	
+	def do_post(self):
+		if not self.boards:
+			return
+		self.session.call(self.client.board.post_message, self.rng.choice(self.boards), self.rng.randbytes(self.message_size))
+	
+	def do_get_boards(self):
+		self.session.call(self.client.board.get_boards)
+	
+	def do_get_user(self):
+		peer = self.rng.choice(self.peers) if self.peers else self
+		if peer.user_id is not None:
+			self.session.call(self.client.user.get, peer.user_id)
+	
+	def do_presence(self):
+		presence = self.rng.choice((UserPresence.online, UserPresence.away, UserPresence.busy))
+		until_time = None if presence == UserPresence.online else datetime.utcnow() + timedelta(hours=1)
+		self.session.call(self.client.user.set_presence, self.user_id, presence, until_time)
+	
+	def do_friend(self):
+		if self.pending:
+			sender = self.pending.pop()
+			self.session.call(self.client.user.accept_friend_request, self.user_id, sender)
+			self.friends.add(sender)
+			return
+		candidates = [peer for peer in self.peers if peer.user_id is not None and peer.user_id not in self.friends and peer.user_id not in self.requested]
+		if not candidates:
+			return
+		peer = self.rng.choice(candidates)
+		self.requested.add(peer.user_id)
+		self.session.call(self.client.user.send_friend_request, peer.user_id)
+		# Let the recipient accept it on one of its next friend actions
+		peer.pending.append(self.user_id)
+		peer.friends.add(self.user_id)
+		self.friends.add(peer.user_id)
+
+def _worker(index: int, options: Dict[str, Any], results: Any):
+	# Worker process entry point: run a share of the population and report
+	# stats to the parent once per interval
+	from . import Subtext
+	
+	users = options['users_per_process'][index]
+	start, deadline, interval = options['start'], options['start'] + options['duration'], options['interval']
+	client = Subtext(options['url'], pool_size=max(users, 1), max_retries=0)
+	recorder = IntervalRecorder()
+	client.instrumentation.add_hook(recorder)
+	rng = random.Random(options['seed'] * 1000 + index)
+	prefix = "load_{}_{}_".format(options['run_id'], index)
+	population = [SimulatedUser(client, prefix + str(i), "password_" + prefix, random.Random(rng.random()), options['mix'], options['message_size']) for i in range(users)]
+	for user in population:
+		user.peers = [peer for peer in population if peer is not user]
+	active = [0]
+	lock = threading.Lock()
+	boards_ready = threading.Event()
+	
+	def run_user(i: int, user: SimulatedUser):
+		# Spread the start of the users over the ramp-up period
+		delay = start + options['ramp'] * (index + i * len(options['users_per_process'])) / max(options['total_users'], 1) - time.time()
+		if delay > 0:
+			time.sleep(delay)
+		try:
+			user.setup()
+		except Exception:
+			if i == 0:
+				boards_ready.set()
+			return
+		if i == 0:
+			# The first user of each process owns the boards and adds the others as they arrive
+			for b in range(options['boards']):
+				try:
+					population[0].boards.append(UUID(user.session.call(client.board.create, "load_{}_{}_board{}".format(options['run_id'], index, b))))
+				except Exception:
+					pass
+			boards_ready.set()
+		else:
+			boards_ready.wait(max(deadline - time.time(), 0))
+			for board_id in list(population[0].boards):
+				try:
+					population[0].session.call(client.board.add_member, board_id, user.user_id)
+					user.boards.append(board_id)
+				except Exception:
+					pass
+		with lock:
+			active[0] += 1
+		while True:
+			time.sleep(user.rng.expovariate(1 / options['think_time']) if options['think_time'] > 0 else 0)
+			if time.time() >= deadline:
+				break
+			try:
+				user.step()
+			except (APIError, OSError, ValueError):
+				# Recorded by the instrumentation hook
+				pass
+		with lock:
+			active[0] -= 1
+	
+	threads = [threading.Thread(target=run_user, args=(i, user), daemon=True) for i, user in enumerate(population)]
+	for thread in threads:
+		thread.start()
+	
+	tick = 0
+	while any(thread.is_alive() for thread in threads) or tick * interval < options['duration']:
+		tick += 1
+		time.sleep(max(start + tick * interval - time.time(), 0))
+		results.put((index, tick - 1, active[0], recorder.drain()))
+		if time.time() >= deadline + options['interval'] * 5:
+			# Stragglers are still blocked in a request; stop waiting for them
+			break
+	results.put((index, None, 0, None))
+	client.close()
+
+def _merge(reports: List[Tuple[int, Dict[str, Tuple[List[int], float, Dict[str, int]]]]], interval: float) -> Dict[str, Any]:
+	endpoints: Dict[str, Any] = {}
+	merged: Dict[str, Tuple[Histogram, Dict[str, int]]] = {}
+	for _, stats in reports:
+		for key, (counts, latency_sum, errors) in stats.items():
+			histogram, all_errors = merged.setdefault(key, (Histogram(LATENCY_BUCKETS), {}))
+			for i, count in enumerate(counts):
+				histogram.counts[i] += count
+			histogram.count += sum(counts)
+			histogram.sum += latency_sum
+			for error, count in errors.items():
+				all_errors[error] = all_errors.get(error, 0) + count
+	total_count = total_errors = 0
+	for key, (histogram, errors) in sorted(merged.items()):
+		error_count = sum(errors.values())
+		total_count += histogram.count
+		total_errors += error_count
+		endpoints[key] = {
+			'count': histogram.count,
+			'rps': histogram.count / interval,
+			'errors': errors,
+			'error_rate': error_count / histogram.count if histogram.count else 0.0,
+			'mean_ms': histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+			'p50_ms': histogram.quantile(0.5) * 1000,
+			'p99_ms': histogram.quantile(0.99) * 1000,
+		}
+	return {
+		'users': sum(users for users, _ in reports),
+		'rps': total_count / interval,
+		'error_rate': total_errors / total_count if total_count else 0.0,
+		'endpoints': endpoints,
+	}
+
+def run(url: Optional[str] = None, users: int = 10, processes: int = 1, duration: float = 60, ramp: float = 0, interval: float = 1.0, mix: Optional[Dict[str, float]] = None, think_time: float = 1.0, message_size: int = 256, boards: int = 2, seed: int = 0, stub_latency: float = 0.0, output: Optional[Any] = None, progress: bool = False) -> List[Dict[str, Any]]:
+	"""
+	Generate load and return the time series, one entry per interval.
+	
+	users are split evenly over worker processes, each running one thread
+	per user. Without a url a StubServer is started in this process. Each
+	entry holds the number of active users, the request rate, the error
+	rate and per-endpoint rates and latencies. If output is given (a file
+	object), entries are written to it as JSON lines as they complete.
+	"""
+	server = None
+	if url is None:
+		from .stub import StubServer
+		server = StubServer(latency=stub_latency)
+		server.start()
+		url = server.url
+	processes = max(1, min(processes, users))
+	options = {
+		'url': url,
+		'users_per_process': [users // processes + (1 if i < users % processes else 0) for i in range(processes)],
+		'total_users': users,
+		'start': time.time() + 2.0,
+		'duration': duration,
+		'ramp': ramp,
+		'interval': interval,
+		'mix': mix or dict(DEFAULT_MIX),
+		'think_time': think_time,
+		'message_size': message_size,
+		'boards': boards,
+		'seed': seed,
+		'run_id': os.urandom(3).hex(),
+	}
+	# Workers must not inherit the stub's threads
+	context = multiprocessing.get_context('spawn')
+	results = context.Queue()
+	workers = [context.Process(target=_worker, args=(i, options, results), daemon=True) for i in range(processes)]
+	for worker in workers:
+		worker.start()
+	
+	series: List[Dict[str, Any]] = []
+	pending: Dict[int, List[Tuple[int, Any]]] = {}
+	# Last interval reported by each worker, None once it finished
+	reported: Dict[int, Optional[int]] = {i: -1 for i in range(processes)}
+	next_tick = 0
+	
+	def flush(tick: int):
+		entry = _merge(pending.pop(tick, []), interval)
+		entry['t'] = (tick + 1) * interval
+		series.append(entry)
+		if output is not None:
+			output.write(json.dumps(entry) + '\n')
+			output.flush()
+		if progress:
+			print("t={:>6.1f}s users={:>5} rps={:>8.1f} errors={:>6.2%}".format(entry['t'], entry['users'], entry['rps'], entry['error_rate']), file=sys.stderr)
+	
+	try:
+		while any(tick is not None for tick in reported.values()):
+			try:
+				index, tick, active, stats = results.get(timeout=duration + ramp + 60)
+			except queue.Empty:
+				break
+			reported[index] = tick
+			if tick is not None:
+				pending.setdefault(tick, []).append((active, stats))
+			# An interval is complete once every worker reported it or finished
+			while next_tick in pending and all(tick is None or tick >= next_tick for tick in reported.values()):
+				flush(next_tick)
+				next_tick += 1
+		for tick in sorted(pending):
+			flush(tick)
+	finally:
+		for worker in workers:
+			worker.join(5)
+			if worker.is_alive():
+				worker.terminate()
+		if server is not None:
+			server.stop()
+	return series
+
+def summarize(series: List[Dict[str, Any]]) -> str:
+	"""
+	Summarize a time series per endpoint over the whole run, and locate the
+	interval with the highest request rate.
+	"""
+	totals: Dict[str, List[float]] = {}
+	for entry in series:
+		for key, stats in entry['endpoints'].items():
+			total = totals.setdefault(key, [0, 0, 0.0, 0.0])
+			total[0] += stats['count']
+			total[1] += stats['error_rate'] * stats['count']
+			total[2] += stats['mean_ms'] * stats['count']
+			total[3] = max(total[3], stats['p99_ms'])
+	lines = ["{:<44} {:>8} {:>8} {:>9} {:>10}".format("endpoint", "count", "errors", "mean ms", "max p99")]
+	for key, (count, errors, mean_total, p99) in sorted(totals.items()):
+		lines.append("{:<44} {:>8} {:>8.0f} {:>9.2f} {:>10.2f}".format(key, count, errors, mean_total / count if count else 0.0, p99))
+	if series:
+		peak = max(series, key=lambda entry: entry['rps'])
+		lines.append("peak: {:.1f} req/s at t={:.0f}s with {} users".format(peak['rps'], peak['t'], peak['users']))
+	return '\n'.join(lines)
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(prog='python -m subtext.loadgen', description="Simulate a population of Subtext users.")
+	target = parser.add_mutually_exclusive_group(required=True)
+	target.add_argument('--url', help="server to load")
+	target.add_argument('--stub', action='store_true', help="load a stub server started in this process")
+	parser.add_argument('-u', '--users', type=int, default=10)
+	parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1)
+	parser.add_argument('-d', '--duration', type=float, default=60, help="seconds, including the ramp-up")
+	parser.add_argument('--ramp', type=float, default=0, help="seconds over which the users start")
+	parser.add_argument('-i', '--interval', type=float, default=1.0, help="reporting interval in seconds")
+	parser.add_argument('--mix', default='', help="action weights, e.g. poll=40,post=15 (actions: {})".format(', '.join(DEFAULT_MIX)))
+	parser.add_argument('--think-time', type=float, default=1.0, help="mean seconds between a user's actions")
+	parser.add_argument('--message-size', type=int, default=256)
+	parser.add_argument('--boards', type=int, default=2, help="boards per process")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--stub-latency', type=float, default=0.0)
+	parser.add_argument('-o', '--output', help="write the time series as JSON lines")
+	args = parser.parse_args(argv)
+	
+	output = open(args.output, 'w') if args.output else None
+	try:
+		series = run(args.url, args.users, args.processes, args.duration, args.ramp, args.interval, parse_mix(args.mix), args.think_time, args.message_size, args.boards, args.seed, args.stub_latency, output, progress=True)
+	finally:
+		if output is not None:
+			output.close()
+	print(summarize(series))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
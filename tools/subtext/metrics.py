@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+subtext.metrics - Request instrumentation and metrics collection.
+"""
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect, json, re, threading
+from urllib.parse import urlsplit
+
+_UUID_SEGMENT = re.compile(r'/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=/|$)')
+
+def endpoint_template(url: str) -> str:
+	"""
+	Turn a request URL into its endpoint template, e.g.
+	http://host/Subtext/board/<uuid>/messages -> /Subtext/board/{}/messages
+	"""
+	return _UUID_SEGMENT.sub('/{}', urlsplit(url).path) or '/'
+
+def _error_code(status: int, content_type: str, content: bytes) -> Optional[str]:
+	if status // 100 == 2:
+		return None
+	if content_type.startswith('application/json'):
+		try:
+			return json.loads(content)['error']
+		except (ValueError, KeyError, TypeError):
+			pass
+	return str(status)
+
+def _counted(chunks: Iterator[bytes], info: 'RequestInfo') -> Iterator[bytes]:
+	# Streamed bodies are sent without a Content-Length; count them as they go
+	for chunk in chunks:
+		info.bytes_out += len(chunk)
+		yield chunk
+
+async def _acounted(chunks: AsyncIterator[bytes], info: 'RequestInfo') -> AsyncIterator[bytes]:
+	async for chunk in chunks:
+		info.bytes_out += len(chunk)
+		yield chunk
+
+class RequestInfo:
+	"""
+	Information about a single request, passed to instrumentation hooks.
+	
+	error is the APIError code for failed requests ('SessionExpired',
+	'NoObjectWithId', ...), the exception class name if no response was
+	received, and None on success.
+	"""
+	__slots__ = ('method', 'url', 'endpoint', 'start', 'latency', 'bytes_out', 'bytes_in', 'status', 'error')
+	
+	def __init__(self, method: str, url: str):
+		self.method = method
+		self.url = url
+		self.endpoint = endpoint_template(url)
+		self.start = 0.0
+		self.latency = 0.0
+		self.bytes_out = 0
+		self.bytes_in = 0
+		self.status = 0
+		self.error: Optional[str] = None
+
+class Instrumentation:
+	"""
+	Dispatches request events to pluggable hooks.
+	
+	A hook is any object with a pre_request(info) and/or post_request(info)
+	method taking a RequestInfo. Hooks run on the thread (or event loop)
+	making the request and should be quick.
+	"""
+	def __init__(self):
+		self.hooks: List[Any] = []
+	
+	def add_hook(self, hook: Any):
+		self.hooks.append(hook)
+	
+	def remove_hook(self, hook: Any):
+		self.hooks.remove(hook)
+	
+	def pre_request(self, info: RequestInfo):
+		for hook in self.hooks:
+			if hasattr(hook, 'pre_request'):
+				hook.pre_request(info)
+	
+	def post_request(self, info: RequestInfo):
+		for hook in self.hooks:
+			if hasattr(hook, 'post_request'):
+				hook.post_request(info)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+	"""
+	Cumulative latency histogram with fixed bucket bounds.
+	"""
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+	
+	def observe(self, value: float):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+	
+	def quantile(self, q: float) -> float:
+		"""
+		Estimate a quantile as the upper bound of the bucket it falls in.
+		"""
+		if self.count == 0:
+			return 0.0
+		rank = q * self.count
+		seen = 0
+		for bound, count in zip(self.buckets, self.counts):
+			seen += count
+			if seen >= rank:
+				return bound
+		return float('inf')
+
+class HistogramCollector:
+	"""
+	In-memory collector of per-endpoint latency histograms, request and error
+	counts and bytes transferred.
+	"""
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.buckets = tuple(buckets)
+		self.lock = threading.Lock()
+		# (method, endpoint) -> Histogram
+		self.latency: Dict[Tuple[str, str], Histogram] = {}
+		# (method, endpoint, status) -> count
+		self.requests: Dict[Tuple[str, str, int], int] = {}
+		# (method, endpoint, error) -> count
+		self.errors: Dict[Tuple[str, str, str], int] = {}
+		# (method, endpoint) -> bytes
+		self.bytes_out: Dict[Tuple[str, str], int] = {}
+		self.bytes_in: Dict[Tuple[str, str], int] = {}
+		# name -> (help, {labels: value})
+		self.gauges: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, Any], ...], float]]] = {}
+		self.counters: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, Any], ...], float]]] = {}
+	
+	def post_request(self, info: RequestInfo):
+		key = (info.method, info.endpoint)
+		with self.lock:
+			histogram = self.latency.get(key)
+			if histogram is None:
+				histogram = self.latency[key] = Histogram(self.buckets)
+			histogram.observe(info.latency)
+			status_key = (info.method, info.endpoint, info.status)
+			self.requests[status_key] = self.requests.get(status_key, 0) + 1
+			if info.error is not None:
+				error_key = (info.method, info.endpoint, info.error)
+				self.errors[error_key] = self.errors.get(error_key, 0) + 1
+			self.bytes_out[key] = self.bytes_out.get(key, 0) + info.bytes_out
+			self.bytes_in[key] = self.bytes_in.get(key, 0) + info.bytes_in
+	
+	def set_gauge(self, name: str, value: float, help: str = "", **labels):
+		with self.lock:
+			values = self.gauges.setdefault(name, (help, {}))[1]
+			values[tuple(sorted(labels.items()))] = value
+	
+	def inc_counter(self, name: str, amount: float = 1, help: str = "", **labels):
+		with self.lock:
+			values = self.counters.setdefault(name, (help, {}))[1]
+			key = tuple(sorted(labels.items()))
+			values[key] = values.get(key, 0) + amount
+	
+	def summary(self) -> List[dict]:
+		"""
+		Per-endpoint summary, slowest total time first.
+		"""
+		with self.lock:
+			rows = [{
+				'method': method,
+				'endpoint': endpoint,
+				'count': histogram.count,
+				'total': histogram.sum,
+				'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+				'p50': histogram.quantile(0.5),
+				'p99': histogram.quantile(0.99),
+				'bytes_out': self.bytes_out.get((method, endpoint), 0),
+				'bytes_in': self.bytes_in.get((method, endpoint), 0),
+			} for (method, endpoint), histogram in self.latency.items()]
+		rows.sort(key=lambda row: row['total'], reverse=True)
+		return rows
+
+def _labels(**labels) -> str:
+	return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items()) + '}'
+
+def prometheus_text(collector: HistogramCollector, prefix: str = 'subtext_client') -> str:
+	"""
+	Render the contents of a collector in the Prometheus text exposition format.
+	"""
+	lines = []
+	with collector.lock:
+		lines.append('# HELP {}_request_duration_seconds Request latency.'.format(prefix))
+		lines.append('# TYPE {}_request_duration_seconds histogram'.format(prefix))
+		for (method, endpoint), histogram in sorted(collector.latency.items()):
+			cumulative = 0
+			for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+				cumulative += count
+				le = '+Inf' if bound == float('inf') else repr(bound)
+				lines.append('{}_request_duration_seconds_bucket{} {}'.format(prefix, _labels(method=method, endpoint=endpoint, le=le), cumulative))
+			lines.append('{}_request_duration_seconds_sum{} {}'.format(prefix, _labels(method=method, endpoint=endpoint), histogram.sum))
+			lines.append('{}_request_duration_seconds_count{} {}'.format(prefix, _labels(method=method, endpoint=endpoint), histogram.count))
+		
+		lines.append('# HELP {}_requests_total Requests by response status.'.format(prefix))
+		lines.append('# TYPE {}_requests_total counter'.format(prefix))
+		for (method, endpoint, status), count in sorted(collector.requests.items()):
+			lines.append('{}_requests_total{} {}'.format(prefix, _labels(method=method, endpoint=endpoint, status=status), count))
+		
+		lines.append('# HELP {}_errors_total Failed requests by API error code.'.format(prefix))
+		lines.append('# TYPE {}_errors_total counter'.format(prefix))
+		for (method, endpoint, error), count in sorted(collector.errors.items()):
+			lines.append('{}_errors_total{} {}'.format(prefix, _labels(method=method, endpoint=endpoint, error=error), count))
+		
+		for name, direction in (('sent', collector.bytes_out), ('received', collector.bytes_in)):
+			lines.append('# HELP {}_bytes_{}_total Body bytes {}.'.format(prefix, name, name))
+			lines.append('# TYPE {}_bytes_{}_total counter'.format(prefix, name))
+			for (method, endpoint), count in sorted(direction.items()):
+				lines.append('{}_bytes_{}_total{} {}'.format(prefix, name, _labels(method=method, endpoint=endpoint), count))
+		
+		for kind, metrics in (('counter', collector.counters), ('gauge', collector.gauges)):
+			for name, (help, values) in sorted(metrics.items()):
+				lines.append('# HELP {}_{} {}'.format(prefix, name, help))
+				lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+				for labels, value in sorted(values.items()):
+					lines.append('{}_{}{} {}'.format(prefix, name, _labels(**dict(labels)) if labels else '', value))
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+subtext.models - Typed response models.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Type
+import array, base64, collections.abc
+from enum import Enum
+from uuid import UUID
+from datetime import datetime, timezone
+
+from .common import Translator
+from .board import BoardEncryption
+from .user import UserPresence
+
+_UNSET = object()
+_NO_ID = bytes(16)
+_MESSAGE_KEYS = ('id', 'timestamp', 'authorId', 'isSystem', 'type', 'content')
+
+def _decode(value: Any, kind: Optional[Type]) -> Any:
+	if value is None or kind is None:
+		return value
+	if issubclass(kind, Enum):
+		# System.Text.Json writes enums as their ordinal
+		return list(kind)[value] if isinstance(value, int) else kind(value)
+	return Translator.from_subtext(value, kind)
+
+def _encode(value: Any) -> Any:
+	if isinstance(value, UUID):
+		return str(value)
+	if isinstance(value, datetime):
+		# The server sends UTC timestamps without an offset
+		if value.tzinfo is not None:
+			value = value.astimezone(timezone.utc).replace(tzinfo=None)
+		return value.isoformat()
+	if isinstance(value, (bytes, bytearray, memoryview)):
+		return base64.b64encode(value).decode('ascii')
+	if isinstance(value, Enum):
+		return list(type(value)).index(value)
+	return value
+
+class _Field:
+	"""
+	Model attribute decoded from the raw JSON value on first access.
+	"""
+	def __init__(self, key: str, kind: Optional[Type] = None):
+		self.key = key
+		self.kind = kind
+	
+	def __set_name__(self, owner, name: str):
+		self.name = name
+		self.slot = '_' + name
+	
+	def __get__(self, obj, owner=None) -> Any:
+		if obj is None:
+			return self
+		value = getattr(obj, self.slot, _UNSET)
+		if value is _UNSET:
+			value = _decode(obj._raw.get(self.key), self.kind)
+			setattr(obj, self.slot, value)
+		return value
+
+class Model:
+	"""
+	Base class of the response models.
+	
+	Models keep the raw JSON object and decode each field (base64, ISO 8601
+	timestamps, UUIDs, enums) the first time it is accessed. Indexing a model
+	with a JSON key returns the raw value, so code written against the plain
+	dicts keeps working.
+	"""
+	__slots__ = ('_raw',)
+	_fields: Dict[str, _Field] = {}
+	
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._fields = {field.key: field for field in vars(cls).values() if isinstance(field, _Field)}
+	
+	def __init__(self, raw: Dict[str, Any]):
+		self._raw = raw
+	
+	def __getitem__(self, key: str) -> Any:
+		if key in self._raw:
+			return self._raw[key]
+		field = self._fields.get(key)
+		if field is None:
+			raise KeyError(key)
+		return _encode(field.__get__(self))
+	
+	def get(self, key: str, default: Any = None) -> Any:
+		try:
+			return self[key]
+		except KeyError:
+			return default
+	
+	def to_dict(self) -> Dict[str, Any]:
+		"""
+		Get the model as a JSON-compatible dict.
+		"""
+		return {key: self[key] for key in self._fields}
+	
+	def __repr__(self) -> str:
+		return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(field.name, field.__get__(self)) for field in self._fields.values()))
+	
+	def __eq__(self, other: Any) -> bool:
+		return type(self) is type(other) and self.to_dict() == other.to_dict()
+	
+	__hash__ = None
+
+class Message(Model):
+	__slots__ = ('_id', '_timestamp', '_author_id', '_is_system', '_type', '_content')
+	id = _Field('id', UUID)
+	timestamp = _Field('timestamp', datetime)
+	author_id = _Field('authorId', UUID)
+	is_system = _Field('isSystem')
+	type = _Field('type')
+	content = _Field('content', bytes)
+	
+	@property
+	def has_content(self) -> bool:
+		"""
+		False if the server left out the content because it is too large.
+		"""
+		return self.content is not None
+
+class Board(Model):
+	__slots__ = ('_id', '_name', '_owner_id', '_encryption', '_last_update', '_last_significant_update', '_is_direct')
+	id = _Field('id', UUID)
+	name = _Field('name')
+	owner_id = _Field('ownerId', UUID)
+	encryption = _Field('encryption', BoardEncryption)
+	last_update = _Field('lastUpdate', datetime)
+	last_significant_update = _Field('lastSignificantUpdate', datetime)
+	is_direct = _Field('isDirect')
+
+class User(Model):
+	__slots__ = ('_id', '_name', '_presence', '_last_active', '_status', '_is_deleted')
+	id = _Field('id', UUID)
+	name = _Field('name')
+	presence = _Field('presence', UserPresence)
+	last_active = _Field('lastActive', datetime)
+	status = _Field('status')
+	is_deleted = _Field('isDeleted')
+
+class MemberRecord(Model):
+	__slots__ = ('_board_id', '_user_id')
+	board_id = _Field('boardId', UUID)
+	user_id = _Field('userId', UUID)
+
+class PublicKey(Model):
+	__slots__ = ('_id', '_owner_id', '_publish_time', '_key_data')
+	id = _Field('id', UUID)
+	owner_id = _Field('ownerId', UUID)
+	publish_time = _Field('publishTime', datetime)
+	key_data = _Field('keyData', bytes)
+
+class AuditLogEntry(Model):
+	__slots__ = ('_id', '_admin_id', '_action', '_details', '_timestamp')
+	id = _Field('id', UUID)
+	admin_id = _Field('adminId', UUID)
+	action = _Field('action')
+	details = _Field('details')
+	timestamp = _Field('timestamp', datetime)
+
+def _id_bytes(value: Any) -> bytes:
+	# Much cheaper than UUID(value).bytes
+	return bytes.fromhex(str(value).replace('-', ''))
+
+class MessagePage(collections.abc.Sequence):
+	"""
+	Columnar container of messages.
+	
+	Instead of one dict per message, IDs are packed into byte arrays, flags
+	into a bytearray and message types into indices of a shared table.
+	Timestamps and contents are kept as the strings the server sent and
+	only decoded when they are accessed; the server's timestamps have 100 ns
+	precision that neither floats nor datetimes can hold, so the strings are
+	also what message['timestamp'] returns, e.g. for BoardSync's cursor.
+	Indexing returns a Message built from the columns.
+	"""
+	__slots__ = ('_ids', '_authors', '_times', '_stamps', '_system', '_types', '_type_names', '_type_index', '_contents')
+	
+	def __init__(self, messages: Iterable[Dict[str, Any]] = ()):
+		self._ids = bytearray()
+		self._authors = bytearray()
+		self._stamps: List[str] = []
+		# POSIX times, built by timestamps() on first call
+		self._times: Optional[array.array] = None
+		self._system = bytearray()
+		self._types = array.array('H')
+		self._type_names: List[str] = []
+		self._type_index: Dict[str, int] = {}
+		self._contents: List[Optional[str]] = []
+		self.extend(messages)
+	
+	def append(self, message: Dict[str, Any]):
+		self._ids += _id_bytes(message['id'])
+		author = message.get('authorId')
+		self._authors += _id_bytes(author) if author is not None else _NO_ID
+		self._stamps.append(message['timestamp'])
+		self._times = None
+		self._system.append(1 if message.get('isSystem') else 0)
+		msg_type = message.get('type')
+		index = self._type_index.get(msg_type)
+		if index is None:
+			index = self._type_index[msg_type] = len(self._type_names)
+			self._type_names.append(msg_type)
+		self._types.append(index)
+		self._contents.append(message.get('content'))
+	
+	def extend(self, messages: Iterable[Dict[str, Any]]):
+		if isinstance(messages, MessagePage):
+			for i in range(len(messages)):
+				self.append(messages._raw(i))
+			return
+		for message in messages:
+			self.append(message)
+	
+	def __len__(self) -> int:
+		return len(self._contents)
+	
+	def _id(self, column: bytearray, i: int) -> Optional[UUID]:
+		value = bytes(column[i * 16:(i + 1) * 16])
+		return UUID(bytes=value) if value != _NO_ID else None
+	
+	def timestamp(self, i: int) -> datetime:
+		return Translator.from_subtext(self._stamps[i], datetime)
+	
+	def _field(self, i: int, key: str) -> Any:
+		if key == 'id':
+			return str(self._id(self._ids, i))
+		if key == 'timestamp':
+			return self._stamps[i]
+		if key == 'authorId':
+			author = self._id(self._authors, i)
+			return str(author) if author is not None else None
+		if key == 'isSystem':
+			return bool(self._system[i])
+		if key == 'type':
+			return self._type_names[self._types[i]]
+		if key == 'content':
+			return self._contents[i]
+		raise KeyError(key)
+	
+	def _raw(self, i: int) -> Dict[str, Any]:
+		return {key: self._field(i, key) for key in _MESSAGE_KEYS}
+	
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return MessagePage(self._raw(i) for i in range(*index.indices(len(self))))
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("index out of range")
+		return Message(_MessageColumns(self, index))
+	
+	def ids(self) -> List[UUID]:
+		return [self._id(self._ids, i) for i in range(len(self))]
+	
+	def timestamps(self) -> array.array:
+		"""
+		POSIX timestamps of all messages.
+		"""
+		if self._times is None:
+			self._times = array.array('d', (Translator.from_subtext(stamp, datetime).timestamp() for stamp in self._stamps))
+		return self._times
+	
+	def missing_content(self) -> List[int]:
+		"""
+		Indices of the messages whose content was left out by the server.
+		"""
+		return [i for i, content in enumerate(self._contents) if content is None]
+	
+	def __repr__(self) -> str:
+		return 'MessagePage({} messages)'.format(len(self))
+
+class _MessageColumns(collections.abc.Mapping):
+	"""
+	Raw message of a MessagePage, read from the columns only when a key is
+	looked up.
+	"""
+	__slots__ = ('page', 'index')
+	
+	def __init__(self, page: MessagePage, index: int):
+		self.page = page
+		self.index = index
+	
+	def __getitem__(self, key: str) -> Any:
+		return self.page._field(self.index, key)
+	
+	def __contains__(self, key: Any) -> bool:
+		return key in _MESSAGE_KEYS
+	
+	def __iter__(self):
+		return iter(_MESSAGE_KEYS)
+	
+	def __len__(self) -> int:
+		return len(_MESSAGE_KEYS)
+
+def wrap(model: Any, value: Any) -> Any:
+	"""
+	Wrap a JSON result (an object or a list of objects) in a model.
+	"""
+	if model is MessagePage:
+		return MessagePage(value)
+	if isinstance(value, list):
+		return [model(item) for item in value]
+	return model(value)
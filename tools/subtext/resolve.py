@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+subtext.resolve - Cached resolution of user names to IDs.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+import collections, concurrent.futures, threading, time
+from uuid import UUID
+
+from .common import APIError
+from .user import UserAPI
+
+class NameResolver:
+	"""
+	Resolves user names to user IDs through UserAPI.query_id_by_name,
+	e.g. for the @mentions in messages.
+	
+	Results are kept in a bounded LRU: IDs for ttl seconds, and names that
+	don't exist (negative results) for negative_ttl seconds, so repeated
+	lookups of a typo don't reach the server either. resolve_many() answers
+	what it can from the cache and looks up the rest concurrently on up to
+	max_workers threads.
+	
+	The resolver registers itself with the UserAPI: deleting a user through
+	it drops the user's name (the server renames deleted users, freeing the
+	name), and creating one drops a cached "not found" for its name.
+	"""
+	def __init__(self, user_api: UserAPI, max_entries: int = 4096, ttl: float = 300.0, negative_ttl: float = 30.0, max_workers: int = 8):
+		self.user_api = user_api
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.max_workers = max_workers
+		self.lock = threading.Lock()
+		# name -> (user ID or None if not found, expiry)
+		self.entries: 'collections.OrderedDict[str, Tuple[Optional[UUID], float]]' = collections.OrderedDict()
+		# user ID -> name, for invalidation
+		self.names: Dict[UUID, str] = {}
+		# Bumped by every invalidation, so lookups racing with one don't
+		# store what may already be stale
+		self.generation = 0
+		self.hits = 0
+		self.negative_hits = 0
+		self.misses = 0
+		self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+		user_api.on_create.append(self._created)
+		user_api.on_delete.append(self.invalidate_id)
+	
+	def _lookup(self, name: str, now: float) -> Tuple[bool, Optional[UUID]]:
+		# Must be called with the lock held
+		entry = self.entries.get(name)
+		if entry is None:
+			return False, None
+		if entry[1] <= now:
+			self._drop(name)
+			return False, None
+		self.entries.move_to_end(name)
+		if entry[0] is None:
+			self.negative_hits += 1
+		else:
+			self.hits += 1
+		return True, entry[0]
+	
+	def _drop(self, name: str):
+		# Must be called with the lock held
+		entry = self.entries.pop(name, None)
+		if entry is not None and entry[0] is not None and self.names.get(entry[0]) == name:
+			del self.names[entry[0]]
+	
+	def _store(self, name: str, user_id: Optional[UUID], generation: int):
+		with self.lock:
+			if generation != self.generation:
+				return
+			self._drop(name)
+			self.entries[name] = (user_id, time.monotonic() + (self.ttl if user_id is not None else self.negative_ttl))
+			if user_id is not None:
+				self.names[user_id] = name
+			while len(self.entries) > self.max_entries:
+				self._drop(next(iter(self.entries)))
+	
+	def _fetch(self, name: str, generation: int) -> Optional[UUID]:
+		try:
+			user_id: Optional[UUID] = UUID(str(self.user_api.query_id_by_name(name)))
+		except APIError as e:
+			if e.status_code != 404:
+				raise
+			user_id = None
+		self._store(name, user_id, generation)
+		return user_id
+	
+	def resolve(self, name: str) -> Optional[UUID]:
+		"""
+		Get the ID of a user by name, or None if there is no such user.
+		"""
+		with self.lock:
+			found, user_id = self._lookup(name, time.monotonic())
+			if found:
+				return user_id
+			self.misses += 1
+			generation = self.generation
+		return self._fetch(name, generation)
+	
+	def resolve_many(self, names: Iterable[str]) -> Dict[str, Optional[UUID]]:
+		"""
+		Resolve a batch of names, returning a dict mapping each name to its
+		user ID or None.
+		"""
+		results: Dict[str, Optional[UUID]] = {}
+		missing = []
+		with self.lock:
+			now = time.monotonic()
+			for name in dict.fromkeys(names):
+				found, user_id = self._lookup(name, now)
+				if found:
+					results[name] = user_id
+				else:
+					missing.append(name)
+			self.misses += len(missing)
+			generation = self.generation
+		if len(missing) == 1:
+			results[missing[0]] = self._fetch(missing[0], generation)
+		elif missing:
+			futures = {self.executor.submit(self._fetch, name, generation): name for name in missing}
+			for future, name in futures.items():
+				results[name] = future.result()
+		return results
+	
+	@property
+	def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+		with self.lock:
+			if self._executor is None:
+				self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='subtext-resolve')
+			return self._executor
+	
+	def invalidate(self, name: Optional[str] = None):
+		"""
+		Forget a name (or all names).
+		"""
+		with self.lock:
+			self.generation += 1
+			if name is None:
+				self.entries.clear()
+				self.names.clear()
+			else:
+				self._drop(name)
+	
+	def invalidate_id(self, user_id: UUID):
+		"""
+		Forget the name of a user, e.g. after it was deleted or renamed.
+		"""
+		with self.lock:
+			self.generation += 1
+			name = self.names.get(UUID(str(user_id)))
+			if name is not None:
+				self._drop(name)
+	
+	def _created(self, name: str, user_id: UUID):
+		with self.lock:
+			self.generation += 1
+			self._drop(name)
+	
+	def stats(self) -> Dict[str, int]:
+		with self.lock:
+			return {
+				'entries': len(self.entries),
+				'hits': self.hits,
+				'negative_hits': self.negative_hits,
+				'misses': self.misses,
+			}
+	
+	def close(self):
+		"""
+		Stop resolving in the background and unregister from the UserAPI.
+		"""
+		if self._created in self.user_api.on_create:
+			self.user_api.on_create.remove(self._created)
+		if self.invalidate_id in self.user_api.on_delete:
+			self.user_api.on_delete.remove(self.invalidate_id)
+		with self.lock:
+			executor, self._executor = self._executor, None
+		if executor is not None:
+			executor.shutdown()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
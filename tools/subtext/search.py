@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+subtext.search - Local full-text index of board messages.
+"""
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+import re, sqlite3, threading
+from uuid import UUID
+from datetime import datetime, timezone
+
+from .common import Translator, message_content
+
+_TOKEN = re.compile(r'\S+')
+
+def _match_expression(query: str) -> str:
+	# Quote every term so user input can't be parsed as FTS5 syntax; a
+	# trailing * still makes a prefix query.
+	terms = []
+	for token in _TOKEN.findall(query):
+		prefix = token.endswith('*') and len(token) > 1
+		token = token.rstrip('*').replace('"', '""')
+		if token:
+			terms.append('"{}"{}'.format(token, '*' if prefix else ''))
+	return ' '.join(terms)
+
+def _posix(value: Union[datetime, str, float, None]) -> Optional[float]:
+	if value is None or isinstance(value, (int, float)):
+		return value
+	if isinstance(value, str):
+		value = Translator.from_subtext(value, datetime)
+	if value.tzinfo is None:
+		# The server sends UTC timestamps without an offset
+		value = value.replace(tzinfo=timezone.utc)
+	return value.timestamp()
+
+def _text(message: Any) -> Optional[str]:
+	content = message_content(message)
+	if content is None:
+		return None
+	return str(content, 'utf-8', errors='replace')
+
+class SearchHit:
+	"""
+	A message matching a search, best match first. snippet is an excerpt of
+	the text with the matching terms wrapped in [ and ].
+	"""
+	__slots__ = ('board_id', 'message_id', 'author_id', 'timestamp', 'type', 'score', 'snippet')
+	
+	def __init__(self, board_id: str, message_id: str, author_id: Optional[str], timestamp: float, msg_type: Optional[str], score: float, snippet: str):
+		self.board_id = board_id
+		self.message_id = message_id
+		self.author_id = author_id
+		self.timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+		self.type = msg_type
+		self.score = score
+		self.snippet = snippet
+	
+	def __repr__(self) -> str:
+		return 'SearchHit({}, {}, {:.3f}, {!r})'.format(self.board_id, self.message_id, self.score, self.snippet)
+
+class SearchIndex:
+	"""
+	Full-text index of decrypted messages, stored in SQLite (FTS5).
+	
+	The server only has ciphertext, so search has to happen on the client.
+	Messages are added as they are fetched and decrypted, e.g. from the
+	result of BoardSync.sync(), and never need to be downloaded again to be
+	searched. Message metadata lives in an ordinary table joined with the
+	FTS5 table on its rowid, so board, author and time filters are applied
+	to the matches of the text query. Adding a message that is already
+	indexed does nothing.
+	
+	With a file path the index survives restarts.
+	"""
+	def __init__(self, path: str = ":memory:", tokenizer: str = "unicode61 remove_diacritics 2"):
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		if path != ":memory:":
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, board_id TEXT NOT NULL, message_id TEXT NOT NULL UNIQUE, author_id TEXT, timestamp REAL NOT NULL, type TEXT)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS messages_board_time ON messages (board_id, timestamp)")
+		self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, tokenize = '{}')".format(tokenizer.replace("'", "''")))
+		self.db.commit()
+	
+	def add(self, board_id: UUID, message: Any, text: str) -> bool:
+		"""
+		Index the text of a message (a dict or Message as returned by
+		BoardAPI.get_messages). Returns False if it was already indexed.
+		"""
+		return self.add_many(board_id, ((message, text),)) == 1
+	
+	def add_many(self, board_id: UUID, items: Iterable[Tuple[Any, Optional[str]]]) -> int:
+		"""
+		Index (message, text) pairs in a single transaction. Pairs without
+		text are skipped. Returns the number of messages added.
+		"""
+		board_id = str(board_id)
+		added = 0
+		with self.lock:
+			with self.db:
+				for message, text in items:
+					if text is None:
+						continue
+					author = message.get('authorId')
+					cur = self.db.execute("INSERT OR IGNORE INTO messages (board_id, message_id, author_id, timestamp, type) VALUES (?, ?, ?, ?, ?)", (
+						board_id, str(message['id']), str(author) if author is not None else None, _posix(message['timestamp']), message.get('type')
+					))
+					if cur.rowcount:
+						self.db.execute("INSERT INTO messages_fts (rowid, text) VALUES (?, ?)", (cur.lastrowid, text))
+						added += 1
+		return added
+	
+	def ingest(self, board_id: UUID, messages: Iterable[Any], decrypt: Optional[Callable[[Any], Optional[str]]] = None) -> int:
+		"""
+		Index a page of messages. decrypt(message) returns the text of a
+		message, or None to skip it; without it the content is read as
+		UTF-8 (for boards without encryption). Messages whose content was
+		left out by the server are skipped by the default, so fetch those
+		separately and pass them to add().
+		"""
+		decrypt = decrypt or _text
+		return self.add_many(board_id, ((message, decrypt(message)) for message in messages))
+	
+	def remove(self, message_id: UUID):
+		with self.lock:
+			with self.db:
+				row = self.db.execute("SELECT id FROM messages WHERE message_id = ?", (str(message_id),)).fetchone()
+				if row is not None:
+					self.db.execute("DELETE FROM messages_fts WHERE rowid = ?", row)
+					self.db.execute("DELETE FROM messages WHERE id = ?", row)
+	
+	def remove_board(self, board_id: UUID):
+		with self.lock:
+			with self.db:
+				self.db.execute("DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE board_id = ?)", (str(board_id),))
+				self.db.execute("DELETE FROM messages WHERE board_id = ?", (str(board_id),))
+	
+	def search(self, query: str, board_id: Optional[UUID] = None, author_id: Optional[UUID] = None, since: Union[datetime, str, float, None] = None, until: Union[datetime, str, float, None] = None, limit: int = 50, offset: int = 0, raw: bool = False) -> List[SearchHit]:
+		"""
+		Search the index, best matches (BM25) first.
+		
+		Every term of query has to match; a term ending in * matches as a
+		prefix. With raw=True query is passed to FTS5 unchanged, so its full
+		query syntax (OR, NEAR, phrases, ...) can be used. The results can be
+		limited to a board, an author, and messages posted in [since, until).
+		"""
+		match = query if raw else _match_expression(query)
+		if not match:
+			return []
+		sql = ["SELECT m.board_id, m.message_id, m.author_id, m.timestamp, m.type, bm25(messages_fts), snippet(messages_fts, 0, '[', ']', '...', 16) FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?"]
+		args: List[Any] = [match]
+		if board_id is not None:
+			sql.append("AND m.board_id = ?")
+			args.append(str(board_id))
+		if author_id is not None:
+			sql.append("AND m.author_id = ?")
+			args.append(str(author_id))
+		if since is not None:
+			sql.append("AND m.timestamp >= ?")
+			args.append(_posix(since))
+		if until is not None:
+			sql.append("AND m.timestamp < ?")
+			args.append(_posix(until))
+		sql.append("ORDER BY bm25(messages_fts) LIMIT ? OFFSET ?")
+		args += [limit, offset]
+		with self.lock:
+			rows = self.db.execute(' '.join(sql), args).fetchall()
+		# bm25() is lower for better matches; flip it so higher is better
+		return [SearchHit(row[0], row[1], row[2], row[3], row[4], -row[5], row[6]) for row in rows]
+	
+	def count(self, board_id: Optional[UUID] = None) -> int:
+		with self.lock:
+			if board_id is None:
+				return self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+			return self.db.execute("SELECT COUNT(*) FROM messages WHERE board_id = ?", (str(board_id),)).fetchone()[0]
+	
+	def optimize(self):
+		"""
+		Merge the index segments. Worth doing after a large import.
+		"""
+		with self.lock:
+			with self.db:
+				self.db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+	
+	def close(self):
+		with self.lock:
+			self.db.close()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+subtext.session - Automatic session management.
+"""
+from typing import Any, Callable, Optional
+import abc, threading, time
+from uuid import UUID
+
+from .common import APIError
+from .user import UserAPI
+from .admin import AdminAPI
+
+class SessionManager(abc.ABC):
+	"""
+	Keeps a session alive and logs in again when it is lost.
+	
+	The expiry of the session is tracked locally. A background thread renews
+	it shortly before the deadline, and calls made through call() log in
+	again once if the server answers 401 SessionExpired, or 404
+	NoObjectWithId for a session it has already reaped. Logins and renewals
+	are coalesced: when several threads find the session stale at the same
+	time, only one of them talks to the server and the others reuse its
+	result.
+	
+	Subclasses implement _login(), _renew() and _logout().
+	"""
+	# Whether every successful API call renews the session on the server
+	renewed_by_calls = False
+	
+	def __init__(self, duration: float, margin: float):
+		self.duration = duration
+		self.margin = margin
+		self.lock = threading.Lock()
+		self.session_id: Optional[UUID] = None
+		self.expires = 0.0
+		self.renewals = 0
+		self.logins = 0
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+	
+	@abc.abstractmethod
+	def _login(self) -> UUID:
+		pass
+	
+	@abc.abstractmethod
+	def _renew(self, session_id: UUID):
+		pass
+	
+	@abc.abstractmethod
+	def _logout(self, session_id: UUID):
+		pass
+	
+	def get(self) -> UUID:
+		"""
+		Get a valid session ID, logging in if there is none.
+		"""
+		session_id = self.session_id
+		if session_id is not None and time.monotonic() < self.expires:
+			return session_id
+		with self.lock:
+			if self.session_id is None or time.monotonic() >= self.expires:
+				self._replace(self.session_id)
+			return self.session_id
+	
+	def _replace(self, stale_id: Optional[UUID]):
+		# Must be called with the lock held
+		if stale_id is not None:
+			try:
+				self._logout(stale_id)
+			except APIError:
+				pass
+		self.session_id = None
+		start = time.monotonic()
+		session_id = self._login()
+		self.session_id = session_id
+		self.expires = start + self.duration
+		self.logins += 1
+	
+	def relogin(self, stale_id: Optional[UUID]) -> UUID:
+		"""
+		Log in again, unless another thread already replaced stale_id.
+		"""
+		with self.lock:
+			if self.session_id is None or self.session_id == stale_id:
+				self._replace(stale_id)
+			return self.session_id
+	
+	def renew(self, force: bool = False) -> UUID:
+		"""
+		Renew the session if it is within margin seconds of expiring.
+		
+		Logs in again if the session can no longer be renewed.
+		"""
+		with self.lock:
+			if self.session_id is None:
+				self._replace(None)
+				return self.session_id
+			if not force and self.expires - time.monotonic() > self.margin:
+				return self.session_id
+			start = time.monotonic()
+			try:
+				self._renew(self.session_id)
+			except APIError as e:
+				if e.status_code not in (401, 403, 404):
+					raise
+				self._replace(self.session_id)
+				return self.session_id
+			self.expires = start + self.duration
+			self.renewals += 1
+			return self.session_id
+	
+	def touch(self, start: float):
+		"""
+		Note that the server renewed the session at monotonic time start.
+		"""
+		if self.renewed_by_calls:
+			self.expires = max(self.expires, start + self.duration)
+	
+	def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+		"""
+		Call an API method with the session ID as its first argument.
+		
+		If the session turns out to have expired, log in again and retry
+		once.
+		"""
+		session_id = self.get()
+		start = time.monotonic()
+		try:
+			result = func(session_id, *args, **kwargs)
+		except APIError as e:
+			if not self._session_lost(session_id, e):
+				raise
+			session_id = self.relogin(session_id)
+			start = time.monotonic()
+			result = func(session_id, *args, **kwargs)
+		self.touch(start)
+		return result
+	
+	def _session_lost(self, session_id: UUID, error: APIError) -> bool:
+		if error.status_code == 401 and error.message == 'SessionExpired':
+			return True
+		if error.status_code != 404 or error.message != 'NoObjectWithId':
+			return False
+		# Also the answer once the server has reaped the session; tell that
+		# apart from a missing object by renewing the session
+		start = time.monotonic()
+		try:
+			self._renew(session_id)
+		except APIError as e:
+			return e.status_code in (401, 403, 404)
+		with self.lock:
+			if self.session_id == session_id:
+				self.expires = start + self.duration
+		return False
+	
+	@property
+	def running(self) -> bool:
+		"""
+		Whether the background renewal thread is running.
+		"""
+		return self._thread is not None
+	
+	def start(self):
+		"""
+		Start renewing the session in a background thread, unless it is
+		already running.
+		"""
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name='subtext-session', daemon=True)
+		self._thread.start()
+	
+	def _run(self):
+		while True:
+			delay = self.expires - self.margin - time.monotonic() if self.session_id is not None else 0
+			if self._stop.wait(max(delay, 0)):
+				return
+			try:
+				self.renew()
+			except Exception:
+				# Server unreachable, try again shortly
+				if self._stop.wait(min(self.margin / 2, 5.0)):
+					return
+	
+	def stop(self):
+		"""
+		Stop the background renewal thread.
+		"""
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+	
+	def close(self):
+		"""
+		Stop renewing and log out.
+		"""
+		self.stop()
+		with self.lock:
+			if self.session_id is not None:
+				try:
+					self._logout(self.session_id)
+				except APIError:
+					pass
+				self.session_id = None
+	
+	def __enter__(self):
+		self.start()
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
+
+class UserSessionManager(SessionManager):
+	"""
+	Session manager for user sessions, renewed through UserAPI.heartbeat.
+	
+	Any session-authenticated user call also renews the session on the
+	server, so calls made through call() push the local deadline back too.
+	duration defaults to the session_duration config value, which should
+	match the server's sessionDuration (see Subtext.about()).
+	"""
+	renewed_by_calls = True
+	
+	def __init__(self, user_api: UserAPI, user_id: UUID, password: str, duration: Optional[float] = None, margin: float = 60.0):
+		super().__init__(duration or user_api.config.get('session_duration', 900), margin)
+		self.user_api = user_api
+		self.user_id = user_id
+		self.password = password
+	
+	def _login(self) -> UUID:
+		return UUID(self.user_api.login(self.user_id, self.password))
+	
+	def _renew(self, session_id: UUID):
+		self.user_api.heartbeat(session_id)
+	
+	def _logout(self, session_id: UUID):
+		self.user_api.logout(session_id)
+
+class AdminSessionManager(SessionManager):
+	"""
+	Session manager for admin sessions, renewed through AdminAPI.renew.
+	
+	The server keeps an admin flagged as logged in after its session
+	expires and refuses new login challenges until it logs out, so a lost
+	session is logged out before the PBKDF2 challenge flow is run again.
+	"""
+	def __init__(self, admin_api: AdminAPI, admin_id: UUID, secret: bytes, duration: Optional[float] = None, margin: float = 30.0):
+		super().__init__(duration or admin_api.config.get('admin_session_duration', 120), margin)
+		self.admin_api = admin_api
+		self.admin_id = admin_id
+		self.secret = secret
+	
+	def _login(self) -> UUID:
+		return self.admin_api.login(self.admin_id, self.secret)
+	
+	def _renew(self, session_id: UUID):
+		self.admin_api.renew(session_id)
+	
+	def _logout(self, session_id: UUID):
+		self.admin_api.logout(session_id)
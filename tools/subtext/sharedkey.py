@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+subtext.sharedkey - Message encryption for BoardEncryption.shared_key boards.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Union
+import hashlib, os, threading
+from uuid import UUID
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .common import message_content
+
+VERSION = 1
+KEY_SIZE = 32
+KEY_ID_SIZE = 8
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# version, key ID, nonce
+HEADER_SIZE = 1 + KEY_ID_SIZE + NONCE_SIZE
+OVERHEAD = HEADER_SIZE + TAG_SIZE
+
+class SharedKeyError(Exception):
+	"""
+	A message could not be decrypted: unknown key, wrong board, or
+	tampered/corrupt content.
+	"""
+	pass
+
+def generate_key() -> bytes:
+	"""
+	Generate a new board key.
+	"""
+	return AESGCM.generate_key(KEY_SIZE * 8)
+
+def key_id(key: bytes) -> bytes:
+	"""
+	Public identifier of a key, stored in every message encrypted with it.
+	"""
+	return hashlib.sha256(b'subtext-shared-key-id' + key).digest()[:KEY_ID_SIZE]
+
+class SharedKeyCodec:
+	"""
+	AES-256-GCM codec for shared-key boards.
+	
+	Every message is laid out as version (1 byte), key ID (8 bytes),
+	a random 96-bit nonce, then the ciphertext and 16-byte tag. The board ID
+	and header are authenticated as associated data, so a message can't be
+	replayed into another board. Boards can hold several keys (e.g. during a
+	rotation): new messages use the current one, and old messages are
+	decrypted with whichever key their ID names.
+	
+	Set-up AESGCM instances are cached per board and key, and whole pages
+	are handled in one call: encrypt_many() draws all nonces from a single
+	os.urandom() call and slices them out of a memoryview, and decryption
+	passes memoryview slices of each decoded content (nonce, ciphertext)
+	to AES-GCM instead of copying them.
+	
+	Distributing the keys to board members (e.g. encrypted to their GnuPG
+	keys) is up to the caller.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		# board ID -> key ID -> cipher
+		self.keys: Dict[str, Dict[bytes, AESGCM]] = {}
+		# board ID -> key ID of the key used for new messages
+		self.current: Dict[str, bytes] = {}
+	
+	def set_key(self, board_id: UUID, key: bytes, current: bool = True) -> bytes:
+		"""
+		Add a key to a board and, if current, use it for new messages.
+		Returns its key ID.
+		"""
+		if len(key) != KEY_SIZE:
+			raise ValueError("shared keys must be {} bytes".format(KEY_SIZE))
+		board_id = str(board_id)
+		kid = key_id(key)
+		with self.lock:
+			self.keys.setdefault(board_id, {})[kid] = AESGCM(key)
+			if current or board_id not in self.current:
+				self.current[board_id] = kid
+		return kid
+	
+	def remove_board(self, board_id: UUID):
+		with self.lock:
+			self.keys.pop(str(board_id), None)
+			self.current.pop(str(board_id), None)
+	
+	def _cipher(self, board_id: str, kid: Optional[bytes] = None):
+		try:
+			if kid is None:
+				kid = self.current[board_id]
+			return kid, self.keys[board_id][kid]
+		except KeyError:
+			raise SharedKeyError("no key for board {}".format(board_id))
+	
+	def encrypt(self, board_id: UUID, plaintext: bytes) -> bytes:
+		return self.encrypt_many(board_id, (plaintext,))[0]
+	
+	def encrypt_many(self, board_id: UUID, plaintexts: Sequence[Union[bytes, memoryview]]) -> List[bytes]:
+		"""
+		Encrypt a batch of messages for a board with its current key.
+		"""
+		board = UUID(str(board_id))
+		kid, cipher = self._cipher(str(board))
+		prefix = bytes((VERSION,)) + kid
+		nonces = memoryview(os.urandom(NONCE_SIZE * len(plaintexts)))
+		results = []
+		for i, plaintext in enumerate(plaintexts):
+			header = prefix + nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+			results.append(header + cipher.encrypt(header[1 + KEY_ID_SIZE:], plaintext, board.bytes + header))
+		return results
+	
+	def decrypt(self, board_id: UUID, content: Union[bytes, memoryview]) -> bytes:
+		"""
+		Decrypt one message, e.g. a body fetched with BoardAPI.get_message.
+		"""
+		return self._decrypt(UUID(str(board_id)), memoryview(content))
+	
+	def _decrypt(self, board: UUID, view: memoryview) -> bytes:
+		if len(view) < OVERHEAD or view[0] != VERSION:
+			raise SharedKeyError("not a shared-key message")
+		_, cipher = self._cipher(str(board), bytes(view[1:1 + KEY_ID_SIZE]))
+		try:
+			return cipher.decrypt(view[1 + KEY_ID_SIZE:HEADER_SIZE], view[HEADER_SIZE:], board.bytes + view[:HEADER_SIZE].tobytes())
+		except InvalidTag:
+			raise SharedKeyError("message failed authentication")
+	
+	def decrypt_many(self, board_id: UUID, contents: Sequence[Optional[Union[bytes, memoryview]]], strict: bool = False) -> List[Optional[bytes]]:
+		"""
+		Decrypt a batch of message contents, in order. None entries stay
+		None, and so do messages that fail to decrypt unless strict is set,
+		in which case SharedKeyError is raised.
+		"""
+		board = UUID(str(board_id))
+		results: List[Optional[bytes]] = []
+		for content in contents:
+			if content is None:
+				results.append(None)
+				continue
+			try:
+				results.append(self._decrypt(board, memoryview(content)))
+			except SharedKeyError:
+				if strict:
+					raise
+				results.append(None)
+		return results
+	
+	def decrypt_page(self, board_id: UUID, messages: Sequence[Any], strict: bool = False) -> List[Optional[bytes]]:
+		"""
+		Decrypt a page of messages from BoardAPI.get_messages(), in order.
+		
+		Contents left out by the server (too large to be sent inline) come
+		back as None; fetch them with get_message() and use decrypt().
+		"""
+		return self.decrypt_many(board_id, [message_content(message) for message in messages], strict)
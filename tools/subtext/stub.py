@@ -0,0 +1,838 @@
+#!/usr/bin/env python3
+"""
+subtext.stub - In-process fake Subtext server.
+"""
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import base64, hashlib, json, os, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta, timezone
+
+from .common import Translator
+from . import cbor
+from .admin import derive_response
+
+BOARD_ENCRYPTION = ('None', 'SharedKey', 'GnuPG')
+USER_PRESENCE = ('Offline', 'Online', 'Away', 'Busy')
+
+class StubError(Exception):
+	"""
+	Error response of the stub server, mirroring APIError on the server.
+	"""
+	def __init__(self, status: int, error: str, authenticate: Optional[str] = None):
+		super().__init__(error)
+		self.status = status
+		self.error = error
+		self.authenticate = authenticate
+
+def _now() -> datetime:
+	# The server stores naive UTC timestamps
+	return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _json_default(value: Any) -> Any:
+	if isinstance(value, UUID):
+		return str(value)
+	if isinstance(value, datetime):
+		return value.isoformat()
+	if isinstance(value, (bytes, bytearray)):
+		return base64.b64encode(value).decode('ascii')
+	if isinstance(value, set):
+		return sorted(value, key=str)
+	raise TypeError("cannot serialize {!r}".format(value))
+
+class _Query:
+	"""
+	Query string parameters with ASP.NET-style model binding.
+	"""
+	def __init__(self, query: str):
+		self.values = {k: v[0] for k, v in parse_qs(query, keep_blank_values=True).items()}
+	
+	def str(self, name: str, default: Optional[str] = None) -> Optional[str]:
+		return self.values.get(name, default)
+	
+	def guid(self, name: str, required: bool = True) -> Optional[UUID]:
+		value = self.values.get(name)
+		if value is None:
+			if required:
+				raise StubError(400, "InvalidRequest")
+			return None
+		try:
+			return UUID(value)
+		except ValueError:
+			raise StubError(400, "InvalidRequest")
+	
+	def int(self, name: str) -> Optional[int]:
+		value = self.values.get(name)
+		if value is None or value == '':
+			return None
+		try:
+			return int(value)
+		except ValueError:
+			raise StubError(400, "InvalidRequest")
+	
+	def bool(self, name: str, default: bool = False) -> bool:
+		value = self.values.get(name)
+		if value is None or value == '':
+			return default
+		return value.lower() == 'true'
+	
+	def datetime(self, name: str) -> Optional[datetime]:
+		value = self.values.get(name)
+		if value is None or value == '':
+			return None
+		try:
+			parsed = Translator.from_subtext(value, datetime)
+		except Exception:
+			raise StubError(400, "InvalidRequest")
+		return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+	
+	def enum(self, name: str, names: Tuple[str, ...], default: Optional[int] = None) -> int:
+		value = self.values.get(name)
+		if value is None:
+			if default is None:
+				raise StubError(400, "InvalidRequest")
+			return default
+		# Like the ASP.NET Core binder: defined ordinals and member names
+		# (case-insensitive), not e.g. "UserPresence.Online"
+		value = value.strip()
+		if value.isdigit() and int(value) < len(names):
+			return int(value)
+		for i, enum_name in enumerate(names):
+			if enum_name.lower() == value.lower():
+				return i
+		raise StubError(400, "InvalidRequest")
+
+class StubState:
+	"""
+	In-memory data of a StubServer.
+	
+	Users and admins can be added directly, without going through the API,
+	to seed the server before a test or benchmark. Passwords are stored in
+	plain text, unlike on the real server.
+	"""
+	def __init__(self, session_duration: float = 900, admin_session_duration: float = 120, page_size: int = 100, max_inline_message_size: int = 2048, secret_size: int = 32, pbkdf2_iterations: int = 10000):
+		self.session_duration = timedelta(seconds=session_duration)
+		self.admin_session_duration = timedelta(seconds=admin_session_duration)
+		self.page_size = page_size
+		self.max_inline_message_size = max_inline_message_size
+		self.secret_size = secret_size
+		self.pbkdf2_iterations = pbkdf2_iterations
+		
+		self.lock = threading.RLock()
+		self.users: Dict[UUID, dict] = {}
+		self.sessions: Dict[UUID, dict] = {}
+		self.admins: Dict[UUID, dict] = {}
+		self.admin_sessions: Dict[UUID, dict] = {}
+		self.boards: Dict[UUID, dict] = {}
+		self.members: Dict[UUID, Set[UUID]] = {}
+		# board ID -> messages, oldest first
+		self.messages: Dict[UUID, List[dict]] = {}
+		self.message_index: Dict[UUID, dict] = {}
+		self.keys: Dict[UUID, dict] = {}
+		self.friends: Dict[UUID, Set[UUID]] = {}
+		self.blocked: Dict[UUID, Set[UUID]] = {}
+		# recipient ID -> sender IDs
+		self.friend_requests: Dict[UUID, Set[UUID]] = {}
+		self.audit_log: List[dict] = []
+	
+	def add_user(self, name: str, password: str, public_key: bytes = b'') -> UUID:
+		with self.lock:
+			user_id = uuid4()
+			self.users[user_id] = {
+				'id': user_id,
+				'name': name,
+				'password': password,
+				'presence': 0,
+				'lastActive': datetime.min,
+				'status': "",
+				'isDeleted': False,
+			}
+			self.friends[user_id] = set()
+			self.blocked[user_id] = set()
+			self.friend_requests[user_id] = set()
+			if public_key:
+				self.add_key(user_id, public_key)
+			return user_id
+	
+	def add_admin(self, secret: Optional[bytes] = None) -> Tuple[UUID, bytes]:
+		with self.lock:
+			admin_id = uuid4()
+			secret = secret or os.urandom(self.secret_size)
+			self.admins[admin_id] = {'id': admin_id, 'secret': secret, 'challenge': os.urandom(self.secret_size), 'isLoggedIn': False}
+			return admin_id, secret
+	
+	def add_key(self, owner_id: UUID, key_data: bytes) -> UUID:
+		with self.lock:
+			key_id = uuid4()
+			self.keys[key_id] = {'id': key_id, 'ownerId': owner_id, 'keyData': bytes(key_data), 'publishTime': _now()}
+			return key_id
+	
+	def add_board(self, owner_id: UUID, name: str, encryption: int = 2, members: Tuple[UUID, ...] = (), is_direct: bool = False) -> UUID:
+		with self.lock:
+			board_id = uuid4()
+			now = _now()
+			self.boards[board_id] = {
+				'id': board_id,
+				'name': name,
+				'ownerId': owner_id,
+				'encryption': encryption,
+				'lastUpdate': now,
+				'lastSignificantUpdate': now,
+				'isDirect': is_direct,
+			}
+			self.members[board_id] = {owner_id, *members}
+			self.messages[board_id] = []
+			return board_id
+	
+	def add_message(self, board_id: UUID, author_id: Optional[UUID], content: bytes, msg_type: str = "Message", is_system: bool = False, timestamp: Optional[datetime] = None) -> UUID:
+		with self.lock:
+			msg = {
+				'id': uuid4(),
+				'boardId': board_id,
+				'timestamp': timestamp or _now(),
+				'authorId': author_id,
+				'isSystem': is_system,
+				'type': msg_type,
+				'content': bytes(content),
+			}
+			self.messages[board_id].append(msg)
+			self.message_index[msg['id']] = msg
+			board = self.boards[board_id]
+			board['lastUpdate'] = msg['timestamp']
+			if not is_system:
+				board['lastSignificantUpdate'] = msg['timestamp']
+			return msg['id']
+	
+	def add_friends(self, user_id: UUID, friend_id: UUID):
+		with self.lock:
+			self.friends[user_id].add(friend_id)
+			self.friends[friend_id].add(user_id)
+	
+	def log_admin_action(self, admin_id: UUID, action: str, details: str = ""):
+		with self.lock:
+			self.audit_log.append({'id': uuid4(), 'adminId': admin_id, 'action': action, 'details': details, 'timestamp': _now()})
+
+_GUID = r'([^/]+)'
+# reName in UserController and BoardController
+_NAME = re.compile(r'^[a-z_][a-z0-9_]{4,}$')
+
+class StubServer:
+	"""
+	Fake Subtext server running on a background thread.
+	
+	Implements the /Subtext routes used by AdminAPI, UserAPI, BoardAPI and
+	KeyAPI on top of a StubState, with the same status codes, error codes
+	and JSON shapes as the real server, so the client can be exercised and
+	benchmarked offline:
+		
+		with StubServer() as server:
+			user_id = server.state.add_user("alice", "password")
+			with Subtext(server.url) as subtext:
+				session_id = subtext.user.login(user_id, "password")
+	
+	latency, if set, delays every response by that many seconds to simulate
+	a network round trip. The port defaults to a free one. With cbor=False
+	it answers application/cbor requests with JSON, like a server without
+	the CBOR formatter.
+	"""
+	def __init__(self, host: str = '127.0.0.1', port: int = 0, state: Optional[StubState] = None, latency: float = 0.0, version: Optional[str] = None, cbor: bool = True):
+		from . import VERSION
+		self.state = state or StubState()
+		self.latency = latency
+		self.version = version or VERSION
+		self.cbor = cbor
+		self.requests = 0
+		self.routes: List[Tuple[str, Any, Callable[..., Tuple[int, Any]]]] = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in (
+			('GET', r'/', self.root),
+			('GET', r'/Subtext', self.about),
+			('GET', r'/Subtext/admin/login/challenge', self.admin_login_challenge),
+			('POST', r'/Subtext/admin/login/response', self.admin_login_response),
+			('POST', r'/Subtext/admin/renew', self.admin_renew),
+			('POST', r'/Subtext/admin/logout', self.admin_logout),
+			('GET', r'/Subtext/admin/auditlog', self.admin_audit_log),
+			('POST', r'/Subtext/user/create', self.user_create),
+			('GET', r'/Subtext/user/queryidbyname', self.user_query_id_by_name),
+			('POST', r'/Subtext/user/login', self.user_login),
+			('POST', r'/Subtext/user/heartbeat', self.user_heartbeat),
+			('POST', r'/Subtext/user/logout', self.user_logout),
+			('GET', r'/Subtext/user/' + _GUID, self.user_get),
+			('DELETE', r'/Subtext/user/' + _GUID, self.user_delete),
+			('GET', r'/Subtext/user/' + _GUID + r'/friends', self.user_get_friends),
+			('DELETE', r'/Subtext/user/' + _GUID + r'/friends/' + _GUID, self.user_remove_friend),
+			('GET', r'/Subtext/user/' + _GUID + r'/blocked', self.user_get_blocked),
+			('POST', r'/Subtext/user/' + _GUID + r'/blocked', self.user_add_blocked),
+			('DELETE', r'/Subtext/user/' + _GUID + r'/blocked/' + _GUID, self.user_remove_blocked),
+			('GET', r'/Subtext/user/' + _GUID + r'/friendrequests', self.user_get_friend_requests),
+			('POST', r'/Subtext/user/' + _GUID + r'/friendrequests', self.user_send_friend_request),
+			('POST', r'/Subtext/user/' + _GUID + r'/friendrequests/' + _GUID, self.user_accept_friend_request),
+			('DELETE', r'/Subtext/user/' + _GUID + r'/friendrequests/' + _GUID, self.user_reject_friend_request),
+			('GET', r'/Subtext/user/' + _GUID + r'/keys', self.user_get_keys),
+			('POST', r'/Subtext/user/' + _GUID + r'/keys', self.user_add_key),
+			('PUT', r'/Subtext/user/' + _GUID + r'/presence', self.user_set_presence),
+			('POST', r'/Subtext/board/create', self.board_create),
+			('POST', r'/Subtext/board/createdirect', self.board_create_direct),
+			('GET', r'/Subtext/board', self.board_get_boards),
+			('GET', r'/Subtext/board/' + _GUID, self.board_get),
+			('GET', r'/Subtext/board/' + _GUID + r'/members', self.board_get_members),
+			('POST', r'/Subtext/board/' + _GUID + r'/members', self.board_add_member),
+			('DELETE', r'/Subtext/board/' + _GUID + r'/members/' + _GUID, self.board_remove_member),
+			('GET', r'/Subtext/board/' + _GUID + r'/messages', self.board_get_messages),
+			('POST', r'/Subtext/board/' + _GUID + r'/messages', self.board_post_message),
+			('GET', r'/Subtext/board/' + _GUID + r'/messages/' + _GUID, self.board_get_message),
+			('GET', r'/Subtext/key/' + _GUID, self.key_get),
+		)]
+		# Routes answering conditional GETs, like ConditionalGet on the server
+		self.conditional = {self.user_get, self.user_get_friends, self.board_get, self.board_get_members}
+		# Routes whose [Produces] allows application/cbor
+		self.cbor_routes = {self.board_get_messages}
+		
+		self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+		self.httpd.daemon_threads = True
+		self._thread: Optional[threading.Thread] = None
+	
+	@property
+	def url(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return "http://{}:{}".format(host, port)
+	
+	def start(self):
+		if self._thread is None:
+			self._thread = threading.Thread(target=self.httpd.serve_forever, name='subtext-stub', daemon=True)
+			self._thread.start()
+	
+	def stop(self):
+		if self._thread is not None:
+			self.httpd.shutdown()
+			self._thread.join()
+			self._thread = None
+		self.httpd.server_close()
+	
+	def __enter__(self):
+		self.start()
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.stop()
+	
+	def _handler_class(self):
+		server = self
+		
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			# Headers and body are written separately
+			disable_nagle_algorithm = True
+			
+			def log_message(self, format, *args):
+				pass
+			
+			def _read_body(self) -> bytes:
+				if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+					chunks = []
+					while True:
+						size = int(self.rfile.readline().split(b';')[0], 16)
+						if size == 0:
+							while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+								pass
+							return b''.join(chunks)
+						chunks.append(self.rfile.read(size))
+						self.rfile.readline()
+				length = int(self.headers.get('Content-Length') or 0)
+				return self.rfile.read(length) if length else b''
+			
+			def _dispatch(self):
+				body = self._read_body()
+				status, content, headers = server.dispatch(self.command, self.path, body, self.headers)
+				if server.latency:
+					time.sleep(server.latency)
+				self.send_response(status)
+				for name, value in headers.items():
+					self.send_header(name, value)
+				self.send_header('Content-Length', str(len(content)))
+				self.end_headers()
+				self.wfile.write(content)
+			
+			do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+		
+		return Handler
+	
+	def dispatch(self, method: str, path: str, body: bytes, request_headers: Optional[Any] = None) -> Tuple[int, bytes, Dict[str, str]]:
+		"""
+		Handle a request, returning the status, body and headers of the response.
+		"""
+		self.requests += 1
+		parts = urlsplit(path)
+		query = _Query(parts.query)
+		headers: Dict[str, str] = {}
+		handler = None
+		try:
+			for route_method, pattern, handler in self.routes:
+				if route_method != method:
+					continue
+				match = pattern.match(parts.path.rstrip('/') or '/')
+				if match is None:
+					continue
+				args = []
+				for arg in match.groups():
+					try:
+						args.append(UUID(arg))
+					except ValueError:
+						raise StubError(400, "InvalidRequest")
+				with self.state.lock:
+					status, value = handler(query, body, *args)
+				break
+			else:
+				raise StubError(404, "NotFound")
+		except StubError as e:
+			if e.authenticate is not None:
+				headers['WWW-Authenticate'] = e.authenticate
+			status, value = e.status, {'error': e.error}
+		except Exception as e:
+			status, value = 500, {'error': type(e).__name__}
+		
+		if isinstance(value, tuple):
+			# Raw content with X-Metadata, as sent by the octet-stream endpoints
+			value, metadata = value
+			headers['X-Metadata'] = json.dumps(metadata, default=_json_default, separators=(',', ':'))
+			headers['Content-Type'] = 'application/octet-stream'
+			return status, bytes(value), headers
+		if isinstance(value, str) and status == 200 and parts.path == '/':
+			headers['Content-Type'] = 'text/plain; charset=utf-8'
+			return status, value.encode(), headers
+		if isinstance(value, list) and self.cbor and handler in self.cbor_routes and cbor.MEDIA_TYPE in (request_headers or {}).get('Accept', ''):
+			# CborOutputFormatter, which only writes lists
+			headers['Content-Type'] = cbor.MEDIA_TYPE
+			content = cbor.dumps(value, default=_json_default)
+		else:
+			headers['Content-Type'] = 'application/json; charset=utf-8'
+			content = json.dumps(value, default=_json_default, separators=(',', ':')).encode()
+		if status == 200 and handler in self.conditional:
+			# The server hashes the fields a response is built from; hashing
+			# the response itself changes exactly as often.
+			etag = 'W/"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+			headers['Cache-Control'] = 'private, no-cache'
+			headers['ETag'] = etag
+			if_none_match = (request_headers or {}).get('If-None-Match')
+			if if_none_match is not None and any(tag.strip() in ('*', etag, etag[2:]) for tag in if_none_match.split(',')):
+				return 304, b'', headers
+		return status, content, headers
+	
+	# Helpers
+	
+	def _page(self, query: _Query, items: List[Any]) -> List[Any]:
+		start = max(query.int('start') or 0, 0)
+		count = query.int('count')
+		if count is None or count <= 0:
+			count = self.state.page_size
+		return items[start:start + min(self.state.page_size, count)]
+	
+	def _session(self, query: _Query) -> dict:
+		# VerifyAndRenewSession
+		state = self.state
+		session = state.sessions.get(query.guid('sessionId'))
+		if session is None:
+			raise StubError(404, "NoObjectWithId")
+		now = _now()
+		if session['timestamp'] + state.session_duration < now:
+			del state.sessions[session['id']]
+			raise StubError(401, "SessionExpired", "X-Subtext-User")
+		user = state.users.get(session['userId'])
+		if user is None:
+			raise StubError(500, "NoObjectWithId")
+		session['timestamp'] = now
+		return user
+	
+	def _admin_session(self, query: _Query) -> dict:
+		state = self.state
+		session = state.admin_sessions.get(query.guid('sessionId'))
+		if session is None:
+			raise StubError(404, "NoObjectWithId")
+		if session['timestamp'] + state.admin_session_duration < _now():
+			raise StubError(401, "SessionExpired", "X-Subtext-Admin")
+		admin = state.admins.get(session['adminId'])
+		if admin is None:
+			raise StubError(500, "NoObjectWithId")
+		if not admin['isLoggedIn']:
+			raise StubError(403, "AdminLoggedOut")
+		return session
+	
+	def _user(self, user_id: UUID) -> dict:
+		user = self.state.users.get(user_id)
+		if user is None:
+			raise StubError(404, "NoObjectWithId")
+		return user
+	
+	def _own(self, user: dict, user_id: UUID):
+		if user['id'] != user_id:
+			raise StubError(403, "NotAuthorized")
+	
+	def _board(self, user: dict, board_id: UUID) -> dict:
+		board = self.state.boards.get(board_id)
+		if board is None:
+			raise StubError(404, "NoObjectWithId")
+		if user['id'] not in self.state.members[board_id]:
+			raise StubError(403, "NotAuthorized")
+		return board
+	
+	def _owned_board(self, user: dict, board_id: UUID) -> dict:
+		board = self.state.boards.get(board_id)
+		if board is None:
+			raise StubError(404, "NoObjectWithId")
+		if board['ownerId'] != user['id']:
+			raise StubError(403, "NotAuthorized")
+		return board
+	
+	# SubtextController
+	
+	def root(self, query, body):
+		return 200, "Subtext"
+	
+	def about(self, query, body):
+		return 200, {
+			'version': self.version,
+			'variant': "RetroAsgardian/Subtext",
+			'instanceName': "subtext_stub",
+			'instanceId': None,
+			'instanceIsPrivate': False,
+			'sessionDuration': self.state.session_duration.total_seconds(),
+		}
+	
+	# AdminController
+	
+	def admin_login_challenge(self, query, body):
+		admin = self.state.admins.get(query.guid('adminId'))
+		if admin is None:
+			raise StubError(404, "NoObjectWithId")
+		if admin['isLoggedIn']:
+			raise StubError(403, "AdminLoggedIn")
+		admin['challenge'] = os.urandom(self.state.secret_size)
+		return 200, admin['challenge']
+	
+	def admin_login_response(self, query, body):
+		state = self.state
+		admin = state.admins.get(query.guid('adminId'))
+		if admin is None:
+			raise StubError(404, "NoObjectWithId")
+		if admin['isLoggedIn']:
+			raise StubError(403, "AdminLoggedIn")
+		try:
+			response = base64.b64decode(query.str('response') or '')
+		except ValueError:
+			raise StubError(400, "InvalidRequest")
+		expected, _ = derive_response(admin['secret'], admin['challenge'], state.pbkdf2_iterations, state.secret_size)
+		admin['challenge'] = os.urandom(state.secret_size)
+		if response != expected:
+			state.log_admin_action(admin['id'], "Login.Failure")
+			raise StubError(401, "IncorrectResponse", "X-Subtext-Admin")
+		session = {'id': uuid4(), 'adminId': admin['id'], 'timestamp': _now()}
+		state.admin_sessions[session['id']] = session
+		admin['isLoggedIn'] = True
+		state.log_admin_action(admin['id'], "Login.Success")
+		return 200, session['id']
+	
+	def admin_renew(self, query, body):
+		session = self._admin_session(query)
+		session['timestamp'] = _now()
+		return 200, "success"
+	
+	def admin_logout(self, query, body):
+		state = self.state
+		session = state.admin_sessions.get(query.guid('sessionId'))
+		if session is None:
+			raise StubError(404, "NoObjectWithId")
+		state.admins[session['adminId']]['isLoggedIn'] = False
+		state.log_admin_action(session['adminId'], "Logout")
+		del state.admin_sessions[session['id']]
+		return 200, "success"
+	
+	def admin_audit_log(self, query, body):
+		self._admin_session(query)
+		action = query.str('action')
+		admin_id = query.guid('adminId', required=False)
+		start_time = query.datetime('startTime')
+		end_time = query.datetime('endTime')
+		entries = [entry for entry in reversed(self.state.audit_log) if
+			(action is None or entry['action'] == action) and
+			(admin_id is None or entry['adminId'] == admin_id) and
+			(start_time is None or entry['timestamp'] >= start_time) and
+			(end_time is None or entry['timestamp'] <= end_time)]
+		return 200, self._page(query, entries)
+	
+	# UserController
+	
+	def user_create(self, query, body):
+		state = self.state
+		name = query.str('name') or ''
+		password = query.str('password') or ''
+		if any(user['name'] == name for user in state.users.values()):
+			raise StubError(409, "NameTaken")
+		if not _NAME.match(name):
+			raise StubError(400, "NameInvalid")
+		if len(password) < 8:
+			raise StubError(400, "PasswordInsecure")
+		return 201, state.add_user(name, password, body)
+	
+	def user_query_id_by_name(self, query, body):
+		name = query.str('name')
+		for user in self.state.users.values():
+			if user['name'] == name:
+				return 200, user['id']
+		raise StubError(404, "NoObjectWithId")
+	
+	def user_login(self, query, body):
+		state = self.state
+		user = self._user(query.guid('userId'))
+		if user['isDeleted']:
+			raise StubError(410, "ObjectDeleted")
+		if user['password'] != query.str('password'):
+			raise StubError(401, "AuthError", "X-Subtext-User")
+		session = {'id': uuid4(), 'userId': user['id'], 'timestamp': _now()}
+		state.sessions[session['id']] = session
+		user['lastActive'] = session['timestamp']
+		user['presence'] = 1
+		return 200, session['id']
+	
+	def user_heartbeat(self, query, body):
+		self._session(query)
+		return 200, "success"
+	
+	def user_logout(self, query, body):
+		state = self.state
+		session = state.sessions.pop(query.guid('sessionId'), None)
+		if session is None:
+			raise StubError(404, "NoObjectWithId")
+		if not any(s['userId'] == session['userId'] for s in state.sessions.values()):
+			state.users[session['userId']]['presence'] = 0
+		return 200, "success"
+	
+	def user_get(self, query, body, user_id):
+		session_user = self._session(query)
+		user = self._user(user_id)
+		if user is session_user or session_user['id'] in self.state.friends[user_id]:
+			return 200, {key: user[key] for key in ('id', 'name', 'presence', 'lastActive', 'status', 'isDeleted')}
+		return 200, {key: user[key] for key in ('id', 'name', 'isDeleted')}
+	
+	def user_delete(self, query, body, user_id):
+		state = self.state
+		user = self._session(query)
+		self._own(user, user_id)
+		if user['password'] != query.str('password'):
+			raise StubError(401, "AuthError", "X-Subtext-User")
+		user['isDeleted'] = True
+		user['password'] = None
+		user['name'] = user['name'] + "!deleted_" + _now().strftime('%Y%m%d')
+		user['lastActive'] = datetime.min
+		user['presence'] = 0
+		user['status'] = ""
+		for session_id in [s['id'] for s in state.sessions.values() if s['userId'] == user_id]:
+			del state.sessions[session_id]
+		return 200, "success"
+	
+	def user_get_friends(self, query, body, user_id):
+		user = self._session(query)
+		self._user(user_id)
+		self._own(user, user_id)
+		return 200, self._page(query, sorted(self.state.friends[user_id], key=str))
+	
+	def user_remove_friend(self, query, body, user_id, friend_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		if friend_id not in self.state.friends[user_id]:
+			raise StubError(404, "NoObjectWithId")
+		self.state.friends[user_id].discard(friend_id)
+		self.state.friends.get(friend_id, set()).discard(user_id)
+		return 200, "success"
+	
+	def user_get_blocked(self, query, body, user_id):
+		user = self._session(query)
+		self._user(user_id)
+		self._own(user, user_id)
+		return 200, self._page(query, sorted(self.state.blocked[user_id], key=str))
+	
+	def user_add_blocked(self, query, body, user_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		blocked_id = query.guid('blockedId')
+		self._user(blocked_id)
+		if blocked_id == user_id:
+			raise StubError(400, "InvalidRequest")
+		if blocked_id in self.state.blocked[user_id]:
+			raise StubError(409, "AlreadyBlocked")
+		self.state.blocked[user_id].add(blocked_id)
+		return 200, "success"
+	
+	def user_remove_blocked(self, query, body, user_id, blocked_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		if blocked_id not in self.state.blocked[user_id]:
+			raise StubError(404, "NoObjectWithId")
+		self.state.blocked[user_id].discard(blocked_id)
+		return 200, "success"
+	
+	def user_get_friend_requests(self, query, body, user_id):
+		user = self._session(query)
+		self._user(user_id)
+		self._own(user, user_id)
+		return 200, self._page(query, sorted(self.state.friend_requests[user_id], key=str))
+	
+	def user_send_friend_request(self, query, body, user_id):
+		state = self.state
+		user = self._session(query)
+		self._user(user_id)
+		if user_id == user['id']:
+			raise StubError(400, "InvalidRequest")
+		if user_id in state.friends[user['id']]:
+			raise StubError(409, "AlreadyFriends")
+		if user['id'] in state.friend_requests[user_id]:
+			raise StubError(409, "AlreadySent")
+		state.friend_requests[user_id].add(user['id'])
+		return 201, "success"
+	
+	def user_accept_friend_request(self, query, body, user_id, sender_id):
+		state = self.state
+		user = self._session(query)
+		self._own(user, user_id)
+		if sender_id not in state.friend_requests[user_id]:
+			raise StubError(404, "NoObjectWithId")
+		state.friend_requests[user_id].discard(sender_id)
+		state.add_friends(user_id, sender_id)
+		return 200, "success"
+	
+	def user_reject_friend_request(self, query, body, user_id, sender_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		if sender_id not in self.state.friend_requests[user_id]:
+			raise StubError(404, "NoObjectWithId")
+		self.state.friend_requests[user_id].discard(sender_id)
+		return 200, "success"
+	
+	def user_get_keys(self, query, body, user_id):
+		self._session(query)
+		self._user(user_id)
+		keys = sorted((key for key in self.state.keys.values() if key['ownerId'] == user_id), key=lambda key: key['publishTime'], reverse=True)
+		return 200, self._page(query, [{'id': key['id'], 'publishTime': key['publishTime']} for key in keys])
+	
+	def user_add_key(self, query, body, user_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		return 201, self.state.add_key(user_id, body)
+	
+	def user_set_presence(self, query, body, user_id):
+		user = self._session(query)
+		self._own(user, user_id)
+		presence = query.enum('presence', USER_PRESENCE)
+		other_data = query.str('otherData', "")
+		until_time = query.datetime('untilTime')
+		if presence == 1:
+			user['status'] = other_data
+		elif presence in (2, 3):
+			if until_time is None:
+				raise StubError(400, "InvalidRequest")
+			user['status'] = until_time.isoformat() + ";" + other_data
+		else:
+			raise StubError(400, "InvalidRequest")
+		user['presence'] = presence
+		return 200, "success"
+	
+	# BoardController
+	
+	def board_create(self, query, body):
+		user = self._session(query)
+		name = query.str('name') or ''
+		if not _NAME.match(name):
+			raise StubError(400, "NameInvalid")
+		return 201, self.state.add_board(user['id'], name, query.enum('encryption', BOARD_ENCRYPTION, 2))
+	
+	def board_create_direct(self, query, body):
+		state = self.state
+		user = self._session(query)
+		recipient_id = query.guid('recipientId')
+		if recipient_id not in state.friends[user['id']]:
+			raise StubError(403, "NotFriends")
+		names = {(user['id'], "!direct_{}_{}".format(recipient_id, user['id'])), (recipient_id, "!direct_{}_{}".format(user['id'], recipient_id))}
+		for board in state.boards.values():
+			if board['isDirect'] and (board['ownerId'], board['name']) in names:
+				return 200, board['id']
+		return 201, state.add_board(user['id'], "!direct_{}_{}".format(recipient_id, user['id']), 2, (recipient_id,), is_direct=True)
+	
+	def board_get_boards(self, query, body):
+		state = self.state
+		user = self._session(query)
+		if query.bool('onlyOwned'):
+			boards = [board for board in state.boards.values() if board['ownerId'] == user['id']]
+		else:
+			boards = [board for board in state.boards.values() if user['id'] in state.members[board['id']]]
+		boards.sort(key=lambda board: str(board['id']))
+		return 200, self._page(query, boards)
+	
+	def board_get(self, query, body, board_id):
+		return 200, self._board(self._session(query), board_id)
+	
+	def board_get_members(self, query, body, board_id):
+		self._board(self._session(query), board_id)
+		return 200, self._page(query, sorted(self.state.members[board_id], key=str))
+	
+	def board_add_member(self, query, body, board_id):
+		state = self.state
+		board = self._owned_board(self._session(query), board_id)
+		user_id = query.guid('userId')
+		self._user(user_id)
+		if user_id in state.members[board_id]:
+			raise StubError(409, "AlreadyAdded")
+		state.members[board_id].add(user_id)
+		state.add_message(board_id, None, str(user_id).encode(), "AddMember", True)
+		return 200, "success"
+	
+	def board_remove_member(self, query, body, board_id, user_id):
+		state = self.state
+		self._owned_board(self._session(query), board_id)
+		if user_id not in state.members[board_id]:
+			raise StubError(404, "NoObjectWithId")
+		state.members[board_id].discard(user_id)
+		state.add_message(board_id, None, str(user_id).encode(), "RemoveMember", True)
+		return 200, "success"
+	
+	def board_get_messages(self, query, body, board_id):
+		state = self.state
+		self._board(self._session(query), board_id)
+		since_time = query.datetime('sinceTime')
+		msg_type = query.str('type')
+		only_system = query.bool('onlySystem')
+		messages = sorted(state.messages[board_id], key=lambda msg: msg['timestamp'], reverse=True)
+		messages = [msg for msg in messages if
+			(since_time is None or msg['timestamp'] >= since_time) and
+			(msg_type is None or msg['type'] == msg_type) and
+			(not only_system or msg['isSystem'])]
+		return 200, [{
+			'id': msg['id'],
+			'timestamp': msg['timestamp'],
+			'authorId': msg['authorId'],
+			'isSystem': msg['isSystem'],
+			'type': msg['type'],
+			'content': msg['content'] if len(msg['content']) <= state.max_inline_message_size else None,
+		} for msg in self._page(query, messages)]
+	
+	def board_post_message(self, query, body, board_id):
+		user = self._session(query)
+		self._board(user, board_id)
+		is_system = query.bool('isSystem')
+		msg_id = self.state.add_message(board_id, user['id'], body, query.str('type', "Message"), is_system)
+		if not is_system:
+			user['lastActive'] = self.state.message_index[msg_id]['timestamp']
+		return 201, msg_id
+	
+	def board_get_message(self, query, body, board_id, message_id):
+		self._board(self._session(query), board_id)
+		msg = self.state.message_index.get(message_id)
+		if msg is None or msg['boardId'] != board_id:
+			raise StubError(404, "NoObjectWithId")
+		metadata = {'Id': msg['id'], 'Timestamp': msg['timestamp'], 'AuthorId': msg['authorId'], 'IsSystem': msg['isSystem'], 'Type': msg['type']}
+		return 200, (msg['content'], metadata)
+	
+	# KeyController
+	
+	def key_get(self, query, body, key_id):
+		key = self.state.keys.get(key_id)
+		if key is None:
+			raise StubError(404, "NoObjectWithId")
+		return 200, (key['keyData'], {'Id': key['id'], 'PublishTime': key['publishTime'], 'OwnerId': key['ownerId']})
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+subtext.sync - Incremental board message sync.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import sqlite3, threading, json
+from uuid import UUID
+from datetime import datetime
+
+from .common import Translator
+from .board import BoardAPI
+
+class BoardSync:
+	"""
+	Fetches only the messages posted to a board since the last sync.
+	
+	For every board the timestamp of the newest message seen is stored,
+	together with the IDs of the messages carrying that timestamp. The next
+	sync asks the server for messages since that timestamp and drops the ones
+	already seen, including duplicates caused by new messages shifting the
+	server's offset paging while a delta is being fetched.
+	
+	Cursors are kept in an SQLite database, so a client using a file path
+	resumes where it left off after a restart.
+	"""
+	def __init__(self, board_api: BoardAPI, path: str = ":memory:", page_size: Optional[int] = None):
+		self.board_api = board_api
+		# Must not exceed the server's page size (Config.pageSize), otherwise
+		# a short page can't be told apart from the last page.
+		self.page_size = page_size or board_api.config.get('page_size', 100)
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS cursors (board_id TEXT PRIMARY KEY, since TEXT NOT NULL, seen TEXT NOT NULL)")
+		self.db.commit()
+	
+	def get_cursor(self, board_id: UUID) -> Optional[Tuple[str, Set[str]]]:
+		"""
+		Get the stored cursor of a board as (timestamp, message IDs at that timestamp).
+		"""
+		with self.lock:
+			row = self.db.execute("SELECT since, seen FROM cursors WHERE board_id = ?", (str(board_id),)).fetchone()
+		if row is None:
+			return None
+		return row[0], set(json.loads(row[1]))
+	
+	def set_cursor(self, board_id: UUID, since: str, seen: Set[str]):
+		with self.lock:
+			self.db.execute("INSERT OR REPLACE INTO cursors (board_id, since, seen) VALUES (?, ?, ?)", (str(board_id), since, json.dumps(sorted(seen))))
+			self.db.commit()
+	
+	def reset(self, board_id: UUID):
+		"""
+		Forget the cursor of a board. The next sync rescans the whole board.
+		"""
+		with self.lock:
+			self.db.execute("DELETE FROM cursors WHERE board_id = ?", (str(board_id),))
+			self.db.commit()
+	
+	def sync(self, session_id: UUID, board_id: UUID) -> List[dict]:
+		"""
+		Retrieve all messages posted since the last sync, oldest first.
+		
+		Without a stored cursor this fetches the whole board.
+		"""
+		cursor = self.get_cursor(board_id)
+		since, seen = cursor if cursor is not None else (None, set())
+		
+		new: Dict[str, dict] = {}
+		start = 0
+		while True:
+			page = self.board_api.get_messages(session_id, board_id, start=start, count=self.page_size, since_time=since)
+			for msg in page:
+				if msg['id'] not in seen:
+					new.setdefault(msg['id'], msg)
+			if len(page) < self.page_size:
+				break
+			start += len(page)
+		
+		if not new:
+			return []
+		
+		times = {msg_id: Translator.from_subtext(msg['timestamp'], datetime) for msg_id, msg in new.items()}
+		messages = sorted(new.values(), key=lambda msg: times[msg['id']])
+		
+		# Keep the timestamp exactly as the server sent it, so it is parsed
+		# back into the same value when passed as sinceTime.
+		newest = messages[-1]['timestamp']
+		newest_time = times[messages[-1]['id']]
+		newest_seen = {msg_id for msg_id, time in times.items() if time == newest_time}
+		if since is not None and Translator.from_subtext(since, datetime) == newest_time:
+			newest_seen |= seen
+		self.set_cursor(board_id, newest, newest_seen)
+		
+		return messages
+	
+	def close(self):
+		with self.lock:
+			self.db.close()
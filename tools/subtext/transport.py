@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+subtext.transport - Shared HTTP transport.
+"""
+from typing import TYPE_CHECKING
+import collections.abc, time
+
+from .metrics import Instrumentation, RequestInfo, _error_code, _counted
+from . import httpcache, flow, coalesce
+
+if TYPE_CHECKING:
+	import requests
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'))
+
+class Transport:
+	"""
+	Pooled HTTP transport shared by all API classes of a Subtext instance.
+	
+	Connections are kept alive and reused between requests. Idempotent
+	requests (GET, PUT, DELETE) are retried with exponential backoff on
+	connection errors and on 502/503/504 responses.
+	
+	Every request is reported to the hooks registered on instrumentation.
+	
+	If the http_cache option is set, GET responses with an ETag or
+	Last-Modified header are cached and revalidated with conditional
+	requests (see subtext.httpcache).
+	
+	If the flow_control option is set, requests are paced by a
+	subtext.flow.FlowController, and if the coalesce option is set,
+	identical concurrent GETs are merged (see subtext.coalesce). With flow
+	control, retries are made above the controller instead of inside
+	urllib3, so every attempt takes a slot and the controller sees each
+	overload response; 429 responses are retried as well.
+	"""
+	def __init__(self, **config):
+		self.config = config
+		self.timeout = config.get('timeout', 10.0)
+		self.instrumentation = Instrumentation()
+		self.cache, self.owns_cache = httpcache.from_config(config)
+		self.flow = flow.from_config(config)
+		self.coalesce = coalesce.from_config(config)
+		self.max_retries = config.get('max_retries', 3)
+		self.backoff_factor = config.get('backoff_factor', 0.5)
+		
+		# requests takes a while to import, so it is only loaded once a
+		# transport is actually needed
+		import requests
+		from requests.adapters import HTTPAdapter
+		from urllib3.util.retry import Retry
+		
+		self.retry_errors = (requests.ConnectionError, requests.Timeout)
+		if self.flow is None:
+			retry = Retry(
+				total=self.max_retries,
+				backoff_factor=self.backoff_factor,
+				status_forcelist=(502, 503, 504),
+				allowed_methods=IDEMPOTENT_METHODS,
+				raise_on_status=False
+			)
+		else:
+			# Retried in _flowed()
+			retry = Retry(total=0, raise_on_status=False)
+		adapter = HTTPAdapter(
+			pool_connections=config.get('pool_size', 10),
+			pool_maxsize=config.get('pool_size', 10),
+			max_retries=retry
+		)
+		
+		self.session = requests.Session()
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+	
+	def request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+		"""
+		Send a request over the pooled session.
+		"""
+		kwargs.setdefault('timeout', self.timeout)
+		if self.coalesce is not None and method == 'GET' and not kwargs.get('stream'):
+			key = self.coalesce.key(url, kwargs.get('params'), kwargs.get('headers'))
+			return self.coalesce.do(key, lambda: self._cached(method, url, **kwargs))
+		return self._cached(method, url, **kwargs)
+	
+	def _cached(self, method: str, url: str, **kwargs) -> 'requests.Response':
+		if self.cache is None or method != 'GET' or kwargs.get('stream'):
+			return self._flowed(method, url, **kwargs)
+		
+		key = self.cache.key(url, kwargs.get('params'))
+		entry = self.cache.get(key)
+		if entry is not None:
+			kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.validators())
+		resp = self._flowed(method, url, **kwargs)
+		replay = self.cache.handle(key, entry, resp.status_code, resp.headers, resp.content)
+		if replay is not None:
+			resp.status_code = 200
+			resp._content = replay.content
+			resp.headers.update(replay.headers)
+		return resp
+	
+	def _flowed(self, method: str, url: str, **kwargs) -> 'requests.Response':
+		if self.flow is None:
+			return self._request(method, url, **kwargs)
+		retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+		attempt = 0
+		while True:
+			slot = self.flow.acquire(method, url)
+			start = time.monotonic()
+			resp, status, retry_after = None, 0, None
+			try:
+				resp = self._request(method, url, **kwargs)
+				status, retry_after = resp.status_code, resp.headers.get('Retry-After')
+			except self.retry_errors:
+				if attempt >= retries:
+					raise
+			finally:
+				self.flow.release(slot, time.monotonic() - start, status, retry_after)
+			if resp is not None:
+				if status not in flow.RETRY_STATUSES or attempt >= retries:
+					return resp
+				resp.close()
+			# Sleeps without holding a slot; a Retry-After pause is waited
+			# out in acquire()
+			time.sleep(self.backoff_factor * (2 ** attempt))
+			attempt += 1
+	
+	def _request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+		if not self.instrumentation.hooks:
+			return self.session.request(method, url, **kwargs)
+		
+		info = RequestInfo(method, url)
+		data = kwargs.get('data')
+		streamed = isinstance(data, collections.abc.Iterator) and not hasattr(data, 'read')
+		if streamed:
+			kwargs['data'] = _counted(data, info)
+		self.instrumentation.pre_request(info)
+		info.start = time.monotonic()
+		try:
+			resp = self.session.request(method, url, **kwargs)
+		except Exception as e:
+			info.latency = time.monotonic() - info.start
+			info.error = type(e).__name__
+			self.instrumentation.post_request(info)
+			raise
+		info.latency = time.monotonic() - info.start
+		info.status = resp.status_code
+		if not streamed:
+			info.bytes_out = int(resp.request.headers.get('Content-Length', 0))
+		if kwargs.get('stream') and resp.status_code // 100 == 2:
+			info.bytes_in = int(resp.headers.get('Content-Length', 0))
+		else:
+			info.bytes_in = len(resp.content)
+		info.error = _error_code(resp.status_code, resp.headers.get('Content-Type', ''), resp.content if resp.status_code // 100 != 2 else b'')
+		self.instrumentation.post_request(info)
+		return resp
+	
+	def get(self, url: str, **kwargs) -> 'requests.Response':
+		return self.request('GET', url, **kwargs)
+	
+	def post(self, url: str, **kwargs) -> 'requests.Response':
+		return self.request('POST', url, **kwargs)
+	
+	def put(self, url: str, **kwargs) -> 'requests.Response':
+		return self.request('PUT', url, **kwargs)
+	
+	def delete(self, url: str, **kwargs) -> 'requests.Response':
+		return self.request('DELETE', url, **kwargs)
+	
+	def close(self):
+		"""
+		Close all pooled connections.
+		"""
+		self.session.close()
+		if self.owns_cache:
+			self.cache.close()
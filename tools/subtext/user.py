@@ -2,8 +2,7 @@
 """
 subtext.user - Subtext user API.
 """
-from typing import Optional
-import requests
+from typing import Callable, List, Optional
 from uuid import UUID
 from enum import Enum
 from datetime import datetime
@@ -14,19 +13,25 @@ class UserPresence(Enum):
 	away = 'Away'
 	busy = 'Busy'
 
-from .common import _assert_compatibility, VersionError, APIError, PagedList
+from .common import _assert_compatibility, VersionError, APIError, PagedList, Body, _stream_body, _typed
+from .transport import Transport
 
 class UserAPI:
 	"""
 	Subtext user API class.
 	"""
-	def __init__(self, url: str, version: str, **config):
+	def __init__(self, url: str, version: str, transport: Transport, **config):
 		self.url = url
 		self.version = version
+		self.transport = transport
 		self.config = config
+		# Called with the name and ID of every user created / ID of every
+		# user deleted through this API, e.g. to invalidate caches
+		self.on_create: List[Callable[[str, UUID], None]] = []
+		self.on_delete: List[Callable[[UUID], None]] = []
 	
 	def create(self, name: str, password: str, public_key: bytes = bytes(0)):
-		resp = requests.post(self.url + "/Subtext/user/create", data=public_key, params={
+		resp = self.transport.post(self.url + "/Subtext/user/create", data=public_key, params={
 			'name': name,
 			'password': password
 		}, headers={'Content-Type': 'application/octet-stream'})
@@ -35,10 +40,13 @@ class UserAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		user_id = resp.json()
+		for callback in self.on_create:
+			callback(name, UUID(str(user_id)))
+		return user_id
 	
 	def query_id_by_name(self, name: str):
-		resp = requests.get(self.url + "/Subtext/user/queryidbyname", params={
+		resp = self.transport.get(self.url + "/Subtext/user/queryidbyname", params={
 			'name': name
 		})
 		if resp.status_code // 100 != 2:
@@ -49,7 +57,7 @@ class UserAPI:
 		return resp.json()
 	
 	def login(self, user_id: UUID, password: str):
-		resp = requests.post(self.url + "/Subtext/user/login", params={
+		resp = self.transport.post(self.url + "/Subtext/user/login", params={
 			'userId': user_id,
 			'password': password
 		})
@@ -59,9 +67,9 @@ class UserAPI:
 			else:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
-		
+	
 	def heartbeat(self, session_id: UUID):
-		resp = requests.post(self.url + "/Subtext/user/heartbeat", params={
+		resp = self.transport.post(self.url + "/Subtext/user/heartbeat", params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -70,9 +78,9 @@ class UserAPI:
 			else:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
-		
+	
 	def logout(self, session_id: UUID):
-		resp = requests.post(self.url + "/Subtext/user/logout", params={
+		resp = self.transport.post(self.url + "/Subtext/user/logout", params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -81,9 +89,9 @@ class UserAPI:
 			else:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
-		
+	
 	def get(self, session_id: UUID, user_id: UUID):
-		resp = requests.get(self.url + "/Subtext/user/{}".format(user_id), params={
+		resp = self.transport.get(self.url + "/Subtext/user/{}".format(user_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -91,10 +99,10 @@ class UserAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		return _typed(self.config, 'User', resp.json())
 	
 	def get_friends(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/user/{}/friends".format(user_id), params={
+		resp = self.transport.get(self.url + "/Subtext/user/{}/friends".format(user_id), params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count
@@ -106,8 +114,15 @@ class UserAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
 	
+	def iter_friends(self, session_id: UUID, user_id: UUID, **options) -> PagedList:
+		"""
+		Iterate over the IDs of all friends of the user.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_friends(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
 	def remove_friend(self, session_id: UUID, user_id: UUID, friend_id: UUID):
-		resp = requests.delete(self.url + "/Subtext/user/{}/friends/{}".format(user_id, friend_id), params={
+		resp = self.transport.delete(self.url + "/Subtext/user/{}/friends/{}".format(user_id, friend_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -118,7 +133,7 @@ class UserAPI:
 		return resp.json()
 	
 	def get_blocked_users(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
+		resp = self.transport.get(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count
@@ -130,8 +145,15 @@ class UserAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
 	
+	def iter_blocked_users(self, session_id: UUID, user_id: UUID, **options) -> PagedList:
+		"""
+		Iterate over the IDs of all users blocked by the user.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_blocked_users(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
 	def add_blocked_user(self, session_id: UUID, user_id: UUID, blocked_id: UUID):
-		resp = requests.post(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
+		resp = self.transport.post(self.url + "/Subtext/user/{}/blocked".format(user_id), params={
 			'sessionId': session_id,
 			'blockedId': blocked_id
 		})
@@ -143,7 +165,7 @@ class UserAPI:
 		return resp.json()
 	
 	def remove_blocked_user(self, session_id: UUID, user_id: UUID, blocked_id: UUID):
-		resp = requests.delete(self.url + "/Subtext/user/{}/blocked/{}".format(user_id, blocked_id), params={
+		resp = self.transport.delete(self.url + "/Subtext/user/{}/blocked/{}".format(user_id, blocked_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -154,7 +176,7 @@ class UserAPI:
 		return resp.json()
 	
 	def get_friend_requests(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
+		resp = self.transport.get(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count
@@ -166,8 +188,15 @@ class UserAPI:
 				raise APIError(resp.text, resp.status_code)
 		return resp.json()
 	
+	def iter_friend_requests(self, session_id: UUID, user_id: UUID, **options) -> PagedList:
+		"""
+		Iterate over the IDs of all users who sent the user a friend request.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_friend_requests(session_id, user_id, start, page_size), page_size=page_size, **options)
+	
 	def send_friend_request(self, session_id: UUID, user_id: UUID):
-		resp = requests.post(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
+		resp = self.transport.post(self.url + "/Subtext/user/{}/friendrequests".format(user_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -178,7 +207,7 @@ class UserAPI:
 		return resp.json()
 	
 	def accept_friend_request(self, session_id: UUID, user_id: UUID, sender_id: UUID):
-		resp = requests.post(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
+		resp = self.transport.post(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -189,7 +218,7 @@ class UserAPI:
 		return resp.json()
 	
 	def reject_friend_request(self, session_id: UUID, user_id: UUID, sender_id: UUID):
-		resp = requests.delete(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
+		resp = self.transport.delete(self.url + "/Subtext/user/{}/friendrequests/{}".format(user_id, sender_id), params={
 			'sessionId': session_id
 		})
 		if resp.status_code // 100 != 2:
@@ -200,7 +229,7 @@ class UserAPI:
 		return resp.json()
 	
 	def get_keys(self, session_id: UUID, user_id: UUID, start: Optional[int] = None, count: Optional[int] = None):
-		resp = requests.get(self.url + "/Subtext/user/{}/keys".format(user_id), params={
+		resp = self.transport.get(self.url + "/Subtext/user/{}/keys".format(user_id), params={
 			'sessionId': session_id,
 			'start': start,
 			'count': count
@@ -210,10 +239,22 @@ class UserAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
-		return resp.json()
+		return _typed(self.config, 'PublicKey', resp.json())
+	
+	def iter_keys(self, session_id: UUID, user_id: UUID, **options) -> PagedList:
+		"""
+		Iterate over the public key records of the user.
+		"""
+		page_size = self.config['page_size']
+		return PagedList(lambda start: self.get_keys(session_id, user_id, start, page_size), page_size=page_size, **options)
 	
-	def add_key(self, session_id: UUID, user_id: UUID, public_key: bytes):
-		resp = requests.post(self.url + "/Subtext/user/{}/keys".format(user_id), data=public_key, params={
+	def add_key(self, session_id: UUID, user_id: UUID, public_key: Body, progress: Optional[Callable[[int, Optional[int]], None]] = None):
+		"""
+		Publish a public key for the user.
+		
+		public_key is streamed like the content in BoardAPI.post_message.
+		"""
+		resp = self.transport.post(self.url + "/Subtext/user/{}/keys".format(user_id), data=_stream_body(public_key, progress), params={
 			'sessionId': session_id
 		}, headers={'Content-Type': 'application/octet-stream'})
 		if resp.status_code // 100 != 2:
@@ -224,9 +265,9 @@ class UserAPI:
 		return resp.json()
 	
 	def set_presence(self, session_id: UUID, user_id: UUID, presence: UserPresence, until_time: Optional[datetime] = None, other_data: str = ""):
-		resp = requests.put(self.url + "/Subtext/user/{}/presence".format(user_id), params={
+		resp = self.transport.put(self.url + "/Subtext/user/{}/presence".format(user_id), params={
 			'sessionId': session_id,
-			'presence': presence,
+			'presence': presence.value,
 			'untilTime': until_time,
 			'otherData': other_data
 		})
@@ -238,7 +279,7 @@ class UserAPI:
 		return resp.json()
 	
 	def delete(self, session_id: UUID, user_id: UUID, password: str):
-		resp = requests.delete(self.url + "/Subtext/user/{}".format(user_id), params={
+		resp = self.transport.delete(self.url + "/Subtext/user/{}".format(user_id), params={
 			'sessionId': session_id,
 			'password': password
 		})
@@ -247,4 +288,6 @@ class UserAPI:
 				raise APIError(resp.json()['error'], resp.status_code)
 			else:
 				raise APIError(resp.text, resp.status_code)
+		for callback in self.on_delete:
+			callback(user_id)
 		return resp.json()
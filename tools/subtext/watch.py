@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+subtext.watch - Detection of boards with new activity.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import sqlite3, threading
+from uuid import UUID
+from datetime import datetime
+
+from .common import Translator
+from .board import BoardAPI
+
+class BoardChange:
+	"""
+	A board whose timestamps differ from the snapshot.
+	
+	kind is 'significant' (LastSignificantUpdate moved, i.e. new messages),
+	'new' (not in the snapshot yet), 'update' (only LastUpdate moved, e.g.
+	membership changes) or 'removed' (no longer listed, board is None).
+	"""
+	__slots__ = ('board_id', 'kind', 'board')
+	
+	def __init__(self, board_id: str, kind: str, board: Any = None):
+		self.board_id = board_id
+		self.kind = kind
+		self.board = board
+	
+	def __repr__(self) -> str:
+		return 'BoardChange({}, {!r})'.format(self.board_id, self.kind)
+
+# Order of the change kinds in the result of BoardWatcher.check()
+_PRIORITY = {'significant': 0, 'new': 1, 'update': 2, 'removed': 3}
+
+class BoardWatcher:
+	"""
+	Finds the boards that changed since the last check.
+	
+	One pass over BoardAPI.iter_boards() is compared against a snapshot of
+	every board's LastUpdate and LastSignificantUpdate, so the messages of
+	idle boards are never requested. The snapshot is kept in an SQLite
+	database; with a file path it survives restarts and the first check
+	after one only reports what changed while the client was away.
+	
+	By default a check also updates the snapshot. With acknowledge=False the
+	snapshot is left alone until acknowledge() is called for a change, so a
+	board that failed to sync is reported again on the next check.
+	"""
+	def __init__(self, board_api: BoardAPI, path: str = ":memory:"):
+		self.board_api = board_api
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS snapshot (board_id TEXT PRIMARY KEY, last_update TEXT, last_significant_update TEXT)")
+		self.db.commit()
+	
+	def _snapshot(self) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+		with self.lock:
+			return {row[0]: (row[1], row[2]) for row in self.db.execute("SELECT board_id, last_update, last_significant_update FROM snapshot")}
+	
+	def check(self, session_id: UUID, acknowledge: bool = True, only_owned: Optional[bool] = None) -> List[BoardChange]:
+		"""
+		List the boards that changed since the snapshot: boards with new
+		messages first (most recent first), then newly joined boards, then
+		other updates, then boards that are no longer listed.
+		
+		With only_owned, boards the user doesn't own are missing from the
+		listing, so no boards are reported as removed.
+		"""
+		snapshot = self._snapshot()
+		changes: List[BoardChange] = []
+		listed = set()
+		for board in self.board_api.iter_boards(session_id, only_owned):
+			board_id = str(board['id'])
+			listed.add(board_id)
+			old = snapshot.get(board_id)
+			if old is None:
+				changes.append(BoardChange(board_id, 'new', board))
+			elif old[1] != board['lastSignificantUpdate']:
+				changes.append(BoardChange(board_id, 'significant', board))
+			elif old[0] != board['lastUpdate']:
+				changes.append(BoardChange(board_id, 'update', board))
+		if not only_owned:
+			for board_id in snapshot.keys() - listed:
+				changes.append(BoardChange(board_id, 'removed'))
+		
+		def order(change: BoardChange):
+			if change.board is None:
+				return (_PRIORITY[change.kind], 0.0)
+			return (_PRIORITY[change.kind], -Translator.from_subtext(change.board['lastSignificantUpdate'], datetime).timestamp())
+		changes.sort(key=order)
+		
+		if acknowledge:
+			self.acknowledge(changes)
+		return changes
+	
+	def acknowledge(self, changes: Iterable[BoardChange]):
+		"""
+		Record changes in the snapshot, so they are not reported again.
+		"""
+		with self.lock:
+			for change in changes:
+				if change.board is None:
+					self.db.execute("DELETE FROM snapshot WHERE board_id = ?", (change.board_id,))
+				else:
+					self.db.execute("INSERT OR REPLACE INTO snapshot (board_id, last_update, last_significant_update) VALUES (?, ?, ?)", (change.board_id, change.board['lastUpdate'], change.board['lastSignificantUpdate']))
+			self.db.commit()
+	
+	def sync(self, session_id: UUID, board_sync: Any, significant_only: bool = False) -> Dict[str, List[dict]]:
+		"""
+		Fetch the new messages of every changed board with a BoardSync,
+		keyed by board ID. A change is only acknowledged once its board
+		synced successfully.
+		"""
+		messages = {}
+		for change in self.check(session_id, acknowledge=False):
+			if change.kind == 'removed':
+				board_sync.reset(change.board_id)
+			elif significant_only and change.kind == 'update':
+				pass
+			else:
+				messages[change.board_id] = board_sync.sync(session_id, change.board_id)
+			self.acknowledge((change,))
+		return messages
+	
+	def reset(self, board_id: Optional[UUID] = None):
+		"""
+		Forget the snapshot of a board (or of all boards), so it is
+		reported as new on the next check.
+		"""
+		with self.lock:
+			if board_id is None:
+				self.db.execute("DELETE FROM snapshot")
+			else:
+				self.db.execute("DELETE FROM snapshot WHERE board_id = ?", (str(board_id),))
+			self.db.commit()
+	
+	def close(self):
+		with self.lock:
+			self.db.close()
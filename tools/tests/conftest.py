@@ -0,0 +1,25 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtext import Subtext
+from subtext.stub import StubServer
+
+@pytest.fixture
+def server():
+	with StubServer() as server:
+		yield server
+
+@pytest.fixture
+def client(server):
+	with Subtext(server.url) as client:
+		yield client
+
+@pytest.fixture
+def alice(server, client):
+	"""
+	(user ID, session ID) of a logged in user.
+	"""
+	user_id = server.state.add_user("alice", "password1")
+	return user_id, client.user.login(user_id, "password1")
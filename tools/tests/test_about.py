@@ -0,0 +1,41 @@
+import json
+
+from subtext import Subtext
+from subtext.common import AboutCache
+
+def test_lazy_client_makes_no_requests(server):
+	client = Subtext(server.url, lazy=True)
+	assert client._transport is None
+	user_id = server.state.add_user("alice", "password1")
+	assert client.user.login(user_id, "password1")
+	assert client.version == client.about()['version']
+	client.close()
+
+def test_about_cache_replaces_the_probe(server, tmp_path):
+	path = str(tmp_path / 'about.json')
+	with Subtext(server.url, about_cache=path) as client:
+		version = client.version
+	with open(path) as f:
+		assert json.load(f)[server.url]['about']['version'] == version
+	
+	client = Subtext(server.url, about_cache=path)
+	assert client._transport is None
+	assert client.version == version
+	
+	# Expired entries are probed again
+	client = Subtext(server.url, about_cache=path, about_cache_ttl=0)
+	assert client._transport is not None
+	client.close()
+
+def test_incompatible_cache_entries_are_dropped(server, tmp_path):
+	path = str(tmp_path / 'about.json')
+	AboutCache(path).put(server.url, {'version': '99.0.0'})
+	with Subtext(server.url, about_cache=path) as client:
+		assert client.version != '99.0.0'
+	assert AboutCache(path).get(server.url)['version'] == client.version
+
+def test_unwritable_cache_is_ignored(tmp_path):
+	(tmp_path / 'file').write_text('')
+	cache = AboutCache(str(tmp_path / 'file' / 'about.json'))
+	cache.put('http://localhost', {'version': '1.0.0'})
+	assert cache.get('http://localhost') is None
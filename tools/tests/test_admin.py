@@ -0,0 +1,18 @@
+from uuid import UUID
+import pytest
+
+from subtext import APIError
+
+@pytest.mark.parametrize('use_processes', (False, True), ids=('threads', 'processes'))
+def test_login_many(server, client, use_processes):
+	admins = [server.state.add_admin() for _ in range(4)]
+	wrong_id, wrong_secret = server.state.add_admin()
+	credentials = admins + [(wrong_id, bytes(len(wrong_secret)))]
+	results = client.admin.login_many(credentials, max_workers=2, use_processes=use_processes)
+	assert set(results) == {admin_id for admin_id, secret in credentials}
+	sessions = [results[admin_id] for admin_id, secret in admins]
+	assert all(isinstance(session_id, UUID) for session_id in sessions)
+	assert {server.state.admin_sessions[session_id]['adminId'] for session_id in sessions} == {admin_id for admin_id, secret in admins}
+	assert isinstance(results[wrong_id], APIError)
+	assert client.admin.kdf_stats.count == 5
+	assert client.admin.kdf_stats.max >= client.admin.kdf_stats.mean > 0
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+
+from subtext import APIError, message_content
+from subtext.aio import AsyncSubtext
+
+def test_async_client_round_trip(server):
+	user_id = server.state.add_user("alice", "password1")
+	async def main():
+		async with AsyncSubtext(server.url, page_size=2) as subtext:
+			session_id = await subtext.user.login(user_id, "password1")
+			board_id = await subtext.board.create(session_id, "board")
+			for i in range(5):
+				await subtext.board.post_message(session_id, board_id, bytes([i]) * 10)
+			page = await subtext.board.get_messages(session_id, board_id)
+			iterated = [message async for message in subtext.board.iter_messages(session_id, board_id, limit=4)]
+			user = await subtext.user.get(session_id, user_id)
+			return page, iterated, user
+	page, iterated, user = asyncio.run(main())
+	assert sorted(message_content(m) for m in page) == [bytes([i]) * 10 for i in range(5)]
+	assert [m['id'] for m in iterated] == [m['id'] for m in page][:4]
+	assert user['name'] == "alice"
+
+def test_async_client_raises_api_errors(server):
+	async def main():
+		async with AsyncSubtext(server.url) as subtext:
+			await subtext.user.login(server.state.add_user("alice", "password1"), "wrong")
+	with pytest.raises(APIError) as info:
+		asyncio.run(main())
+	assert info.value.status_code == 401
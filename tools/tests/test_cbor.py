@@ -0,0 +1,80 @@
+from uuid import UUID, uuid4
+import pytest
+
+from subtext import cbor
+
+def test_round_trip():
+	user_id = uuid4()
+	value = [{
+		'id': user_id,
+		'text': "héllo",
+		'empty': "",
+		'content': bytes(range(256)) * 4,
+		'numbers': [0, 23, 24, 255, 256, 65535, 65536, 2 ** 32, 2 ** 63, -1, -25, -2 ** 40],
+		'float': 1.5,
+		'flags': [True, False, None],
+		'nested': {'a': [{}, []]},
+	}]
+	decoded = cbor.loads(cbor.dumps(value))
+	assert decoded[0]['id'] == str(user_id)
+	assert isinstance(decoded[0]['content'], memoryview)
+	decoded[0]['content'] = bytes(decoded[0]['content'])
+	value[0]['id'] = str(user_id)
+	assert decoded == value
+
+def test_indefinite_lengths():
+	# [_ "ab", {_ "k": 1}] with chunked text
+	data = bytes((0x9f, 0x7f, 0x61)) + b'a' + bytes((0x61,)) + b'b' + bytes((0xff, 0xbf, 0x61)) + b'k' + bytes((0x01, 0xff, 0xff))
+	assert cbor.loads(data) == ["ab", {'k': 1}]
+
+def test_truncated_input_raises():
+	data = cbor.dumps([{'id': uuid4(), 'text': "hello world", 'content': b'x' * 300, 'n': -70000, 'f': 0.25, 'none': None}])
+	for end in range(len(data)):
+		with pytest.raises(ValueError):
+			cbor.loads(data[:end])
+
+def test_trailing_data_raises():
+	with pytest.raises(ValueError):
+		cbor.loads(cbor.dumps(1) + b'\x00')
+
+@pytest.mark.parametrize('data', (b'\x1f', b'\x3f', b'\xdf\x01', b'\x1c'))
+def test_invalid_additional_information_raises(data):
+	with pytest.raises(ValueError):
+		cbor.loads(data)
+
+def test_unknown_types_need_default():
+	with pytest.raises(TypeError):
+		cbor.dumps(object())
+	assert cbor.loads(cbor.dumps({1, 2}, default=sorted)) == [1, 2]
+
+def test_is_cbor():
+	assert cbor.is_cbor('application/cbor')
+	assert cbor.is_cbor('Application/CBOR; charset=binary')
+	assert not cbor.is_cbor('application/json')
+	assert not cbor.is_cbor(None)
+
+def test_message_pages_over_cbor(server, alice):
+	from subtext import Subtext, message_content
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	contents = [bytes([i]) * 100 for i in range(5)]
+	for content in contents:
+		server.state.add_message(board_id, user_id, content)
+	with Subtext(server.url, binary_messages=True) as client:
+		session_id = client.user.login(user_id, "password1")
+		page = client.board.get_messages(session_id, board_id)
+	assert all(isinstance(message_content(msg), memoryview) for msg in page)
+	assert sorted(bytes(message_content(msg)) for msg in page) == contents
+
+def test_only_message_pages_are_negotiated(server, alice):
+	import requests
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	server.state.add_message(board_id, user_id, b'hello')
+	headers = {'Accept': 'application/cbor, application/json;q=0.9'}
+	resp = requests.get(server.url + "/Subtext/board", params={'sessionId': session_id}, headers=headers)
+	assert resp.headers['Content-Type'].startswith('application/json')
+	assert resp.json()[0]['name'] == "board"
+	resp = requests.get(server.url + "/Subtext/board/{}/messages".format(board_id), params={'sessionId': session_id}, headers=headers)
+	assert cbor.is_cbor(resp.headers['Content-Type'])
+	assert bytes(cbor.loads(resp.content)[0]['content']) == b'hello'
@@ -0,0 +1,121 @@
+import asyncio, threading, time
+import pytest
+
+from subtext.coalesce import SingleFlight
+
+def test_concurrent_calls_share_one_request():
+	flight = SingleFlight()
+	started = threading.Event()
+	release = threading.Event()
+	calls = []
+	def request():
+		calls.append(1)
+		started.set()
+		release.wait()
+		return 42
+	results = []
+	leader = threading.Thread(target=lambda: results.append(flight.do('key', request)))
+	leader.start()
+	started.wait()
+	followers = [threading.Thread(target=lambda: results.append(flight.do('key', request))) for _ in range(3)]
+	for thread in followers:
+		thread.start()
+	while flight.stats()['hits'] < 3:
+		time.sleep(0.001)
+	release.set()
+	for thread in [leader, *followers]:
+		thread.join()
+	assert results == [42] * 4
+	assert len(calls) == 1
+	assert flight.stats()['in_flight'] == 0
+
+def test_errors_are_shared_and_not_kept():
+	flight = SingleFlight()
+	started = threading.Event()
+	release = threading.Event()
+	def request():
+		started.set()
+		release.wait()
+		raise KeyError('boom')
+	errors = []
+	def call():
+		try:
+			flight.do('key', request)
+		except KeyError as e:
+			errors.append(e)
+	leader = threading.Thread(target=call)
+	leader.start()
+	started.wait()
+	follower = threading.Thread(target=call)
+	follower.start()
+	while flight.stats()['hits'] < 1:
+		time.sleep(0.001)
+	release.set()
+	leader.join()
+	follower.join()
+	assert len(errors) == 2
+	# The next call makes a new request
+	assert flight.do('key', lambda: 1) == 1
+
+def test_session_is_ignored_only_for_shared_endpoints():
+	flight = SingleFlight()
+	url = 'http://localhost/Subtext/user/queryidbyname'
+	assert flight.key(url, {'sessionId': 'a', 'name': 'x'}) == flight.key(url, {'sessionId': 'b', 'name': 'x'})
+	url = 'http://localhost/Subtext/board'
+	assert flight.key(url, {'sessionId': 'a'}) != flight.key(url, {'sessionId': 'b'})
+
+def test_cancelled_leader_does_not_fail_followers():
+	flight = SingleFlight()
+	calls = []
+	async def request():
+		calls.append(1)
+		await asyncio.sleep(0.1)
+		return 42
+	async def main():
+		leader = asyncio.create_task(asyncio.wait_for(flight.do_async('key', request), 0.02))
+		await asyncio.sleep(0)
+		followers = [asyncio.create_task(flight.do_async('key', request)) for _ in range(3)]
+		with pytest.raises(asyncio.TimeoutError):
+			await leader
+		return await asyncio.gather(*followers)
+	assert asyncio.run(main()) == [42] * 3
+	assert len(calls) == 1
+
+def test_request_is_cancelled_once_every_caller_gave_up():
+	flight = SingleFlight()
+	cancelled = []
+	async def request():
+		try:
+			await asyncio.sleep(10)
+		except asyncio.CancelledError:
+			cancelled.append(1)
+			raise
+	async def main():
+		callers = [asyncio.create_task(flight.do_async('key', request)) for _ in range(2)]
+		await asyncio.sleep(0.01)
+		callers[0].cancel()
+		await asyncio.sleep(0.01)
+		assert not cancelled
+		callers[1].cancel()
+		await asyncio.gather(*callers, return_exceptions=True)
+		await asyncio.sleep(0)
+		assert cancelled
+		# A later call starts a new request
+		async def other():
+			return 1
+		return await flight.do_async('key', other)
+	assert asyncio.run(main()) == 1
+	assert flight.stats()['in_flight'] == 0
+
+def test_async_errors_reach_every_caller():
+	flight = SingleFlight()
+	calls = []
+	async def request():
+		calls.append(1)
+		await asyncio.sleep(0.01)
+		raise KeyError('boom')
+	async def main():
+		return await asyncio.gather(*(flight.do_async('key', request) for _ in range(3)), return_exceptions=True)
+	results = asyncio.run(main())
+	assert all(isinstance(result, KeyError) for result in results)
+	assert len(calls) == 1
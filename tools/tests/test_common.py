@@ -0,0 +1,51 @@
+import pytest
+
+from subtext import PagedList
+
+def _source(count, page_size):
+	items = list(range(count))
+	calls = []
+	def callback(start):
+		calls.append(start)
+		return items[start:start + page_size]
+	return items, calls, callback
+
+@pytest.mark.parametrize('prefetch', (False, True))
+def test_paged_list_slicing(prefetch):
+	items, calls, callback = _source(25, 10)
+	values = PagedList(callback, page_size=10, prefetch=prefetch)
+	assert values[3:17:2] == items[3:17:2]
+	assert values[20:100] == items[20:]
+	assert values[-5:] == items[-5:]
+	assert values[::-3] == items[::-3]
+	assert values[5:-5] == items[5:-5]
+	assert values[30:] == []
+	assert list(values) == items
+
+def test_paged_list_negative_indices():
+	items, calls, callback = _source(25, 10)
+	values = PagedList(callback, page_size=10, prefetch=False)
+	assert values[-1] == 24
+	assert values[-25] == 0
+	with pytest.raises(IndexError):
+		values[-26]
+	with pytest.raises(IndexError):
+		values[25]
+	# A short page ends the list, so the empty page is never requested
+	assert 30 not in calls
+
+def test_paged_list_window_refetches_evicted_items():
+	items, calls, callback = _source(25, 10)
+	values = PagedList(callback, page_size=10, window=10, prefetch=False)
+	assert list(values) == items
+	calls.clear()
+	assert values[0] == 0
+	assert calls == [0]
+
+def test_paged_list_limit():
+	items, calls, callback = _source(25, 10)
+	values = PagedList(callback, page_size=10, prefetch=False, limit=12)
+	assert list(values) == items[:12]
+	assert values[-1] == 11
+	with pytest.raises(IndexError):
+		values[12]
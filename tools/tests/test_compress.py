@@ -0,0 +1,45 @@
+import json
+
+from subtext import message_content
+from subtext.compress import MessageCompressor, DICTIONARY_TYPE
+
+def _samples(count):
+	return [json.dumps({'user': 'user%d' % (i % 7), 'text': 'status update number %d for the team' % i, 'ok': i % 3 == 0}).encode() for i in range(count)]
+
+def test_small_and_incompressible_contents_are_left_alone():
+	compressor = MessageCompressor()
+	assert compressor.compress('board', b'short') == (b'short', 'Message')
+	content, msg_type = compressor.compress('board', b'abc' * 1000)
+	assert msg_type == 'Message+zstd' and len(content) < 3000
+	assert compressor.decompress(content, msg_type) == (b'abc' * 1000, 'Message')
+	assert compressor.decompress(b'plain', 'Message') == (b'plain', 'Message')
+	assert (compressor.compressed, compressor.skipped) == (1, 1)
+
+def test_dictionary_round_trip(server, client, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	samples = _samples(1000)
+	sender = MessageCompressor()
+	sender.train(board_id, samples, size=4096)
+	plain = MessageCompressor()
+	message = _samples(1001)[-1]
+	assert len(sender.compress(board_id, message)[0]) < len(plain.compress(board_id, message)[0])
+	
+	sender.post_dictionary(client.board, session_id, board_id)
+	for sample in samples[:5]:
+		sender.post_message(client.board, session_id, board_id, sample)
+	
+	# Another member picks the dictionary up from the page; it is too
+	# large to be inline
+	receiver = MessageCompressor()
+	page = client.board.get_messages(session_id, board_id)
+	results = receiver.read_messages(board_id, page, fetch=lambda message: client.board.get_message(session_id, board_id, message['id']))
+	assert sorted(bytes(content) for message, content, msg_type in results if msg_type == 'Message') == sorted(samples[:5])
+	assert receiver.board_dictionaries[str(board_id)] == sender.board_dictionaries[str(board_id)]
+	
+	# Without the dictionary the messages can't be read
+	messages = [message for message in page if message['type'] != DICTIONARY_TYPE]
+	assert all(content is None for message, content, msg_type in MessageCompressor().read_messages(board_id, messages))
+	loader = MessageCompressor()
+	assert loader.load_dictionaries(client.board, session_id, board_id) == 1
+	assert [loader.decompress(bytes(message_content(message)), message['type'])[0] for message in messages] == [content for message, content, msg_type in results if msg_type == 'Message']
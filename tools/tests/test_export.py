@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+import gzip, json, os, uuid
+import pytest
+
+from subtext import APIError, AuditLogExporter
+from subtext.session import AdminSessionManager
+
+BASE = datetime(2024, 1, 1)
+END = BASE + timedelta(minutes=600)
+
+@pytest.fixture
+def sessions(server, client):
+	admin_id, secret = server.state.add_admin()
+	for i in range(600):
+		server.state.audit_log.append({'id': uuid.uuid4(), 'adminId': admin_id, 'action': 'Action', 'details': str(i), 'timestamp': BASE + timedelta(minutes=i)})
+	sessions = AdminSessionManager(client.admin, admin_id, secret)
+	yield sessions
+	sessions.close()
+
+def _rows(path):
+	with gzip.open(path, 'rt', encoding='utf-8') as f:
+		return [json.loads(line) for line in f]
+
+def test_export_resumes_from_the_checkpoint(sessions, tmp_path):
+	directory = str(tmp_path / 'export')
+	exporter = AuditLogExporter(sessions, directory, slice_size=timedelta(hours=1))
+	stats = exporter.export(BASE, END)
+	assert stats['slices'] == 10
+	assert stats['rows'] == 600
+	os.remove(exporter.part_path(3))
+	stats = AuditLogExporter(sessions, directory, slice_size=timedelta(hours=1)).export(BASE, END)
+	assert stats['fetched'] == 1
+	assert stats['total_rows'] == 600
+	rows = _rows(exporter.combine(str(tmp_path / 'all.jsonl.gz')))
+	assert len({row['details'] for row in rows}) == 600
+	# Newest first, and entries on slice boundaries are only exported once
+	assert [row['details'] for row in rows] == [str(i) for i in reversed(range(600))]
+
+def test_export_with_other_arguments_is_refused(sessions, tmp_path):
+	directory = str(tmp_path / 'export')
+	AuditLogExporter(sessions, directory, slice_size=timedelta(hours=1)).export(BASE, END)
+	with pytest.raises(ValueError):
+		AuditLogExporter(sessions, directory, slice_size=timedelta(hours=2)).export(BASE, END)
+
+def test_failed_slice_leaves_no_partial_part(server, sessions, tmp_path):
+	dispatch = server.dispatch
+	requests = []
+	def failing(method, path, body, headers=None):
+		if 'audit' in path:
+			requests.append(path)
+			if len(requests) == 3:
+				return 500, b'{"error":"Broken"}', {'Content-Type': 'application/json'}
+		return dispatch(method, path, body, headers)
+	server.dispatch = failing
+	directory = str(tmp_path / 'export')
+	exporter = AuditLogExporter(sessions, directory, slice_size=timedelta(hours=1), max_workers=1)
+	with pytest.raises(APIError):
+		exporter.export(BASE, END)
+	assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+	assert not sessions.running
+	stats = AuditLogExporter(sessions, directory, slice_size=timedelta(hours=1), max_workers=1).export(BASE, END)
+	assert stats['fetched'] == 1
+	assert stats['total_rows'] == 600
@@ -0,0 +1,32 @@
+import io
+
+from subtext import message_content
+from subtext.fetch import BodyFetcher
+
+def test_fetch_bodies_left_out_of_the_page(server, client, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	large = {}
+	for i in range(6):
+		content = bytes([i]) * (server.state.max_inline_message_size + 1 + i)
+		large[str(server.state.add_message(board_id, user_id, content))] = content
+	small = server.state.add_message(board_id, user_id, b'small')
+	
+	page = client.board.get_messages(session_id, board_id)
+	assert [str(m['id']) for m in BodyFetcher.missing(page)] == sorted(large, key=[str(m['id']) for m in page].index)
+	assert message_content(next(m for m in page if str(m['id']) == str(small))) == b'small'
+	
+	fetcher = BodyFetcher(client.board, max_workers=3)
+	assert {str(k): v for k, v in fetcher.fetch(session_id, board_id, page).items()} == large
+	
+	mapped = fetcher.fetch(session_id, board_id, page, use_mmap=True)
+	assert {str(k): bytes(v) for k, v in mapped.items()} == large
+	
+	files = {}
+	def sink(message):
+		return files.setdefault(str(message['id']), io.BytesIO())
+	fetcher.fetch(session_id, board_id, page, sink=sink)
+	assert {k: v.getvalue() for k, v in files.items()} == large
+
+def test_fetch_without_missing_bodies(client):
+	assert BodyFetcher(client.board).fetch(None, None, [{'id': 1, 'content': 'eA=='}]) == {}
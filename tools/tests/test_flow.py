@@ -0,0 +1,83 @@
+import time
+import pytest
+
+from subtext import Subtext
+from subtext.flow import Budget, FlowController
+
+URL = 'http://localhost/Subtext/board'
+
+def _controller(**options):
+	return FlowController(budgets={'read': Budget(initial=8, max_limit=16)}, **options)
+
+@pytest.mark.parametrize('status', (429, 503, 0))
+def test_overload_halves_the_limit(status):
+	flow = _controller()
+	flow.release(flow.acquire('GET', URL), 0.01, status)
+	metrics = flow.metrics()['read']
+	assert metrics['limit'] == 4
+	assert metrics['overloads'] == 1
+	assert metrics['in_flight'] == 0
+
+def test_server_errors_leave_the_limit_alone():
+	flow = _controller()
+	flow.release(flow.acquire('GET', URL), 0.01, 500)
+	assert flow.metrics()['read']['limit'] == 8
+
+def test_retry_after_pauses_the_class():
+	flow = _controller()
+	flow.release(flow.acquire('GET', URL), 0.01, 429, '0.2')
+	start = time.monotonic()
+	flow.release(flow.acquire('GET', URL), 0.01, 200)
+	assert time.monotonic() - start >= 0.15
+	# Other classes are not paused
+	start = time.monotonic()
+	flow.release(flow.acquire('POST', URL + '/create'), 0.01, 200)
+	assert time.monotonic() - start < 0.1
+
+def test_limit_grows_while_saturated():
+	flow = _controller()
+	limit = 8
+	for _ in range(200):
+		slots = [flow.acquire('GET', URL) for _ in range(limit)]
+		for slot in slots:
+			flow.release(slot, 0.01, 200)
+		limit = flow.metrics()['read']['limit']
+	assert flow.metrics()['read']['limit'] == 16
+
+def _failing(server, statuses, failing_path='/Subtext/user/queryidbyname'):
+	# Answer the first requests to failing_path with the given statuses
+	dispatch = server.dispatch
+	requests = []
+	def failing(method, path, body, headers=None):
+		if not path.startswith(failing_path):
+			return dispatch(method, path, body, headers)
+		requests.append(path)
+		if len(requests) <= len(statuses):
+			return statuses[len(requests) - 1], b'{"error":"Busy"}', {'Content-Type': 'application/json', 'Retry-After': '0'}
+		return dispatch(method, path, body, headers)
+	server.dispatch = failing
+	return requests
+
+def test_transport_retries_above_the_controller(server):
+	user_id = server.state.add_user("alice", "password1")
+	requests = _failing(server, (503, 429))
+	flow = _controller()
+	with Subtext(server.url, flow_control=flow, backoff_factor=0.01) as client:
+		assert client.user.query_id_by_name("alice") == str(user_id)
+	assert len(requests) == 3
+	assert flow.metrics()['read']['overloads'] == 2
+	assert flow.metrics()['read']['in_flight'] == 0
+
+def test_async_transport_retries_above_the_controller(server):
+	user_id = server.state.add_user("alice", "password1")
+	asyncio = pytest.importorskip('asyncio')
+	pytest.importorskip('aiohttp')
+	from subtext.aio import AsyncSubtext
+	requests = _failing(server, (503, 503))
+	flow = _controller()
+	async def main():
+		async with AsyncSubtext(server.url, flow_control=flow, backoff_factor=0.01) as client:
+			return await client.user.query_id_by_name("alice")
+	assert asyncio.run(main()) == str(user_id)
+	assert len(requests) == 3
+	assert flow.metrics()['read']['overloads'] == 2
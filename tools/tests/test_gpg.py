@@ -0,0 +1,36 @@
+import shutil
+import pytest
+
+from subtext.gpg import GPGPipeline, GPGError, generate_key, _kill_agent
+
+pytestmark = pytest.mark.skipif(shutil.which('gpg') is None, reason="needs gpg")
+
+@pytest.fixture(scope='module')
+def keyring(tmp_path_factory):
+	homedir = str(tmp_path_factory.mktemp('gnupg'))
+	fingerprint = generate_key(homedir, 'Test <test@example.com>')
+	yield homedir, fingerprint
+	_kill_agent('gpg', homedir)
+
+def test_round_trip(keyring):
+	homedir, fingerprint = keyring
+	plaintexts = [bytes([i]) * (i * 100 + 1) for i in range(7)]
+	with GPGPipeline(homedir, processes=2, batch_size=3) as pipeline:
+		ciphertexts = pipeline.encrypt(plaintexts, [fingerprint])
+		assert all(plaintext not in ciphertext for plaintext, ciphertext in zip(plaintexts[1:], ciphertexts[1:]))
+		contents = ciphertexts[:3] + [None, b'not a message'] + ciphertexts[3:]
+		assert pipeline.decrypt(contents) == plaintexts[:3] + [None, None] + plaintexts[3:]
+		with pytest.raises(GPGError):
+			pipeline.decrypt(contents, strict=True)
+		with pytest.raises(ValueError):
+			pipeline.encrypt(plaintexts, [])
+
+def test_board_round_trip(server, client, alice, keyring):
+	homedir, fingerprint = keyring
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	plaintexts = [b'message %d' % i for i in range(5)]
+	with GPGPipeline(homedir, processes=2, copy_keyring=False) as pipeline:
+		pipeline.post_messages(session_id, client.board, board_id, plaintexts, [fingerprint])
+		pages = list(pipeline.iter_board(session_id, client.board, board_id))
+	assert sorted(plaintext for page in pages for message, plaintext in page) == plaintexts
@@ -0,0 +1,52 @@
+import pytest
+
+from subtext import Subtext, APIError, HTTPCache
+
+def test_unchanged_responses_are_replayed_from_304s(server, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	cache = HTTPCache()
+	with Subtext(server.url, http_cache=cache) as client:
+		board = client.board.get(session_id, board_id)
+		assert client.board.get(session_id, board_id) == board
+		assert (cache.hits, cache.misses) == (1, 1)
+		
+		client.board.post_message(session_id, board_id, b'hello')
+		assert client.board.get(session_id, board_id)['lastUpdate'] != board['lastUpdate']
+		assert (cache.hits, cache.misses) == (1, 2)
+
+def test_member_list_changes_with_its_members(server, alice):
+	user_id, session_id = alice
+	bob_id = server.state.add_user("bob_the_user", "password2")
+	board_id = server.state.add_board(user_id, "board")
+	cache = HTTPCache()
+	with Subtext(server.url, http_cache=cache) as client:
+		assert len(client.board.get_members(session_id, board_id)) == 1
+		assert len(client.board.get_members(session_id, board_id)) == 1
+		client.board.add_member(session_id, board_id, bob_id)
+		assert len(client.board.get_members(session_id, board_id)) == 2
+		assert (cache.hits, cache.misses) == (1, 2)
+
+def test_entries_survive_restarts(server, alice, tmp_path):
+	user_id, session_id = alice
+	path = str(tmp_path / 'http.db')
+	with Subtext(server.url, http_cache=path) as client:
+		user = client.user.get(session_id, user_id)
+	cache = HTTPCache(path=path)
+	with Subtext(server.url, http_cache=cache) as client:
+		assert client.user.get(session_id, user_id) == user
+	assert cache.hits == 1
+	cache.close()
+
+def test_lost_access_invalidates(server, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	cache = HTTPCache()
+	with Subtext(server.url, http_cache=cache) as client:
+		client.board.get(session_id, board_id)
+		assert len(cache.entries) == 1
+		server.state.members[board_id].clear()
+		with pytest.raises(APIError) as info:
+			client.board.get(session_id, board_id)
+		assert info.value.status_code == 403
+		assert len(cache.entries) == 0
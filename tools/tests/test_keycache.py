@@ -0,0 +1,57 @@
+import time
+
+from subtext.keycache import KeyCache
+
+def _keys(server, user_id, count):
+	return [str(server.state.add_key(user_id, bytes([i]) * 64)) for i in range(count)]
+
+def test_lru_evicts_the_least_recently_used(server, client, alice):
+	user_id, session_id = alice
+	keys = _keys(server, user_id, 3)
+	cache = KeyCache(client.key, client.user, max_entries=2)
+	cache.get(keys[0])
+	cache.get(keys[1])
+	assert cache.get(keys[0]) == bytes([0]) * 64
+	cache.get(keys[2])
+	assert list(cache.entries) == [keys[0], keys[2]]
+	assert (cache.hits, cache.misses) == (1, 3)
+	cache.get(keys[1])
+	assert cache.misses == 4
+
+def test_ttl_and_publish_time_refetch(server, client, alice):
+	user_id, session_id = alice
+	key_id, = _keys(server, user_id, 1)
+	cache = KeyCache(client.key, client.user, ttl=0.05)
+	cache.get(key_id)
+	cache.get(key_id)
+	assert (cache.hits, cache.misses) == (1, 1)
+	time.sleep(0.1)
+	cache.get(key_id)
+	assert cache.misses == 2
+	cache.get(key_id, "2000-01-01T00:00:00")
+	assert cache.misses == 3
+
+def test_user_keys_download_only_new_keys(server, client, alice):
+	user_id, session_id = alice
+	keys = _keys(server, user_id, 2)
+	cache = KeyCache(client.key, client.user)
+	assert set(cache.get_user_keys(session_id, user_id)) == set(keys)
+	keys += _keys(server, user_id, 1)
+	assert set(cache.get_user_keys(session_id, user_id)) == set(keys)
+	assert cache.misses == 3
+
+def test_entries_persist_across_instances(server, client, alice, tmp_path):
+	user_id, session_id = alice
+	key_id, = _keys(server, user_id, 1)
+	path = str(tmp_path / 'keys.db')
+	cache = KeyCache(client.key, client.user, path=path)
+	cache.get(key_id)
+	cache.close()
+	
+	server.state.keys.clear()
+	cache = KeyCache(client.key, client.user, path=path)
+	assert cache.get(key_id) == bytes([0]) * 64
+	assert (cache.hits, cache.misses) == (1, 0)
+	cache.invalidate(key_id)
+	cache.close()
+	assert KeyCache(client.key, client.user, path=path).db.execute("SELECT COUNT(*) FROM keys").fetchone() == (0,)
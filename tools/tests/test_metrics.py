@@ -0,0 +1,49 @@
+import asyncio, io
+
+from subtext.aio import AsyncSubtext
+from subtext.metrics import HistogramCollector, prometheus_text
+
+ENDPOINT = '/Subtext/board/{}/messages'
+
+def _posted(collector):
+	return [row for row in collector.summary() if row['method'] == 'POST' and row['endpoint'] == ENDPOINT]
+
+def test_byte_counts_of_buffered_and_streamed_bodies(server, client, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	collector = HistogramCollector()
+	client.instrumentation.add_hook(collector)
+	client.board.post_message(session_id, board_id, b'x' * 100)
+	client.board.post_message(session_id, board_id, memoryview(b'y' * 200000))
+	client.board.post_message(session_id, board_id, io.BytesIO(b'z' * 300))
+	client.board.get_messages(session_id, board_id)
+	row, = _posted(collector)
+	assert row['count'] == 3
+	assert row['bytes_out'] == 100 + 200000 + 300
+	assert collector.requests[('POST', ENDPOINT, 201)] == 3
+	get, = [row for row in collector.summary() if row['method'] == 'GET' and row['endpoint'] == ENDPOINT]
+	assert get['bytes_in'] > 300
+	assert 'subtext_client_request_duration_seconds_count' in prometheus_text(collector)
+
+def test_errors_are_counted(server, client):
+	collector = HistogramCollector()
+	client.instrumentation.add_hook(collector)
+	user_id = server.state.add_user("alice", "password1")
+	try:
+		client.user.login(user_id, "wrong")
+	except Exception:
+		pass
+	assert collector.errors == {('POST', '/Subtext/user/login', 'AuthError'): 1}
+
+def test_async_byte_counts_of_streamed_bodies(server, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	collector = HistogramCollector()
+	async def main():
+		async with AsyncSubtext(server.url) as subtext:
+			subtext.instrumentation.add_hook(collector)
+			await subtext.board.post_message(session_id, board_id, b'x' * 100)
+			await subtext.board.post_message(session_id, board_id, memoryview(b'y' * 200000), progress=lambda sent, total: None)
+	asyncio.run(main())
+	row, = _posted(collector)
+	assert row['bytes_out'] == 100 + 200000
@@ -0,0 +1,31 @@
+from uuid import UUID, uuid4
+
+from subtext.models import MessagePage
+
+def test_message_page_keeps_timestamps_as_sent():
+	stamp = '2020-05-01T12:34:56.1234567'
+	page = MessagePage([{'id': str(uuid4()), 'timestamp': stamp, 'authorId': None, 'isSystem': False, 'type': 'Message', 'content': 'aGk='}])
+	assert page[0]['timestamp'] == stamp
+	assert page[-1:][0]['timestamp'] == stamp
+	assert page[0].to_dict()['timestamp'] == stamp
+	assert page[0].timestamp.microsecond == 123456
+	assert page[0].content == b'hi'
+
+def test_message_page_decodes_fields_on_access():
+	message_id, author_id = uuid4(), uuid4()
+	raw = [
+		{'id': str(message_id), 'timestamp': '2020-05-01T12:00:00', 'authorId': str(author_id), 'isSystem': True, 'type': 'Key', 'content': None},
+		{'id': str(uuid4()), 'timestamp': '2020-05-01T12:00:01.5', 'authorId': None, 'isSystem': False, 'type': 'Message', 'content': 'aGk='},
+	]
+	page = MessagePage(raw)
+	assert page[0].id == message_id and page[0].author_id == author_id
+	assert page[1].author_id is None
+	assert page[0].is_system and page[0].type == 'Key' and not page[0].has_content
+	assert [message.to_dict() for message in page] == raw
+	assert dict(page[0]._raw) == raw[0]
+	assert page.ids() == [message_id, UUID(raw[1]['id'])]
+	assert page.missing_content() == [0]
+	assert page.timestamps()[1] - page.timestamps()[0] == 1.5
+	page.append(raw[0])
+	assert len(page.timestamps()) == 3
+	assert page[1:][0].content == b'hi'
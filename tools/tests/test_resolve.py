@@ -0,0 +1,45 @@
+from uuid import UUID
+
+from subtext import NameResolver
+
+def test_resolve_caches_names_and_misses(server, client, alice):
+	user_id, session_id = alice
+	resolver = NameResolver(client.user)
+	assert resolver.resolve("alice") == user_id
+	assert resolver.resolve("alice") == user_id
+	assert resolver.resolve("nobody") is None
+	assert resolver.resolve("nobody") is None
+	assert resolver.stats() == {'entries': 2, 'hits': 1, 'negative_hits': 1, 'misses': 2}
+	resolver.close()
+
+def test_resolve_many(server, client, alice):
+	names = ["user{}x".format(i) for i in range(20)]
+	ids = {name: server.state.add_user(name, "password") for name in names}
+	with NameResolver(client.user, max_workers=4) as resolver:
+		assert resolver.resolve_many(names + ["nobody"]) == dict(ids, nobody=None)
+		assert resolver.stats()['misses'] == 21
+
+def test_creating_a_user_drops_the_cached_miss(client):
+	with NameResolver(client.user, negative_ttl=300) as resolver:
+		assert resolver.resolve("carol") is None
+		carol = UUID(str(client.user.create("carol", "password3")))
+		assert resolver.resolve("carol") == carol
+
+def test_deleting_a_user_drops_its_name(client, alice):
+	with NameResolver(client.user) as resolver:
+		carol = UUID(str(client.user.create("carol", "password3")))
+		assert resolver.resolve("carol") == carol
+		session_id = client.user.login(carol, "password3")
+		client.user.delete(session_id, carol, "password3")
+		# The server renames deleted users, so the name is free again
+		assert resolver.resolve("carol") is None
+
+def test_invalidate(server, client, alice):
+	user_id, session_id = alice
+	with NameResolver(client.user) as resolver:
+		resolver.resolve("alice")
+		resolver.invalidate_id(user_id)
+		assert resolver.stats()['entries'] == 0
+		resolver.resolve("alice")
+		resolver.invalidate()
+		assert resolver.stats()['entries'] == 0
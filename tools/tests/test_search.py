@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import pytest
+
+from subtext import SearchIndex
+
+BASE = datetime(2024, 1, 1)
+
+@pytest.fixture
+def indexed(server, client, alice):
+	"""
+	A board of five messages, fetched from the stub and indexed.
+	"""
+	user_id, session_id = alice
+	bob_id = server.state.add_user("bob_the_user", "password2")
+	board_id = server.state.add_board(user_id, "board", members=(bob_id,))
+	texts = [
+		(user_id, "the quick brown fox"),
+		(bob_id, "a lazy dog sleeps"),
+		(user_id, "fox fox fox, all foxes"),
+		(bob_id, "quick thinking"),
+		(user_id, "nothing to see"),
+	]
+	for i, (author, text) in enumerate(texts):
+		server.state.add_message(board_id, author, text.encode(), timestamp=BASE + timedelta(hours=i))
+	index = SearchIndex()
+	assert index.ingest(board_id, client.board.get_messages(session_id, board_id)) == 5
+	yield index, board_id, user_id, bob_id
+	index.close()
+
+def test_ingest_is_idempotent(client, alice, indexed):
+	index, board_id, user_id, bob_id = indexed
+	assert index.ingest(board_id, client.board.get_messages(alice[1], board_id)) == 0
+	assert index.count() == index.count(board_id) == 5
+
+def test_ranking_and_snippets(indexed):
+	index, board_id, user_id, bob_id = indexed
+	hits = index.search("fox")
+	assert len(hits) == 2
+	assert hits[0].snippet.count('[fox]') == 3
+	assert hits[0].score > hits[1].score
+	assert [hit.snippet for hit in index.search("fox*")][0].count('[') == 4
+
+def test_filters(indexed):
+	index, board_id, user_id, bob_id = indexed
+	assert [hit.author_id for hit in index.search("quick", author_id=bob_id)] == [str(bob_id)]
+	assert len(index.search("quick", board_id=board_id)) == 2
+	assert index.search("quick", board_id=user_id) == []
+	hits = index.search("quick", since=BASE + timedelta(hours=1), until=BASE + timedelta(hours=4))
+	assert [hit.timestamp.hour for hit in hits] == [3]
+	assert len(index.search("quick", limit=1)) == len(index.search("quick", limit=1, offset=1)) == 1
+
+def test_query_syntax(indexed):
+	index, board_id, user_id, bob_id = indexed
+	assert index.search('fox"') != []
+	assert index.search("dog OR see") == []
+	assert len(index.search("dog OR see", raw=True)) == 2
+	assert index.search("   ") == []
+
+def test_remove(indexed):
+	index, board_id, user_id, bob_id = indexed
+	index.remove(index.search("dog")[0].message_id)
+	assert index.search("dog") == []
+	index.remove_board(board_id)
+	assert index.count() == 0
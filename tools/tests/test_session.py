@@ -0,0 +1,48 @@
+from datetime import timedelta
+from uuid import uuid4
+import pytest
+
+from subtext import APIError
+from subtext.session import SessionManager, UserSessionManager
+
+@pytest.fixture
+def sessions(server, client):
+	user_id = server.state.add_user("alice", "password1")
+	return user_id, UserSessionManager(client.user, user_id, "password1")
+
+def test_session_manager_is_abstract():
+	with pytest.raises(TypeError):
+		SessionManager(900, 60)
+
+def test_relogin_after_expiry(server, client, sessions):
+	user_id, manager = sessions
+	assert manager.call(client.user.get, user_id)['name'] == "alice"
+	session = server.state.sessions[manager.session_id]
+	session['timestamp'] -= server.state.session_duration + timedelta(seconds=1)
+	assert manager.call(client.user.get, user_id)['name'] == "alice"
+	assert manager.logins == 2
+
+def test_relogin_after_the_session_was_reaped(server, client, sessions):
+	user_id, manager = sessions
+	manager.call(client.user.get, user_id)
+	server.state.sessions.clear()
+	assert manager.call(client.user.get, user_id)['name'] == "alice"
+	assert manager.logins == 2
+
+def test_missing_objects_are_not_mistaken_for_a_lost_session(client, sessions):
+	user_id, manager = sessions
+	with pytest.raises(APIError) as info:
+		manager.call(client.user.get, uuid4())
+	assert info.value.status_code == 404
+	assert manager.logins == 1
+
+def test_renew_and_close(server, sessions):
+	user_id, manager = sessions
+	session_id = manager.get()
+	assert manager.renew(force=True) == session_id
+	assert manager.renewals == 1
+	manager.start()
+	assert manager.running
+	manager.close()
+	assert not manager.running
+	assert session_id not in server.state.sessions
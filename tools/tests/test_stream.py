@@ -0,0 +1,36 @@
+import io
+from uuid import UUID
+import pytest
+
+from subtext.common import _stream_body
+
+def _chunks():
+	for i in range(4):
+		yield bytes([i]) * 1000
+
+@pytest.mark.parametrize('make', (
+	lambda data: data,
+	lambda data: memoryview(data),
+	lambda data: io.BytesIO(data),
+	lambda data: _chunks(),
+), ids=('bytes', 'memoryview', 'file', 'iterable'))
+def test_post_message_streams_every_body_type(server, client, alice, make):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	data = b''.join(_chunks())
+	progress = []
+	client.board.post_message(session_id, board_id, make(data), progress=lambda sent, total: progress.append((sent, total)))
+	assert [msg['content'] for msg in server.state.messages[board_id]] == [data]
+	assert progress[-1][0] == len(data)
+
+def test_add_key_streams_from_a_file(server, client, alice):
+	user_id, session_id = alice
+	key_id = client.user.add_key(session_id, user_id, io.BytesIO(b'key' * 50000))
+	assert server.state.keys[UUID(key_id)]['keyData'] == b'key' * 50000
+
+def test_stream_body_chunks_and_reports_progress():
+	progress = []
+	chunks = list(_stream_body(memoryview(b'x' * 10), lambda sent, total: progress.append((sent, total)), chunk_size=4))
+	assert [bytes(chunk) for chunk in chunks] == [b'xxxx', b'xxxx', b'xx']
+	assert progress == [(4, 10), (8, 10), (10, 10)]
+	assert _stream_body(b'raw') == b'raw'
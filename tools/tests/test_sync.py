@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+import pytest
+
+from subtext import Subtext, BoardSync
+
+@pytest.mark.parametrize('typed', (False, True))
+def test_sync_drops_messages_at_the_inclusive_cursor(server, typed):
+	state = server.state
+	user_id = state.add_user("alice", "password1")
+	board_id = state.add_board(user_id, "board")
+	stamp = datetime(2024, 1, 1, 12, 0, 0, 123456)
+	first = {str(state.add_message(board_id, user_id, b'a', timestamp=stamp)) for _ in range(2)}
+	with Subtext(server.url, typed=typed) as client:
+		session_id = client.user.login(user_id, "password1")
+		sync = BoardSync(client.board)
+		assert {str(msg['id']) for msg in sync.sync(session_id, board_id)} == first
+		# sinceTime is inclusive, so the server sends the messages at the
+		# cursor again
+		assert sync.sync(session_id, board_id) == []
+		late = state.add_message(board_id, user_id, b'b', timestamp=stamp)
+		newer = state.add_message(board_id, user_id, b'c', timestamp=stamp + timedelta(seconds=1))
+		assert [str(msg['id']) for msg in sync.sync(session_id, board_id)] == [str(late), str(newer)]
+		assert sync.sync(session_id, board_id) == []
+
+def test_sync_pages_through_a_delta(server, client, alice):
+	user_id, session_id = alice
+	board_id = server.state.add_board(user_id, "board")
+	start = datetime(2024, 1, 1)
+	for i in range(25):
+		server.state.add_message(board_id, user_id, b'x', timestamp=start + timedelta(seconds=i))
+	sync = BoardSync(client.board, page_size=10)
+	messages = sync.sync(session_id, board_id)
+	assert len(messages) == 25
+	assert len({msg['id'] for msg in messages}) == 25
@@ -0,0 +1,25 @@
+from subtext import BoardWatcher
+
+def test_only_owned_check_does_not_remove_other_boards(server, client, alice):
+	user_id, session_id = alice
+	bob = server.state.add_user("bobby", "password2")
+	owned = server.state.add_board(user_id, "owned")
+	joined = server.state.add_board(bob, "joined", members=(user_id,))
+	watcher = BoardWatcher(client.board)
+	assert {(change.board_id, change.kind) for change in watcher.check(session_id)} == {(str(owned), 'new'), (str(joined), 'new')}
+	assert watcher.check(session_id, only_owned=True) == []
+	assert watcher.check(session_id) == []
+
+def test_check_reports_changes(server, client, alice):
+	user_id, session_id = alice
+	busy = server.state.add_board(user_id, "busy")
+	left = server.state.add_board(user_id, "left")
+	watcher = BoardWatcher(client.board)
+	watcher.check(session_id)
+	server.state.add_message(busy, user_id, b'hi')
+	server.state.members[left].discard(user_id)
+	changes = watcher.check(session_id, acknowledge=False)
+	assert [(change.board_id, change.kind) for change in changes] == [(str(busy), 'significant'), (str(left), 'removed')]
+	# Not acknowledged, so reported again
+	assert len(watcher.check(session_id)) == 2
+	assert watcher.check(session_id) == []